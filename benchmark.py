@@ -1,15 +1,18 @@
-import cv2
-import torch
+import argparse
+import os
+import sys
 import numpy as np
 import tenseal as ts
 import time
 import csv
 import logging
-from facenet_pytorch import InceptionResnetV1, MTCNN
 from itertools import combinations
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+from face_processing import get_face_embeddings
+
 # ==================== VALIDATED CONFIGURATION ====================
-IMG_SIZE = 160
+# he_tuner.py derives overflow-safe sets for a given SCALE_FACTOR and security level
 SCALE_FACTOR = 1000
 NUM_TRIALS = 5
 IMAGE_FILES = [f"../input{i}.jpg" for i in range(1,9)]  # Assuming images are named from image0.jpg to image9.jpg
@@ -33,34 +36,28 @@ PARAM_SETS = [
     
 ]
 
+# Column layout of the committed he_performance.csv
+SUMMARY_FIELDS = ['polydegree_modulus', 'plain_modulus', 'setup', 'encrypt', 'compute', 'decrypt', 'total']
+
+# Template encodings compared by --compact-report: (projection, template dim, bits)
+COMPACT_CONFIGS = [
+    ("dense", None, 0),
+    ("reduced", 256, 16),
+    ("reduced", 128, 16),
+    ("reduced", 256, 8),
+    ("reduced", 128, 8),
+    ("reduced", 64, 8),
+]
+REPORT_SEED = "123456"
+
+# "rotate" sums homomorphically (needs Galois keys), "slotwise" sums after decryption
+DISTANCE_MODES = ["rotate", "slotwise"]
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("HEPerfTest")
 
-# Initialize face processing models
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-facenet = InceptionResnetV1(pretrained='vggface2').eval().to(device)
-mtcnn = MTCNN(image_size=IMG_SIZE, margin=20, device=device)
-
-def get_face_embedding(image_path):
-    """Robust face embedding extraction with error handling"""
-    try:
-        img = cv2.cvtColor(cv2.imread(image_path), cv2.COLOR_BGR2RGB)
-        if img is None:
-            raise ValueError("Image load failed")
-            
-        face = mtcnn(img)
-        if face is None:
-            raise ValueError("No face detected")
-            
-        with torch.no_grad():
-            return facenet(face.unsqueeze(0).to(device)).cpu().numpy().flatten()
-            
-    except Exception as e:
-        logger.error(f"Face processing error: {str(e)}")
-        raise
-
-def create_he_context(poly_degree, plain_modulus):
+def create_he_context(poly_degree, plain_modulus, galois_keys=True):
     """Create validated HE context with batching support"""
     context = ts.context(
         ts.SCHEME_TYPE.BFV,
@@ -68,17 +65,24 @@ def create_he_context(poly_degree, plain_modulus):
         plain_modulus=plain_modulus,
         # coeff_mod_bit_sizes=coeff_mod_bit_sizes
     )
-    context.generate_galois_keys()
+    if galois_keys:
+        context.generate_galois_keys()
     return context
 
-def time_he_operations(params, emb1, emb2):
-    """Benchmark HE operations with error handling"""
+def time_he_operations(params, emb1, emb2, distance_mode="rotate", scale=SCALE_FACTOR):
+    """Benchmark HE operations with error handling.
+
+    Returns ``(timings_ms, bundle_bytes)``; ``load`` is the context
+    deserialization an authentication pays when it opens a bundle. Pass
+    ``scale=1`` for vectors that are already integer-encoded.
+    """
     times = {
-        'setup': [], 'encrypt': [], 'compute': [], 'decrypt': []
+        'setup': [], 'load': [], 'encrypt': [], 'compute': [], 'decrypt': []
     }
+    bundle_bytes = 0
     
-    scaled1 = (emb1 * SCALE_FACTOR).astype(np.int64)
-    scaled2 = (emb2 * SCALE_FACTOR).astype(np.int64)
+    scaled1 = (emb1 * scale).astype(np.int64)
+    scaled2 = (emb2 * scale).astype(np.int64)
     
     for _ in range(NUM_TRIALS):
         try:
@@ -86,103 +90,230 @@ def time_he_operations(params, emb1, emb2):
             start = time.perf_counter()
             context = create_he_context(
                 params['poly_degree'],
-                params['plain_modulus']
+                params['plain_modulus'],
+                galois_keys=distance_mode == "rotate"
             )
             times['setup'].append(time.perf_counter() - start)
+
+            # Context (de)serialization, as stored in and read from a bundle
+            serialized_context = context.serialize(save_secret_key=True)
+            start = time.perf_counter()
+            context = ts.context_from(serialized_context)
+            times['load'].append(time.perf_counter() - start)
             
             # Encryption
             start = time.perf_counter()
             enc1 = ts.bfv_vector(context, scaled1)
             enc2 = ts.bfv_vector(context, scaled2)
             times['encrypt'].append(time.perf_counter() - start)
+            bundle_bytes = len(serialized_context) + len(enc1.serialize())
             
             # Computation
             start = time.perf_counter()
             diff = enc1 - enc2
             squared = diff * diff
-            encrypted_dist = squared.sum()
+            encrypted_dist = squared.sum() if distance_mode == "rotate" else squared
             times['compute'].append(time.perf_counter() - start)
             
             # Decryption
             start = time.perf_counter()
             raw_dist = encrypted_dist.decrypt()
-            if isinstance(raw_dist, list):
-                raw_dist = raw_dist[0]
-            if raw_dist < 0:
-                raw_dist += params["plain_modulus"]  
-            distance = np.sqrt(abs(raw_dist)) / SCALE_FACTOR
+            if not isinstance(raw_dist, list):
+                raw_dist = [raw_dist]
+            raw_dist = sum(v + params["plain_modulus"] if v < 0 else v for v in raw_dist)
+            distance = np.sqrt(abs(raw_dist)) / scale
             times['decrypt'].append(time.perf_counter() - start)
             
         except Exception as e:
             logger.error(f"Operation failed: {str(e)}")
             return None
     
-    return {k: 1000 * sum(v) / NUM_TRIALS for k, v in times.items()}
+    return {k: 1000 * sum(v) / NUM_TRIALS for k, v in times.items()}, bundle_bytes
 
-def run_performance_tests():
-    """Main benchmarking workflow"""
+def load_embeddings():
     logger.info("Loading sample embeddings...")
     try:
-        # Load embeddings for all images
-        embeddings = {}
-        for img_file in IMAGE_FILES:
-            embeddings[img_file] = get_face_embedding(img_file)
-        
+        # Load embeddings for all images in one batched pass
+        batch, failures = get_face_embeddings(IMAGE_FILES)
+        if failures:
+            raise ValueError(f"{len(failures)} image(s) had no usable face")
+        return dict(zip(IMAGE_FILES, batch))
     except Exception as e:
         logger.error(f"Failed to load embeddings: {str(e)}")
+        return None
+
+def _ranks(values):
+    return np.argsort(np.argsort(values)).astype(float)
+
+def run_compact_report():
+    """Accuracy vs. HE cost of the compact template encodings.
+
+    Every image pair is compared the way an authentication would: the first
+    image is the enrolled template whose encoding is calibrated, the second
+    the probe. Distances are computed on the encoded integers, which is what
+    the HE pipeline decrypts, and compared with the embedding distance
+    scaled by 1/sqrt(EMBEDDING_SIZE), the norm every projection targets.
+    Each row uses the smallest poly degree whose parameters decrypt the
+    worst case correctly.
+    """
+    embeddings = load_embeddings()
+    if embeddings is None:
+        return
+    # Needs the HE env (.env), unlike the parameter sweep
+    from encryption import (
+        EMBEDDING_SIZE,
+        TemplateEncoding,
+        apply_user_specific_projection,
+        projected_length,
+        projection_gain,
+    )
+    from he_tuner import batching_primes, test_vectors, validate
+
+    pairs = list(combinations(IMAGE_FILES, 2))
+    reference = np.array([np.linalg.norm(embeddings[a] - embeddings[b]) for a, b in pairs]) / np.sqrt(EMBEDDING_SIZE)
+
+    rows = []
+    for projection, dim, bits in COMPACT_CONFIGS:
+        projected = {img: apply_user_specific_projection(emb, REPORT_SEED, projection, dim)
+                     for img, emb in embeddings.items()}
+        distances, encoded = [], None
+        for a, b in pairs:
+            encoding = TemplateEncoding.calibrate(projected[a], projection, bits, dim)
+            encoded = (encoding.encode(projected[a]), encoding.encode(projected[b]))
+            distances.append(encoding.distance(int(np.sum((encoded[0] - encoded[1]) ** 2))))
+        distances = np.array(distances)
+
+        length = projected_length(projection, dim=dim)
+        qmax = (1 << (bits - 1)) - 1 if bits else None
+        bound = length * (2 * qmax) ** 2 if bits else TemplateEncoding(projection, dim=dim).bound()
+        vectors = test_vectors(length, SCALE_FACTOR * projection_gain(projection, dim=dim), 2,
+                               np.random.default_rng(0), qmax)
+        params = None
+        for poly_degree in (4096, 8192, 16384):
+            if poly_degree < length:
+                continue
+            candidate = {'poly_degree': poly_degree, 'plain_modulus': batching_primes(poly_degree, bound, 1)[0],
+                         'coeff_mod_bit_sizes': []}
+            if validate(candidate, "rotate", vectors):
+                params = candidate
+                break
+        measured = params and time_he_operations(params, *encoded, scale=1)
+        if not measured:
+            logger.error(f"No working parameters for {projection}/{dim}/{bits}")
+            continue
+        timings, bundle_bytes = measured
+        rows.append({
+            'projection': projection,
+            'template_dim': length,
+            'bits': bits or f"s={SCALE_FACTOR}",
+            'mean_rel_error': float(np.mean(np.abs(distances - reference) / reference)),
+            'rank_corr': float(np.corrcoef(_ranks(distances), _ranks(reference))[0, 1]),
+            'plain_modulus_bits': params['plain_modulus'].bit_length(),
+            'poly_degree': params['poly_degree'],
+            'templates_per_ciphertext': params['poly_degree'] // length,
+            'auth_ms': timings['load'] + timings['encrypt'] + timings['compute'] + timings['decrypt'],
+            'bundle_bytes': bundle_bytes,
+        })
+
+    with open('compact_report.csv', 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+    print("\n📊 Template encoding: accuracy vs. cost")
+    print(f"{'Projection':<10} | {'Dim':>4} | {'Bits':>7} | {'Rel. error':>10} | {'Rank corr':>9} | "
+          f"{'t bits':>6} | {'Poly':>5} | {'Per ctxt':>8} | {'Auth ms':>8} | Bundle bytes")
+    for row in rows:
+        print(f"{row['projection']:<10} | {row['template_dim']:>4} | {row['bits']:>7} | "
+              f"{row['mean_rel_error']:>10.4f} | {row['rank_corr']:>9.4f} | {row['plain_modulus_bits']:>6} | "
+              f"{row['poly_degree']:>5} | {row['templates_per_ciphertext']:>8} | {row['auth_ms']:>8.1f} | "
+              f"{row['bundle_bytes']:>12}")
+
+def run_performance_tests():
+    """Main benchmarking workflow"""
+    embeddings = load_embeddings()
+    if embeddings is None:
         return
 
     results = []
     
     # Loop over all possible pairs of images
     for params in PARAM_SETS:
-        logger.info(f"\n🔧 Testing poly_degree={params['poly_degree']}...")
-        try:
-            # Iterate over all unique pairs of images
-            for img1, img2 in combinations(IMAGE_FILES, 2):
-                emb1, emb2 = embeddings[img1], embeddings[img2]
-                timings = time_he_operations(params, emb1, emb2)
-                
-                if timings:
-                    # Add individual entry for each operation
-                    results.append({
-                        'input_images': f"{img1},{img2}",
-                        'poly_degree': params['poly_degree'],
-                        **timings,
-                        'total_ms': sum(timings.values())
-                    })
+        for distance_mode in DISTANCE_MODES:
+            logger.info(f"\n🔧 Testing poly_degree={params['poly_degree']}, mode={distance_mode}...")
+            try:
+                # Iterate over all unique pairs of images
+                for img1, img2 in combinations(IMAGE_FILES, 2):
+                    emb1, emb2 = embeddings[img1], embeddings[img2]
+                    measured = time_he_operations(params, emb1, emb2, distance_mode)
+                    
+                    if measured:
+                        timings, bundle_bytes = measured
+                        # Add individual entry for each operation
+                        results.append({
+                            'input_images': f"{img1},{img2}",
+                            'poly_degree': params['poly_degree'],
+                            'plain_modulus': params['plain_modulus'],
+                            'distance_mode': distance_mode,
+                            **timings,
+                            'total_ms': sum(timings.values()),
+                            'bundle_bytes': bundle_bytes
+                        })
 
-        except Exception as e:
-            logger.error(f"Test failed: {str(e)}")
+            except Exception as e:
+                logger.error(f"Test failed: {str(e)}")
     
-    # Calculate averages
-    if results:
-        avg_result = {
-            'input_images': 'average',
-            'poly_degree': sum(r['poly_degree'] for r in results) / len(results),
-            'setup': sum(r['setup'] for r in results) / len(results),
-            'encrypt': sum(r['encrypt'] for r in results) / len(results),
-            'compute': sum(r['compute'] for r in results) / len(results),
-            'decrypt': sum(r['decrypt'] for r in results) / len(results),
-            'total_ms': sum(r['total_ms'] for r in results) / len(results)
-        }
+    # Calculate averages per distance mode so the modes can be compared
+    for distance_mode in DISTANCE_MODES:
+        mode_results = [r for r in results if r['distance_mode'] == distance_mode]
+        if not mode_results:
+            continue
+        avg_result = {'input_images': 'average', 'distance_mode': distance_mode, 'plain_modulus': ''}
+        for key in ['poly_degree', 'setup', 'load', 'encrypt', 'compute', 'decrypt', 'total_ms', 'bundle_bytes']:
+            avg_result[key] = sum(r[key] for r in mode_results) / len(mode_results)
         results.append(avg_result)
 
-    # Save results to CSV
+    # he_performance.csv keeps its committed layout: one averaged row per
+    # parameter set for the default "rotate" mode. Per-pair rows and the
+    # other modes go to he_performance_detailed.csv.
     if results:
         with open('he_performance.csv', 'w', newline='') as f:
-            fieldnames = ['input_images', 'poly_degree', 'setup', 'encrypt', 'compute', 'decrypt', 'total_ms']
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            writer = csv.writer(f)
+            writer.writerow(SUMMARY_FIELDS)
+            for params in PARAM_SETS:
+                rows = [r for r in results if r['input_images'] != 'average'
+                        and r['distance_mode'] == 'rotate'
+                        and r['poly_degree'] == params['poly_degree']
+                        and r['plain_modulus'] == params['plain_modulus']]
+                if not rows:
+                    continue
+                averages = [round(sum(r[key] for r in rows) / len(rows), 2)
+                            for key in ['setup', 'encrypt', 'compute', 'decrypt']]
+                writer.writerow([params['poly_degree'], params['plain_modulus'], *averages,
+                                 round(sum(averages), 2)])
+
+        with open('he_performance_detailed.csv', 'w', newline='') as f:
+            fieldnames = ['input_images', 'poly_degree', 'plain_modulus', 'distance_mode', 'setup', 'load',
+                          'encrypt', 'compute', 'decrypt', 'total_ms', 'bundle_bytes']
+            writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction='ignore')
             writer.writeheader()
             writer.writerows(results)
         
         print("\n📊 Validated Performance Results (ms)")
-        print(f"{'Input Images':<20} | {'Poly Degree':<12} | {'Setup':<8} | {'Encrypt':<8} | {'Compute':<8} | {'Decrypt':<8} | Total")
+        print(f"{'Input Images':<20} | {'Poly Degree':<12} | {'Mode':<8} | {'Setup':<8} | {'Load':<8} | "
+              f"{'Encrypt':<8} | {'Compute':<8} | {'Decrypt':<8} | {'Total':<8} | Bundle bytes")
         for res in results:
-            print(f"{res['input_images']:<20} | {res['poly_degree']:<12.1f} | "
-                  f"{res['setup']:>7.1f} | {res['encrypt']:>8.1f} | "
+            print(f"{res['input_images']:<20} | {res['poly_degree']:<12.1f} | {res['distance_mode']:<8} | "
+                  f"{res['setup']:>7.1f} | {res['load']:>7.1f} | {res['encrypt']:>8.1f} | "
                   f"{res['compute']:>8.1f} | {res['decrypt']:>8.1f} | "
-                  f"{res['total_ms']:>7.1f}")
+                  f"{res['total_ms']:>7.1f} | {res['bundle_bytes']:>12.0f}")
 
 if __name__ == "__main__":
-    run_performance_tests()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="HE performance benchmarks")
+    parser.add_argument("--compact-report", action="store_true",
+                        help="compare compact template encodings instead of sweeping PARAM_SETS")
+    args = parser.parse_args()
+    if args.compact_report:
+        run_compact_report()
+    else:
+        run_performance_tests()
\ No newline at end of file
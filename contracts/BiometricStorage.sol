@@ -25,6 +25,16 @@ contract BiometricStorage {
         emit IPFSHashStored(uid, ipfsHash);
     }
 
+    // Store many IPFS hashes in one transaction
+    function storeIPFSHashBatch(string[] memory uids, string[] memory ipfsHashes) public onlyOwner {
+        require(uids.length == ipfsHashes.length, "Length mismatch");
+        for (uint256 i = 0; i < uids.length; i++) {
+            require(bytes(userIPFSHashes[uids[i]]).length == 0, "IPFS hash already exists");
+            userIPFSHashes[uids[i]] = ipfsHashes[i];
+            emit IPFSHashStored(uids[i], ipfsHashes[i]);
+        }
+    }
+
     // Retrieve stored IPFS hash
     function getIPFSHash(string memory uid) public view returns (string memory) {
         require(bytes(userIPFSHashes[uid]).length != 0, "No IPFS hash found");
@@ -0,0 +1,74 @@
+// SPDX-License-Identifier: MIT
+pragma solidity ^0.8.0;
+
+// Compact variant of BiometricStorage: the UID is the raw 32-byte SHA-256 from
+// generate_uid and the CID is stored as its 32-byte sha2-256 digest plus a codec
+// byte (1 = CIDv0, otherwise the CIDv1 multicodec, e.g. 0x70 dag-pb, 0x55 raw).
+contract BiometricStorageV2 {
+    struct Record {
+        bytes32 digest;
+        uint8 codec;
+    }
+
+    mapping(bytes32 => Record) private records;
+    // Set on the first store and never cleared, so a revoked UID can be told
+    // apart from one that was never migrated from BiometricStorage
+    mapping(bytes32 => bool) public known;
+    address public owner;
+
+    event IPFSHashStored(bytes32 indexed uid, bytes32 digest, uint8 codec);
+    event IPFSHashUpdated(bytes32 indexed uid, bytes32 digest, uint8 codec);
+    event IPFSHashRevoked(bytes32 indexed uid);
+
+    modifier onlyOwner() {
+        require(msg.sender == owner, "Only owner can perform this action");
+        _;
+    }
+
+    constructor() {
+        owner = msg.sender;
+    }
+
+    function _store(bytes32 uid, bytes32 digest, uint8 codec) private {
+        require(codec != 0, "Invalid codec");
+        require(records[uid].codec == 0, "IPFS hash already exists");
+        records[uid] = Record(digest, codec);
+        known[uid] = true;
+        emit IPFSHashStored(uid, digest, codec);
+    }
+
+    // Store initial IPFS hash
+    function storeIPFSHash(bytes32 uid, bytes32 digest, uint8 codec) public onlyOwner {
+        _store(uid, digest, codec);
+    }
+
+    // Store many IPFS hashes in one transaction
+    function storeIPFSHashBatch(bytes32[] memory uids, bytes32[] memory digests, uint8[] memory codecs) public onlyOwner {
+        require(uids.length == digests.length && uids.length == codecs.length, "Length mismatch");
+        for (uint256 i = 0; i < uids.length; i++) {
+            _store(uids[i], digests[i], codecs[i]);
+        }
+    }
+
+    // Retrieve stored IPFS hash
+    function getIPFSHash(bytes32 uid) public view returns (bytes32, uint8) {
+        Record memory record = records[uid];
+        require(record.codec != 0, "No IPFS hash found");
+        return (record.digest, record.codec);
+    }
+
+    // Update existing IPFS hash with a new one
+    function updateIPFSHash(bytes32 uid, bytes32 digest, uint8 codec) public onlyOwner {
+        require(codec != 0, "Invalid codec");
+        require(records[uid].codec != 0, "No IPFS hash found");
+        records[uid] = Record(digest, codec);
+        emit IPFSHashUpdated(uid, digest, codec);
+    }
+
+    // Completely revoke (delete) the stored IPFS hash
+    function revokeIPFSHash(bytes32 uid) public onlyOwner {
+        require(records[uid].codec != 0, "No IPFS hash found");
+        delete records[uid];
+        emit IPFSHashRevoked(uid);
+    }
+}
@@ -0,0 +1,87 @@
+"""Compares gas used by BiometricStorage and BiometricStorageV2 on a local chain.
+
+Run ``truffle compile`` first, then point WEB3_URL at Ganache/Truffle
+(default http://127.0.0.1:8545) or pass ``--tester`` to use an in-process
+eth-tester chain.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+from web3 import EthereumTesterProvider, Web3
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+from cid_codec import encode_cid, uid_to_bytes32
+
+BUILD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "build", "contracts")
+# A realistic CIDv0 (sha2-256, dag-pb) reused with varying UIDs
+SAMPLE_CID = "QmYwAPJzv5CZsnA625s3Xf2nemtYgPpHdWEz79ojWnPbdG"
+
+
+def deploy(web3, name, account):
+    with open(os.path.join(BUILD_DIR, f"{name}.json")) as f:
+        build = json.load(f)
+    factory = web3.eth.contract(abi=build["abi"], bytecode=build["bytecode"])
+    receipt = web3.eth.wait_for_transaction_receipt(factory.constructor().transact({"from": account}))
+    return web3.eth.contract(address=receipt["contractAddress"], abi=build["abi"]), receipt["gasUsed"]
+
+
+def gas_of(web3, call, account):
+    tx_hash = call.transact({"from": account})
+    return web3.eth.wait_for_transaction_receipt(tx_hash)["gasUsed"]
+
+
+def measure(web3, account, count, batch_size):
+    uids = [hashlib.sha256(f"user-{i}".encode()).hexdigest() for i in range(count + batch_size)]
+    digest, codec = encode_cid(SAMPLE_CID)
+    results = {}
+
+    v1, deploy_v1 = deploy(web3, "BiometricStorage", account)
+    v2, deploy_v2 = deploy(web3, "BiometricStorageV2", account)
+    results["deploy"] = (deploy_v1, deploy_v2)
+
+    store_v1 = [gas_of(web3, v1.functions.storeIPFSHash(uid, SAMPLE_CID), account) for uid in uids[:count]]
+    store_v2 = [gas_of(web3, v2.functions.storeIPFSHash(uid_to_bytes32(uid), digest, codec), account)
+                for uid in uids[:count]]
+    results["store (avg)"] = (sum(store_v1) / count, sum(store_v2) / count)
+
+    results["update"] = (
+        gas_of(web3, v1.functions.updateIPFSHash(uids[0], SAMPLE_CID), account),
+        gas_of(web3, v2.functions.updateIPFSHash(uid_to_bytes32(uids[0]), digest, codec), account),
+    )
+    results["revoke"] = (
+        gas_of(web3, v1.functions.revokeIPFSHash(uids[0]), account),
+        gas_of(web3, v2.functions.revokeIPFSHash(uid_to_bytes32(uids[0])), account),
+    )
+
+    batch = uids[count:]
+    batch_v1 = gas_of(web3, v1.functions.storeIPFSHashBatch(batch, [SAMPLE_CID] * batch_size), account)
+    batch_v2 = gas_of(web3, v2.functions.storeIPFSHashBatch(
+        [uid_to_bytes32(uid) for uid in batch], [digest] * batch_size, [codec] * batch_size), account)
+    results[f"batch of {batch_size} (per pair)"] = (batch_v1 / batch_size, batch_v2 / batch_size)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tester", action="store_true", help="use an in-process eth-tester chain")
+    parser.add_argument("--count", type=int, default=10, help="single stores to average")
+    parser.add_argument("--batch", type=int, default=20, help="pairs in the batch store")
+    args = parser.parse_args()
+
+    if args.tester:
+        web3 = Web3(EthereumTesterProvider())
+    else:
+        web3 = Web3(Web3.HTTPProvider(os.getenv("WEB3_URL", "http://127.0.0.1:8545")))
+    account = web3.eth.accounts[0]
+
+    results = measure(web3, account, args.count, args.batch)
+    print(f"\n⛽ Gas used{'':<24} | {'v1 (string)':>12} | {'v2 (bytes32)':>12} | Saving")
+    for operation, (gas_v1, gas_v2) in results.items():
+        print(f"{operation:<34} | {gas_v1:>12.0f} | {gas_v2:>12.0f} | {100 * (1 - gas_v2 / gas_v1):>5.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+"""Finds the cheapest BFV parameters that cannot overflow the squared distance.
+
+The worst-case decrypted distance follows from SCALE_FACTOR and the
+projection (see ``encryption.squared_distance_bound``). For each poly
+degree with enough slots, the tuner takes the smallest batching primes
+t ≡ 1 (mod 2n) above that bound and a coefficient modulus within the
+homomorphic-encryption standard's limit for the security level. It then
+checks each candidate end to end on worst-case and random vectors (the
+noise budget is not exposed, so a candidate that decrypts wrongly is
+rejected) and benchmarks the rest.
+
+    python he_tuner.py --security 128 --projection dense --distance-mode rotate
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import sys
+import time
+
+import numpy as np
+import tenseal as ts
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+from encryption import (
+    EMBEDDING_SIZE,
+    SCALE_FACTOR,
+    TEMPLATE_BITS,
+    TEMPLATE_DIM,
+    projected_length,
+    projection_gain,
+    squared_distance_bound,
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("HETuner")
+
+POLY_DEGREES = [2048, 4096, 8192, 16384, 32768]
+# Largest total coefficient-modulus bits per poly degree (HomomorphicEncryption.org
+# standard, ternary secrets); SEAL's BFVDefault uses the 128-bit column
+MAX_COEFF_BITS = {
+    128: {1024: 27, 2048: 54, 4096: 109, 8192: 218, 16384: 438, 32768: 881},
+    192: {1024: 19, 2048: 37, 4096: 75, 8192: 152, 16384: 305, 32768: 611},
+    256: {1024: 14, 2048: 29, 4096: 58, 8192: 118, 16384: 237, 32768: 476},
+}
+# SEAL's limits on individual prime sizes
+MAX_PRIME_BITS = 60
+MAX_PLAIN_BITS = 60
+
+
+def is_prime(n):
+    """Deterministic Miller-Rabin for n < 3.3e24."""
+    if n < 2:
+        return False
+    bases = [2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41]
+    for p in bases:
+        if n % p == 0:
+            return n == p
+    d, r = n - 1, 0
+    while d % 2 == 0:
+        d, r = d // 2, r + 1
+    for a in bases:
+        x = pow(a, d, n)
+        if x in (1, n - 1):
+            continue
+        for _ in range(r - 1):
+            x = pow(x, 2, n)
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+
+def batching_primes(poly_degree, above, count):
+    """The ``count`` smallest primes t > ``above`` with t ≡ 1 (mod 2n)."""
+    step = 2 * poly_degree
+    t = (above // step + 1) * step + 1
+    primes = []
+    while len(primes) < count and t.bit_length() <= MAX_PLAIN_BITS:
+        if is_prime(t):
+            primes.append(t)
+        t += step
+    return primes
+
+
+def coeff_modulus_options(poly_degree, security):
+    """Coefficient-modulus prime sizes to try, using the whole bit budget."""
+    budget = MAX_COEFF_BITS[security][poly_degree]
+    options = []
+    if security == 128:
+        # Empty means SEAL's own BFVDefault split
+        options.append([])
+    count = math.ceil(budget / MAX_PRIME_BITS)
+    # One prime more than the minimum leaves a separate special prime for key switching
+    for primes in (count, count + 1):
+        sizes = [budget // primes + (1 if i < budget % primes else 0) for i in range(primes)]
+        if sizes not in options and all(bits <= MAX_PRIME_BITS for bits in sizes):
+            options.append(sizes)
+    return options
+
+
+def make_context(candidate, galois_keys):
+    context = ts.context(ts.SCHEME_TYPE.BFV, candidate["poly_degree"], candidate["plain_modulus"],
+                         coeff_mod_bit_sizes=candidate["coeff_mod_bit_sizes"])
+    if galois_keys:
+        context.generate_galois_keys()
+    return context
+
+
+def decrypted_distance(encrypted, context, plain_modulus):
+    raw = encrypted.decrypt(context.secret_key())
+    if not isinstance(raw, list):
+        raw = [raw]
+    return sum(int(v) + plain_modulus if v < 0 else int(v) for v in raw)
+
+
+def test_vectors(length, radius, trials, rng, qmax=None):
+    """Integer vector pairs at or near the worst case, as the bundle code scales them.
+
+    With ``qmax`` the templates are quantized, so the worst case is every
+    slot clipped at opposite ends of the range.
+    """
+    if qmax:
+        extreme = np.full(length, qmax, dtype=np.int64)
+        pairs = [(extreme, -extreme)]
+        for _ in range(trials):
+            x = rng.integers(-qmax, qmax + 1, length)
+            pairs.append((x, -x))
+        return pairs
+    peak = int(radius)
+    extreme = np.zeros(length, dtype=np.int64)
+    extreme[0] = peak
+    pairs = [(extreme, -extreme)]
+    for _ in range(trials):
+        x = rng.standard_normal(length)
+        x *= radius / np.linalg.norm(x)
+        pairs.append((x.astype(np.int64), (-x).astype(np.int64)))
+    return pairs
+
+
+def validate(candidate, distance_mode, vectors):
+    """True when every test pair decrypts to its exact squared distance."""
+    context = make_context(candidate, distance_mode == "rotate")
+    for x, y in vectors:
+        diff = ts.bfv_vector(context, x.tolist()) - ts.bfv_vector(context, y.tolist())
+        squared = diff * diff
+        encrypted = squared.sum() if distance_mode == "rotate" else squared
+        expected = int(np.sum((x - y) ** 2))
+        if decrypted_distance(encrypted, context, candidate["plain_modulus"]) != expected:
+            return False
+    return True
+
+
+def benchmark(candidate, distance_mode, x, y, trials):
+    times = {"setup": [], "load": [], "encrypt": [], "compute": [], "decrypt": []}
+    for _ in range(trials):
+        start = time.perf_counter()
+        context = make_context(candidate, distance_mode == "rotate")
+        times["setup"].append(time.perf_counter() - start)
+
+        serialized_context = context.serialize(save_secret_key=True)
+        start = time.perf_counter()
+        context = ts.context_from(serialized_context)
+        times["load"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        enc_x = ts.bfv_vector(context, x.tolist())
+        enc_y = ts.bfv_vector(context, y.tolist())
+        times["encrypt"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        diff = enc_x - enc_y
+        squared = diff * diff
+        encrypted = squared.sum() if distance_mode == "rotate" else squared
+        times["compute"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        decrypted_distance(encrypted, context, candidate["plain_modulus"])
+        times["decrypt"].append(time.perf_counter() - start)
+
+    result = {k: 1000 * sum(v) / trials for k, v in times.items()}
+    # What an authentication pays once the bundle is fetched
+    result["auth_ms"] = result["load"] + result["encrypt"] + result["compute"] + result["decrypt"]
+    result["bundle_bytes"] = len(serialized_context) + len(enc_x.serialize())
+    return result
+
+
+def tune(security, projection, distance_mode, scale_factor, embedding_size, primes_per_degree, trials,
+         all_degrees=False, template_bits=0, template_dim=None):
+    length = projected_length(projection, embedding_size, template_dim)
+    radius = scale_factor * projection_gain(projection, embedding_size, template_dim)
+    qmax = (1 << (template_bits - 1)) - 1 if template_bits else None
+    if qmax:
+        # The quantization scale is calibrated per enrollment, so only clipping bounds it
+        bound = length * (2 * qmax) ** 2
+    else:
+        bound = squared_distance_bound(projection, scale_factor, embedding_size, template_dim)
+    logger.info(f"Worst-case squared distance: {bound} ({bound.bit_length()} bits), {length} slots")
+
+    rng = np.random.default_rng(0)
+    vectors = test_vectors(length, radius, 3, rng, qmax)
+    results = []
+    for poly_degree in POLY_DEGREES:
+        if poly_degree < length:
+            continue
+        for plain_modulus in batching_primes(poly_degree, bound, primes_per_degree):
+            for coeff_mod_bit_sizes in coeff_modulus_options(poly_degree, security):
+                candidate = {
+                    "poly_degree": poly_degree,
+                    "plain_modulus": plain_modulus,
+                    "coeff_mod_bit_sizes": coeff_mod_bit_sizes,
+                }
+                try:
+                    valid = validate(candidate, distance_mode, vectors)
+                except Exception as e:
+                    logger.info(f"✗ {candidate}: {e}")
+                    continue
+                if not valid:
+                    logger.info(f"✗ {candidate}: wrong decryption (noise budget exhausted)")
+                    continue
+                candidate.update(benchmark(candidate, distance_mode, *vectors[1], trials))
+                logger.info(f"✓ {candidate}")
+                results.append(candidate)
+        # Every cost grows with the degree, so a larger one can't win
+        if results and not all_degrees:
+            break
+    return bound, results
+
+
+def env_lines(candidate, args):
+    lines = [
+        f"POLY_DEGREE={candidate['poly_degree']}",
+        f"PRIME_MODULUS={candidate['plain_modulus']}",
+        f"SCALE_FACTOR={args.scale_factor}",
+        f"PROJECTION_MODE={args.projection}",
+    ]
+    if args.projection == "reduced":
+        lines.append(f"TEMPLATE_DIM={args.template_dim}")
+    if args.template_bits:
+        lines.append(f"TEMPLATE_BITS={args.template_bits}")
+    if candidate["coeff_mod_bit_sizes"]:
+        lines.append(f"COEFF_MOD_BIT_SIZES={','.join(map(str, candidate['coeff_mod_bit_sizes']))}")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--security", type=int, default=128, choices=sorted(MAX_COEFF_BITS))
+    parser.add_argument("--projection", default=os.getenv("PROJECTION_MODE", "dense"),
+                        choices=["dense", "fast", "reduced"])
+    parser.add_argument("--template-dim", type=int, default=TEMPLATE_DIM, help="dimensions kept by \"reduced\"")
+    parser.add_argument("--template-bits", type=int, default=TEMPLATE_BITS, choices=[0, 8, 16])
+    parser.add_argument("--distance-mode", default=os.getenv("DISTANCE_MODE", "rotate"), choices=["rotate", "slotwise"])
+    parser.add_argument("--scale-factor", type=int, default=SCALE_FACTOR)
+    parser.add_argument("--embedding-size", type=int, default=EMBEDDING_SIZE)
+    parser.add_argument("--primes", type=int, default=2, help="plain moduli to try per poly degree")
+    parser.add_argument("--trials", type=int, default=3)
+    parser.add_argument("--all-degrees", action="store_true",
+                        help="keep trying larger poly degrees after one works")
+    parser.add_argument("--output", help="write all valid candidates as JSON")
+    args = parser.parse_args()
+
+    bound, results = tune(args.security, args.projection, args.distance_mode, args.scale_factor,
+                          args.embedding_size, args.primes, args.trials, args.all_degrees,
+                          args.template_bits, args.template_dim)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"bound": bound, "security": args.security, "projection": args.projection,
+                       "distance_mode": args.distance_mode, "candidates": results}, f, indent=2)
+    if not results:
+        print("❌ No candidate decrypted correctly; lower SCALE_FACTOR or the security level")
+        sys.exit(1)
+
+    fastest = min(results, key=lambda c: (c["auth_ms"], c["bundle_bytes"]))
+    smallest = min(results, key=lambda c: (c["bundle_bytes"], c["auth_ms"]))
+    print(f"\n📊 {len(results)} overflow-safe candidates (squared-distance bound {bound})")
+    print(f"{'Poly':>6} | {'Plain modulus':>14} | {'Coeff bits':<22} | {'Setup':>8} | {'Auth':>8} | Bundle bytes")
+    for c in sorted(results, key=lambda c: c["auth_ms"]):
+        bits = ",".join(map(str, c["coeff_mod_bit_sizes"])) or "default"
+        print(f"{c['poly_degree']:>6} | {c['plain_modulus']:>14} | {bits:<22} | "
+              f"{c['setup']:>7.1f} | {c['auth_ms']:>7.1f} | {c['bundle_bytes']:>12}")
+
+    print("\n✅ Fastest authentication:")
+    print("\n".join(env_lines(fastest, args)))
+    if smallest is not fastest:
+        print("\n✅ Smallest bundle:")
+        print("\n".join(env_lines(smallest, args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Compares FaceNet inference backends on this CPU: load time, latency and agreement.
+
+Each backend is loaded the way the service loads it (the first run exports
+and caches the compiled model), checked against the eager model's
+embeddings and timed for a single face and for a batch. Aligned faces come
+from ``--images`` when given; random crops are used otherwise, which is
+enough for latency but says less about agreement.
+
+    python inference_benchmark.py --images faces/ --threads 4
+    python inference_benchmark.py --backends eager,onnx --output backends.json
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("InferenceBenchmark")
+
+
+def load_faces(directory, count):
+    import cv2
+    import torch
+    from face_processing import get_mtcnn
+
+    faces = []
+    for name in sorted(os.listdir(directory)):
+        frame = cv2.imread(os.path.join(directory, name))
+        if frame is None:
+            continue
+        face = get_mtcnn()(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        if face is not None:
+            faces.append(face)
+        if len(faces) == count:
+            break
+    if not faces:
+        raise ValueError(f"❌ No faces found in {directory}")
+    return torch.stack(faces)
+
+
+def time_calls(fn, warmup, repeat):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(1000 * (time.perf_counter() - start))
+    return float(np.mean(samples)), float(np.percentile(samples, 50)), float(np.percentile(samples, 99))
+
+
+def run(backends, faces, warmup, repeat):
+    import torch
+    from face_processing import BACKEND_TOLERANCE, backend_agreement, load_facenet
+
+    reference = load_facenet("eager").cpu()
+    results = []
+    for backend in backends:
+        start = time.perf_counter()
+        try:
+            model = load_facenet(backend)
+        except Exception as e:
+            logger.warning(f"⚠️ Skipping {backend}: {e}")
+            results.append({"backend": backend, "error": str(e)})
+            continue
+        load_ms = 1000 * (time.perf_counter() - start)
+        error = backend_agreement(model, faces, reference)
+
+        def _infer(batch):
+            with torch.no_grad():
+                model(batch)
+
+        single = time_calls(lambda: _infer(faces[:1]), warmup, repeat)
+        batch = time_calls(lambda: _infer(faces), warmup, repeat)
+        results.append({
+            "backend": backend,
+            "load_ms": load_ms,
+            "max_l2_error": error,
+            "tolerance": BACKEND_TOLERANCE[backend],
+            "agrees": error <= BACKEND_TOLERANCE[backend],
+            "single_mean_ms": single[0], "single_p50_ms": single[1], "single_p99_ms": single[2],
+            "batch_size": len(faces),
+            "batch_mean_ms": batch[0], "batch_p50_ms": batch[1], "batch_p99_ms": batch[2],
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backends", default="eager,torchscript,onnx,int8")
+    parser.add_argument("--images", help="directory of face images for agreement and timing")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--threads", type=int, help="intra-op threads (INFERENCE_THREADS)")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        # face_processing reads its settings at import time
+        os.environ["INFERENCE_THREADS"] = str(args.threads)
+    import torch
+    from face_processing import IMG_SIZE
+
+    if args.images:
+        faces = load_faces(args.images, args.batch_size)
+    else:
+        faces = torch.randn(args.batch_size, 3, IMG_SIZE, IMG_SIZE, generator=torch.Generator().manual_seed(0))
+
+    results = run(args.backends.split(","), faces, args.warmup, args.repeat)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"threads": torch.get_num_threads(), "results": results}, f, indent=2)
+
+    print(f"\n📊 FaceNet backends ({torch.get_num_threads()} threads, batch of {len(faces)})")
+    print(f"{'Backend':<12} | {'Load ms':>9} | {'1 face p50':>10} | {'Batch p50':>10} | "
+          f"{'ms/face':>8} | {'Max L2 err':>10} | OK")
+    for r in results:
+        if "error" in r:
+            print(f"{r['backend']:<12} | {r['error']}")
+            continue
+        print(f"{r['backend']:<12} | {r['load_ms']:>9.0f} | {r['single_p50_ms']:>10.1f} | "
+              f"{r['batch_p50_ms']:>10.1f} | {r['batch_p50_ms'] / r['batch_size']:>8.2f} | "
+              f"{r['max_l2_error']:>10.2e} | {'✅' if r['agrees'] else '❌'}")
+    if not all(r.get("agrees") for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Load generator for the SecureFace service (src/server.py).
+
+Sends authentication requests with a fixed image and PIN at a given
+concurrency and reports throughput and p50/p99 latency.
+
+    python loadgen.py --image face.jpg --pin 1234 --requests 200 --concurrency 8
+"""
+import argparse
+import base64
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+
+def run(url, payload, total, concurrency):
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+
+    def one(_):
+        start = time.perf_counter()
+        try:
+            status = session.post(url, json=payload, timeout=120).status_code
+        except requests.exceptions.RequestException:
+            status = None
+        return status, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(total)))
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array([latency for status, latency in results if status == 200]) * 1000
+    statuses = {}
+    for status, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+
+    print(f"\n📊 {total} requests, concurrency {concurrency}, {elapsed:.1f}s")
+    print(f"   Throughput: {len(latencies) / elapsed:.2f} req/s (successful)")
+    print(f"   Status codes: {statuses}")
+    if len(latencies):
+        print(f"   Latency p50: {np.percentile(latencies, 50):.1f} ms, "
+              f"p99: {np.percentile(latencies, 99):.1f} ms, max: {latencies.max():.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SecureFace service load generator")
+    parser.add_argument("--url", default="http://127.0.0.1:8765")
+    parser.add_argument("--image", required=True, help="face image sent with every request")
+    parser.add_argument("--pin", required=True, help="PIN of an already registered user")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    with open(args.image, "rb") as f:
+        image = base64.b64encode(f.read()).decode()
+    payload = {"pin": args.pin, "image": image}
+    run(args.url + "/authenticate", payload, args.requests, args.concurrency)
+
+
+if __name__ == "__main__":
+    main()
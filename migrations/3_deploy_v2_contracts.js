@@ -0,0 +1,5 @@
+const BiometricStorageV2 = artifacts.require("BiometricStorageV2");
+
+module.exports = function (deployer) {
+  deployer.deploy(BiometricStorageV2);
+};
@@ -0,0 +1,142 @@
+import threading
+import time
+from concurrent.futures import Future
+
+from face_processing import get_face_embedding
+from encryption import (
+    compute_encrypted_distance, decrypt_distance, forget_context, refresh_encrypted_bundle, release_context,
+)
+from ipfs_handler import get_ipfs_handler
+from blockchain_interaction import get_ipfs_hash, revoke_ipfs_hash, update_ipfs_hash
+from bundle_format import open_bundle
+
+
+class BundleLookupError(Exception):
+    """No biometric bundle could be found for the UID."""
+
+
+def _timed(timings, stage, fn, *args):
+    start = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        timings[stage] = time.perf_counter() - start
+
+
+def _fetch_bundle(uid, timings):
+    try:
+        ipfs_hash = _timed(timings, "chain_lookup", get_ipfs_hash, uid)
+    except Exception as e:
+        raise BundleLookupError(str(e)) from e
+    bundle = _timed(timings, "ipfs_fetch", get_ipfs_handler().retrieve_encrypted_bundle, ipfs_hash)
+    return ipfs_hash, bundle
+
+
+def _verify_locally(bundle, embedding, user_seed, timings):
+    encrypted_distance, context, encoding = _timed(
+        timings, "he_compute", compute_encrypted_distance, bundle, embedding, user_seed
+    )
+    try:
+        return _timed(timings, "decrypt", decrypt_distance, encrypted_distance, context, encoding)
+    finally:
+        release_context(context)
+
+
+def _in_background(fn, *args):
+    """Runs ``fn`` on a daemon thread and returns a Future for its result.
+
+    Unlike an executor's worker, an abandoned daemon thread does not hold up
+    interpreter exit, so a canceled login can quit straight away.
+    """
+    future = Future()
+
+    def _run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=_run, name="auth-fetch", daemon=True).start()
+    return future
+
+
+def authenticate(uid, user_seed, capture, verify=None):
+    """Runs one authentication with the network work overlapping the camera.
+
+    The chain lookup and bundle download start in a background thread while
+    ``capture()`` (which returns an image path or BGR frame) and FaceNet run
+    in the caller's thread; both join before the HE step. ``verify(bundle,
+    embedding, user_seed)`` can replace the in-thread HE step, e.g. to run
+    it in a process pool. Returns a dict with the distance, threshold,
+    decision and per-stage timings in seconds.
+    """
+    timings = {}
+    start = time.perf_counter()
+    fetch = _in_background(_fetch_bundle, uid, timings)
+    try:
+        image = _timed(timings, "capture", capture)
+        if image is None:
+            raise ValueError("❌ Capture canceled")
+        embedding = _timed(timings, "embedding", get_face_embedding, image)
+    except BaseException:
+        # Nothing waits for a fetch that is already running; it ends on its own timeout
+        fetch.cancel()
+        raise
+    wait_start = time.perf_counter()
+    ipfs_hash, bundle = fetch.result()
+    timings["fetch_wait"] = time.perf_counter() - wait_start
+
+    threshold = open_bundle(bundle).threshold
+    if verify is None:
+        distance = _verify_locally(bundle, embedding, user_seed, timings)
+    else:
+        distance = _timed(timings, "he_verify", verify, bundle, embedding, user_seed)
+    timings["end_to_end"] = time.perf_counter() - start
+
+    return {
+        "ipfs_hash": ipfs_hash,
+        "bundle": bundle,
+        "embedding": embedding,
+        "distance": distance,
+        "threshold": threshold,
+        "granted": distance < threshold,
+        "timings": timings,
+    }
+
+
+def refresh_template(uid, user_seed, result, account, private_key):
+    """Updates the stored template from a granted ``authenticate`` result.
+
+    Reuses the capture and the bundle that authentication already has, so
+    there is no new webcam session and no keygen. The new bundle replaces
+    the old one through ``update_ipfs_hash``. Returns ``(ipfs_hash,
+    threshold)`` of the new bundle.
+    """
+    if not result["granted"]:
+        raise ValueError("❌ Only a granted authentication can refresh the template")
+    bundle = refresh_encrypted_bundle(result["bundle"], result["embedding"], user_seed, result["distance"])
+    ipfs_hash = get_ipfs_handler().upload_encrypted_bundle(bundle)
+    update_ipfs_hash(uid, ipfs_hash, account, private_key).result()
+    return ipfs_hash, open_bundle(bundle).threshold
+
+
+def revoke_template(uid, user_seed, result, account, private_key):
+    """Revokes the UID on chain, then drops the local copies of its bundle.
+
+    ``result`` is the granted ``authenticate`` result that proved the user.
+    The cached bundle and its decrypted context are removed only once the
+    revocation is mined, so a failed transaction leaves them usable.
+    """
+    if not result["granted"]:
+        raise ValueError("❌ Only a granted authentication can revoke")
+    revoke_ipfs_hash(uid, account, private_key).result()
+    get_ipfs_handler().forget_bundle(result["ipfs_hash"])
+    forget_context(result["bundle"], user_seed)
+
+
+def print_timings(timings):
+    print("\n⏱️ Authentication stages:")
+    for stage, seconds in timings.items():
+        print(f"   {stage:<14} {seconds * 1000:>9.1f} ms")
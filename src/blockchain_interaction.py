@@ -1,56 +1,254 @@
 from web3 import Web3
+from web3.exceptions import ContractLogicError
 import json
 import os
 import sys  # Added for better error handling
+import threading
 from dotenv import load_dotenv
-try:
+
+import metrics
+from lazy import LazySingleton
+from cid_codec import decode_cid, encode_cid, uid_to_bytes32
+from tx_manager import TransactionManager
+from uid_index import UidIndex
+
+load_dotenv()
+# 11155111 is Sepolia; set to the local Ganache/Truffle network id to test locally
+CONTRACT_NETWORK_ID = os.getenv("CONTRACT_NETWORK_ID", "11155111")
+# "2" selects BiometricStorageV2 (bytes32 UIDs, binary CIDs)
+CONTRACT_VERSION = os.getenv("CONTRACT_VERSION", "1")
+# In v2 mode, UIDs that BiometricStorageV2 has never held are read from the v1 contract
+V1_FALLBACK = os.getenv("V1_FALLBACK", "0") == "1"
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "50"))
+UID_INDEX_ENABLED = os.getenv("UID_INDEX", "0") == "1"
+UID_INDEX_PATH = os.getenv("UID_INDEX_PATH", os.path.join(os.path.expanduser("~"), ".cache", "secureface", "uid_index.sqlite"))
+UID_INDEX_START_BLOCK = os.getenv("UID_INDEX_START_BLOCK")
+UID_INDEX_MAX_STALENESS = float(os.getenv("UID_INDEX_MAX_STALENESS", "60"))
+
+
+def _load_build(name):
     script_dir = os.path.dirname(os.path.abspath(__file__))
-    contract_path = os.path.join(script_dir, "../build/contracts/BiometricStorage.json")
+    contract_path = os.path.join(script_dir, f"../build/contracts/{name}.json")
     with open(contract_path, "r") as contract_file:
-        contract_build = json.load(contract_file)
-except FileNotFoundError:
-    sys.exit("Error: BiometricStorage.json file not found. Ensure the file exists at the specified path.")
+        return json.load(contract_file)
 
-load_dotenv()
-url = os.getenv("WEB3_URL")
-web3 = Web3(Web3.HTTPProvider(url))
 
-if not web3.is_connected():
-    sys.exit("Error: Failed to connect to Ethereum. Ensure the Sepolia testnet endpoint and credentials are correct.")
+def _load_contract(web3, name):
+    contract_build = _load_build(name)
+    deployment = contract_build['networks'][CONTRACT_NETWORK_ID]
+    return web3.eth.contract(address=deployment['address'], abi=contract_build['abi']), deployment
+
+
+def _connect():
+    """Reads the contract build and connects to the RPC node."""
+    name = "BiometricStorageV2" if CONTRACT_VERSION == "2" else "BiometricStorage"
+    try:
+        _load_build(name)
+    except FileNotFoundError:
+        sys.exit(f"Error: {name}.json file not found. Ensure the file exists at the specified path.")
+
+    url = os.getenv("WEB3_URL")
+    web3 = Web3(Web3.HTTPProvider(url))
+
+    if not web3.is_connected():
+        sys.exit("Error: Failed to connect to Ethereum. Ensure the Sepolia testnet endpoint and credentials are correct.")
+
+    contract, deployment = _load_contract(web3, name)
+    return web3, contract, deployment
+
+
+# Connected on first use, not at import time
+_chain = LazySingleton("web3", _connect)
+
+
+def get_web3():
+    return _chain.get()[0]
+
+
+def get_contract():
+    return _chain.get()[1]
+
+
+def _is_compact():
+    return CONTRACT_VERSION == "2"
+
+
+def _load_legacy_contract():
+    try:
+        return _load_contract(get_web3(), "BiometricStorage")[0]
+    except (FileNotFoundError, KeyError):
+        return None
+
+
+_legacy = LazySingleton("web3_v1", _load_legacy_contract)
+
+
+def warm_up_chain():
+    """Starts connecting to the RPC node in a background thread."""
+    threads = [_chain.warm()]
+    if UID_INDEX_ENABLED:
+        threads.append(_index.warm())
+    return threads
+
+
+def _open_index():
+    web3, contract, deployment = _chain.get()
+    if UID_INDEX_START_BLOCK is not None:
+        start_block = int(UID_INDEX_START_BLOCK)
+    elif deployment.get('transactionHash'):
+        # No events can predate the deployment transaction
+        start_block = web3.eth.get_transaction_receipt(deployment['transactionHash'])['blockNumber']
+    else:
+        start_block = 0
+    os.makedirs(os.path.dirname(UID_INDEX_PATH), exist_ok=True)
+    index = UidIndex(web3, contract, UID_INDEX_PATH, start_block=start_block,
+                     max_staleness=UID_INDEX_MAX_STALENESS, compact=_is_compact())
+    index.sync()
+    index.start_tailing()
+    return index
+
+
+_index = LazySingleton("uid_index", _open_index)
+
+
+def get_uid_index():
+    """Returns the event-log index, or ``None`` when UID_INDEX is not enabled."""
+    return _index.get() if UID_INDEX_ENABLED else None
+
+
+_tx_managers = {}
+_tx_managers_lock = threading.Lock()
+
+
+def get_transaction_manager(account, private_key):
+    """Returns the shared transaction manager for ``account``."""
+    with _tx_managers_lock:
+        manager = _tx_managers.get(account)
+        if manager is None:
+            manager = TransactionManager(get_web3(), account, private_key)
+            _tx_managers[account] = manager
+        return manager
+
+
+def _record_args(uid, ipfs_hash):
+    if _is_compact():
+        return (uid_to_bytes32(uid), *encode_cid(ipfs_hash))
+    return (uid, ipfs_hash)
+
+
+def _uid_arg(uid):
+    return uid_to_bytes32(uid) if _is_compact() else uid
 
-abi = contract_build['abi']
-contract_address = contract_build['networks']['11155111']['address']
-contract = web3.eth.contract(address=contract_address, abi=abi)
 
 def store_ipfs_hash(uid, ipfs_hash, account, private_key):
-    tx = contract.functions.storeIPFSHash(uid, ipfs_hash).build_transaction({
-        'from': account,
-        'nonce': web3.eth.get_transaction_count(account),
-        'gas': 2000000,
-        'gasPrice': web3.to_wei('20', 'gwei')
-    })
-    signed_tx = web3.eth.account.sign_transaction(tx, private_key)
-    web3.eth.send_raw_transaction(signed_tx.raw_transaction)
+    """Queues the store; the returned Future resolves to the receipt."""
+    call = get_contract().functions.storeIPFSHash(*_record_args(uid, ipfs_hash))
+    return metrics.track_future("chain.store", get_transaction_manager(account, private_key).submit(call))
+
+def store_ipfs_hash_batch(pairs, account, private_key, chunk_size=None):
+    """Stores many ``(uid, ipfs_hash)`` pairs, one transaction per chunk.
+
+    Returns one Future per chunk of at most ``chunk_size`` pairs.
+    """
+    chunk_size = chunk_size or BATCH_CHUNK_SIZE
+    pairs = list(pairs)
+    manager = get_transaction_manager(account, private_key)
+    futures = []
+    for start in range(0, len(pairs), chunk_size):
+        chunk = pairs[start:start + chunk_size]
+        # Transpose [(uid, cid...), ...] into per-argument arrays
+        columns = [list(column) for column in zip(*(_record_args(uid, cid) for uid, cid in chunk))]
+        call = get_contract().functions.storeIPFSHashBatch(*columns)
+        futures.append(metrics.track_future("chain.store_batch", manager.submit(call)))
+    return futures
+
+def _fallback_contract(uid):
+    """The v1 contract if ``uid`` may only live there, else ``None``.
+
+    Only UIDs that BiometricStorageV2 has never held qualify: a UID revoked
+    (or re-stored) in v2 must never resolve through its old v1 entry.
+    """
+    if not (_is_compact() and V1_FALLBACK):
+        return None
+    legacy = _legacy.get()
+    if legacy is None or get_contract().functions.known(uid_to_bytes32(uid)).call():
+        return None
+    return legacy
+
+def _legacy_holds(legacy, uid):
+    try:
+        legacy.functions.getIPFSHash(uid).call()
+        return True
+    except ContractLogicError:
+        return False
 
 def update_ipfs_hash(uid, new_ipfs_hash, account, private_key):
-    tx = contract.functions.updateIPFSHash(uid, new_ipfs_hash).build_transaction({
-        'from': account,
-        'nonce': web3.eth.get_transaction_count(account),
-        'gas': 2000000,
-        'gasPrice': web3.to_wei('20', 'gwei')
-    })
-    signed_tx = web3.eth.account.sign_transaction(tx, private_key)
-    web3.eth.send_raw_transaction(signed_tx.raw_transaction)
+    legacy = _fallback_contract(uid)
+    if legacy is not None and _legacy_holds(legacy, uid):
+        # Not migrated yet: storing in v2 makes it authoritative for this UID from now on
+        call = get_contract().functions.storeIPFSHash(*_record_args(uid, new_ipfs_hash))
+    else:
+        call = get_contract().functions.updateIPFSHash(*_record_args(uid, new_ipfs_hash))
+    return metrics.track_future("chain.update", get_transaction_manager(account, private_key).submit(call))
 
 def revoke_ipfs_hash(uid, account, private_key):
-    tx = contract.functions.revokeIPFSHash(uid).build_transaction({
-        'from': account,
-        'nonce': web3.eth.get_transaction_count(account),
-        'gas': 2000000,
-        'gasPrice': web3.to_wei('20', 'gwei')
-    })
-    signed_tx = web3.eth.account.sign_transaction(tx, private_key)
-    web3.eth.send_raw_transaction(signed_tx.raw_transaction)
+    legacy = _fallback_contract(uid)
+    if legacy is not None and _legacy_holds(legacy, uid):
+        # Not migrated yet: revoke it where lookups find it
+        call = legacy.functions.revokeIPFSHash(uid)
+    else:
+        call = get_contract().functions.revokeIPFSHash(_uid_arg(uid))
+    return metrics.track_future("chain.revoke", get_transaction_manager(account, private_key).submit(call))
+
+@metrics.timed("chain.read")
+def _read_contract(uid):
+    if not _is_compact():
+        return get_contract().functions.getIPFSHash(uid).call()
+    try:
+        digest, codec = get_contract().functions.getIPFSHash(uid_to_bytes32(uid)).call()
+        return decode_cid(digest, codec)
+    except ContractLogicError:
+        # "No IPFS hash found"; an RPC failure is no reason to consult v1
+        legacy = _fallback_contract(uid)
+        if legacy is None:
+            raise
+        return legacy.functions.getIPFSHash(uid).call()
 
+@metrics.timed("chain.lookup")
 def get_ipfs_hash(uid):
-    return contract.functions.getIPFSHash(uid).call()
\ No newline at end of file
+    try:
+        index = get_uid_index()
+    except Exception as e:
+        print(f"⚠️ Local UID index unavailable, using the contract: {e}")
+        index = None
+    if index is not None and index.is_fresh():
+        known, cid = index.lookup(uid)
+        if known and cid:
+            return cid
+    # Unknown, revoked or stale in the index: the contract is authoritative
+    return _read_contract(uid)
+
+def migrate_to_v2(uids, account, private_key, chunk_size=None):
+    """Copies the given UIDs from BiometricStorage into BiometricStorageV2.
+
+    The v1 contract only logs keccak hashes of UIDs, so the operator
+    supplies the UIDs to move. UIDs missing from v1 are skipped, and so are
+    UIDs v2 already knows, so a rerun can't bring back one revoked in v2.
+    Once migrated, a UID is never read from v1 again. Returns the
+    batch-store Futures.
+    """
+    if not _is_compact():
+        raise RuntimeError("❌ Set CONTRACT_VERSION=2 to migrate into BiometricStorageV2")
+    legacy = _legacy.get()
+    if legacy is None:
+        raise RuntimeError("❌ No BiometricStorage deployment found to migrate from")
+    pairs = []
+    for uid in uids:
+        if get_contract().functions.known(uid_to_bytes32(uid)).call():
+            print(f"⚠️ Skipping {uid}: already migrated")
+            continue
+        try:
+            pairs.append((uid, legacy.functions.getIPFSHash(uid).call()))
+        except ContractLogicError:
+            print(f"⚠️ Skipping {uid}: not stored in the v1 contract")
+    return store_ipfs_hash_batch(pairs, account, private_key, chunk_size)
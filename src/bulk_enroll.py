@@ -0,0 +1,461 @@
+"""Enrolls many users from a manifest of PINs and face images.
+
+The manifest is CSV (``user,pin,images``, with images separated by ``;``)
+or JSON lines (``{"user": ..., "pin": ..., "images": [...]}``). Image paths
+are relative to the manifest, and a directory stands for every image in
+it. The first image is the template and the rest calibrate the threshold,
+as in interactive registration.
+
+Users flow through bounded stages connected by small queues, so a slow
+stage holds back the ones before it instead of letting work pile up in
+memory:
+
+    embed      batched MTCNN + FaceNet over several users' images
+    calibrate  per-user threshold from the enrollment spread
+    bundle     HE bundle creation in worker processes
+    upload     concurrent IPFS uploads
+    commit     batched storeIPFSHashBatch transactions
+
+Progress is checkpointed in SQLite per user, so a rerun after a crash skips
+committed users and commits already-uploaded bundles without redoing
+their HE work.
+
+    python bulk_enroll.py users.csv --checkpoint enroll.sqlite --report enroll.json
+"""
+import argparse
+import csv
+import functools
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from dotenv import load_dotenv
+
+from face_processing import get_face_embeddings, warm_up_models
+from encryption import calibrate_threshold, create_encrypted_bundle, enrollment_stats, generate_uid
+from ipfs_handler import get_ipfs_handler
+from blockchain_interaction import BATCH_CHUNK_SIZE, get_ipfs_hash, store_ipfs_hash, store_ipfs_hash_batch
+from verify_engine import HE_WORKERS, VerificationEngine
+
+load_dotenv()
+SALT = os.getenv("GLOBAL_SALT")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+MIN_IMAGES = 2
+# Batch transactions waiting for receipts; the tx manager pipelines their nonces
+MAX_PENDING_CHUNKS = 4
+
+_DONE = object()
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS enrollments (
+    user TEXT PRIMARY KEY,
+    uid TEXT,
+    state TEXT NOT NULL,
+    ipfs_hash TEXT,
+    threshold REAL,
+    error TEXT,
+    updated REAL NOT NULL
+);
+"""
+
+
+class Checkpoint:
+    """Per-user progress: ``uploaded``, ``committed``, ``skipped`` or ``failed``."""
+
+    def __init__(self, path):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            rows = self._db.execute("SELECT user, uid, state, ipfs_hash FROM enrollments").fetchall()
+        return {user: {"uid": uid, "state": state, "ipfs_hash": ipfs_hash} for user, uid, state, ipfs_hash in rows}
+
+    def mark(self, user, state, uid=None, ipfs_hash=None, threshold=None, error=None):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO enrollments (user, uid, state, ipfs_hash, threshold, error, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(user) DO UPDATE SET "
+                "uid = COALESCE(excluded.uid, uid), state = excluded.state, "
+                "ipfs_hash = COALESCE(excluded.ipfs_hash, ipfs_hash), "
+                "threshold = COALESCE(excluded.threshold, threshold), error = excluded.error, "
+                "updated = excluded.updated",
+                (user, uid, state, ipfs_hash, threshold, error, time.time()),
+            )
+
+    def counts(self):
+        with self._lock:
+            return dict(self._db.execute("SELECT state, COUNT(*) FROM enrollments GROUP BY state").fetchall())
+
+
+def _expand_images(paths, base_dir):
+    images = []
+    for path in paths:
+        path = os.path.join(base_dir, path.strip())
+        if os.path.isdir(path):
+            images.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                          if name.lower().endswith(IMAGE_EXTENSIONS))
+        elif path:
+            images.append(path)
+    return images
+
+
+def read_manifest(path):
+    """Yields ``{"user", "pin", "images"}`` records without loading the whole file."""
+    base_dir = os.path.dirname(os.path.abspath(path))
+    with open(path, newline="") as f:
+        if path.endswith((".jsonl", ".json")):
+            records = (json.loads(line) for line in f if line.strip())
+        else:
+            records = ({"user": row["user"], "pin": row["pin"], "images": row["images"].split(";")}
+                       for row in csv.DictReader(f))
+        for record in records:
+            yield {
+                "user": str(record["user"]),
+                "pin": str(record["pin"]),
+                "images": _expand_images(record["images"], base_dir),
+            }
+
+
+class StageStats:
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.failed = 0
+        self.busy = 0.0
+        self.blocked = 0.0
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def add(self, busy=0.0, blocked=0.0, items=0, failed=0):
+        with self._lock:
+            now = time.perf_counter()
+            if self.started is None:
+                self.started = now - busy
+            self.finished = now
+            self.busy += busy
+            self.blocked += blocked
+            self.items += items
+            self.failed += failed
+
+    def summary(self):
+        wall = (self.finished - self.started) if self.started is not None else 0.0
+        return {
+            "stage": self.name,
+            "workers": self.workers,
+            "items": self.items,
+            "failed": self.failed,
+            "wall_s": wall,
+            "items_per_s": self.items / wall if wall else 0.0,
+            # Near 1 means this stage is the bottleneck; high "blocked" means the next one is
+            "utilization": self.busy / (wall * self.workers) if wall else 0.0,
+            "blocked_s": self.blocked,
+        }
+
+
+class Stage:
+    """``workers`` threads applying ``fn`` to items from ``inbox``.
+
+    ``fn`` returns an iterable of items for ``outbox``. A full outbox blocks
+    the workers, which is what bounds memory across the pipeline.
+    """
+
+    def __init__(self, name, fn, workers, inbox, outbox):
+        self.fn = fn
+        self.inbox = inbox
+        self.outbox = outbox
+        self.stats = StageStats(name, workers)
+        self._remaining = workers
+        self._lock = threading.Lock()
+        self.threads = [threading.Thread(target=self._run, name=f"enroll-{name}-{i}", daemon=True)
+                        for i in range(workers)]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            item = self.inbox.get()
+            if item is _DONE:
+                # Let sibling workers see it too; the last one passes it on
+                self.inbox.put(_DONE)
+                with self._lock:
+                    self._remaining -= 1
+                    last = self._remaining == 0
+                if last and self.outbox is not None:
+                    self.outbox.put(_DONE)
+                return
+            start = time.perf_counter()
+            try:
+                outputs = list(self.fn(item))
+            except Exception as e:
+                # Users without a checkpoint state are simply picked up again on the next run
+                print(f"❌ {self.stats.name} failed: {e}")
+                self.stats.add(time.perf_counter() - start, failed=1)
+                continue
+            busy = time.perf_counter() - start
+            start = time.perf_counter()
+            for output in outputs:
+                self.outbox.put(output)
+            self.stats.add(busy, time.perf_counter() - start, items=len(outputs))
+
+
+class BulkEnrollment:
+    def __init__(self, checkpoint, account, private_key, batch_users=8, upload_workers=8,
+                 queue_size=32, chunk_size=None, flush_seconds=10.0, he_workers=None):
+        self.checkpoint = checkpoint
+        self.account = account
+        self.private_key = private_key
+        self.batch_users = batch_users
+        self.upload_workers = upload_workers
+        self.queue_size = queue_size
+        self.chunk_size = chunk_size or BATCH_CHUNK_SIZE
+        self.flush_seconds = flush_seconds
+        self.engine = VerificationEngine(he_workers or HE_WORKERS)
+        self.commit_stats = StageStats("commit", 1)
+        self._pending_chunks = threading.BoundedSemaphore(MAX_PENDING_CHUNKS)
+        self._settler = ThreadPoolExecutor(MAX_PENDING_CHUNKS, thread_name_prefix="enroll-settle")
+        self._chunk_futures = []
+
+    def _fail(self, stats, record, error):
+        print(f"❌ {record['user']}: {error}")
+        self.checkpoint.mark(record["user"], "failed", uid=record.get("uid"), error=str(error))
+        stats.add(failed=1)
+
+    # ---- stages ----
+    def _embed(self, batch):
+        images, owners = [], []
+        for record in batch:
+            images.extend(record["images"])
+            owners.extend([record] * len(record["images"]))
+        embeddings, failures = get_face_embeddings(images)
+        per_user = {record["user"]: [] for record in batch}
+        bad = {}
+        for i, (record, embedding) in enumerate(zip(owners, embeddings)):
+            if i in failures:
+                bad.setdefault(record["user"], []).append(os.path.basename(images[i]))
+            else:
+                per_user[record["user"]].append(embedding)
+        for record in batch:
+            if record["user"] in bad:
+                # Same rule as interactive registration: every capture must have a face
+                self._fail(self.stages["embed"].stats, record, f"no usable face in {', '.join(bad[record['user']])}")
+                continue
+            yield dict(record, embeddings=per_user[record["user"]])
+
+    def _calibrate(self, record):
+        threshold = calibrate_threshold(record["embeddings"], record["pin"])
+        stats = enrollment_stats(record["embeddings"], record["pin"])
+        yield dict(record, embeddings=record["embeddings"][:1], threshold=threshold, stats=stats)
+
+    def _bundle(self, record):
+        try:
+            create = functools.partial(create_encrypted_bundle, refresh_stats=record["stats"])
+            bundle = self.engine.run(create, record["embeddings"][0], record["pin"], record["threshold"]).result()
+        except Exception as e:
+            self._fail(self.stages["bundle"].stats, record, e)
+            return
+        yield {"user": record["user"], "uid": record["uid"], "threshold": record["threshold"], "bundle": bundle}
+
+    def _upload(self, record):
+        try:
+            ipfs_hash = get_ipfs_handler().upload_encrypted_bundle(record["bundle"])
+        except Exception as e:
+            self._fail(self.stages["upload"].stats, record, e)
+            return
+        self.checkpoint.mark(record["user"], "uploaded", uid=record["uid"], ipfs_hash=ipfs_hash,
+                             threshold=record["threshold"])
+        yield {"user": record["user"], "uid": record["uid"], "ipfs_hash": ipfs_hash}
+
+    # ---- commit ----
+    def _commit_loop(self, inbox):
+        chunk, deadline = [], None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = inbox.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is not None and item is not _DONE:
+                chunk.append(item)
+                deadline = deadline or time.monotonic() + self.flush_seconds
+            if chunk and (item is None or item is _DONE or len(chunk) >= self.chunk_size):
+                self._commit_chunk(chunk)
+                chunk, deadline = [], None
+            if item is _DONE:
+                wait(self._chunk_futures)
+                return
+
+    def _commit_chunk(self, chunk):
+        start = time.perf_counter()
+        self._pending_chunks.acquire()
+        blocked = time.perf_counter() - start
+        try:
+            future = store_ipfs_hash_batch([(r["uid"], r["ipfs_hash"]) for r in chunk], self.account,
+                                           self.private_key, len(chunk))[0]
+        except Exception as e:
+            # E.g. a CID the contract can't encode or an RPC error; the loop must keep draining
+            self._pending_chunks.release()
+            for record in chunk:
+                self._fail(self.commit_stats, record, e)
+            return
+        # Receipts are awaited off the commit loop so the next chunk can be sent meanwhile
+        self._chunk_futures.append(self._settler.submit(self._settle, future, chunk, blocked, time.perf_counter()))
+
+    def _settle(self, future, chunk, blocked, submitted):
+        try:
+            try:
+                future.result()
+                committed = chunk
+            except Exception as e:
+                # One already-registered UID reverts the whole batch; retry one by one
+                print(f"⚠️ Batch of {len(chunk)} failed ({e}), storing individually")
+                committed = []
+                for record in chunk:
+                    try:
+                        store_ipfs_hash(record["uid"], record["ipfs_hash"], self.account, self.private_key).result()
+                        committed.append(record)
+                    except Exception as single_error:
+                        self._fail(self.commit_stats, record, single_error)
+            for record in committed:
+                self.checkpoint.mark(record["user"], "committed")
+            self.commit_stats.add(time.perf_counter() - submitted, blocked, items=len(committed))
+        finally:
+            self._pending_chunks.release()
+
+    # ---- driver ----
+    @staticmethod
+    def _already_committed(uid, ipfs_hash):
+        try:
+            return get_ipfs_hash(uid) == ipfs_hash
+        except Exception:
+            return False
+
+    def _admit(self, record, seen_uids):
+        """Returns the record with its UID if it still needs enrolling, else None."""
+        uid = generate_uid(record["pin"], SALT)
+        if uid in seen_uids:
+            # The UID only depends on the PIN, so two users can't share one
+            self.checkpoint.mark(record["user"], "failed", uid=uid, error=f"PIN already used by {seen_uids[uid]}")
+            return None
+        seen_uids[uid] = record["user"]
+        if len(record["images"]) < MIN_IMAGES:
+            self.checkpoint.mark(record["user"], "failed", uid=uid, error=f"needs at least {MIN_IMAGES} images")
+            return None
+        try:
+            existing = get_ipfs_hash(uid)
+        except Exception:
+            existing = None
+        if existing:
+            self.checkpoint.mark(record["user"], "skipped", uid=uid, ipfs_hash=existing, error="already registered")
+            return None
+        return dict(record, uid=uid)
+
+    def run(self, records, retry_failed=False):
+        done = self.checkpoint.load()
+        queues = {name: queue.Queue(self.queue_size) for name in ("embed", "calibrate", "bundle", "upload", "commit")}
+        self.stages = {
+            "embed": Stage("embed", self._embed, 1, queues["embed"], queues["calibrate"]),
+            "calibrate": Stage("calibrate", self._calibrate, 1, queues["calibrate"], queues["bundle"]),
+            "bundle": Stage("bundle", self._bundle, self.engine.workers, queues["bundle"], queues["upload"]),
+            "upload": Stage("upload", self._upload, self.upload_workers, queues["upload"], queues["commit"]),
+        }
+        warm_up_models()
+        self.engine.warm_up()
+        for stage in self.stages.values():
+            stage.start()
+        committer = threading.Thread(target=self._commit_loop, args=(queues["commit"],), name="enroll-commit")
+        committer.start()
+
+        start = time.perf_counter()
+        seen_uids, batch, admitted = {}, [], 0
+        for record in records:
+            state = done.get(record["user"], {})
+            if state.get("state") in ("committed", "skipped") or (state.get("state") == "failed" and not retry_failed):
+                continue
+            if state.get("state") == "uploaded":
+                seen_uids[state["uid"]] = record["user"]
+                if self._already_committed(state["uid"], state["ipfs_hash"]):
+                    # Mined before the crash, just not checkpointed
+                    self.checkpoint.mark(record["user"], "committed")
+                    continue
+                # The bundle is already on IPFS; only the chain write is missing
+                queues["commit"].put({"user": record["user"], "uid": state["uid"], "ipfs_hash": state["ipfs_hash"]})
+                continue
+            record = self._admit(record, seen_uids)
+            if record is None:
+                continue
+            admitted += 1
+            batch.append(record)
+            if len(batch) == self.batch_users:
+                queues["embed"].put(batch)
+                batch = []
+        if batch:
+            queues["embed"].put(batch)
+        queues["embed"].put(_DONE)
+
+        for stage in self.stages.values():
+            for thread in stage.threads:
+                thread.join()
+        committer.join()
+        self._settler.shutdown()
+        self.engine.shutdown()
+        elapsed = time.perf_counter() - start
+        return {
+            "admitted": admitted,
+            "elapsed_s": elapsed,
+            "states": self.checkpoint.counts(),
+            "stages": [stage.stats.summary() for stage in self.stages.values()] + [self.commit_stats.summary()],
+        }
+
+
+def print_report(report):
+    print(f"\n📊 Enrolled in {report['elapsed_s']:.1f}s: "
+          + ", ".join(f"{state} {count}" for state, count in sorted(report["states"].items())))
+    print(f"{'Stage':<10} | {'Workers':>7} | {'Items':>6} | {'Failed':>6} | {'Items/s':>8} | "
+          f"{'Utilization':>11} | Blocked s")
+    for s in report["stages"]:
+        print(f"{s['stage']:<10} | {s['workers']:>7} | {s['items']:>6} | {s['failed']:>6} | "
+              f"{s['items_per_s']:>8.2f} | {s['utilization']:>10.0%} | {s['blocked_s']:>9.1f}")
+    busiest = max(report["stages"], key=lambda s: s["utilization"])
+    if busiest["items"]:
+        print(f"🐢 Limiting stage: {busiest['stage']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk enrollment from a manifest")
+    parser.add_argument("manifest", help="CSV (user,pin,images) or JSON lines")
+    parser.add_argument("--checkpoint", default="enrollment.sqlite")
+    parser.add_argument("--retry-failed", action="store_true", help="retry users a previous run marked failed")
+    parser.add_argument("--batch-users", type=int, default=8, help="users embedded per FaceNet batch")
+    parser.add_argument("--upload-workers", type=int, default=8)
+    parser.add_argument("--he-workers", type=int, help="bundle-creation processes (HE_WORKERS)")
+    parser.add_argument("--queue-size", type=int, default=32, help="items buffered between stages")
+    parser.add_argument("--chunk-size", type=int, help="UIDs per batch transaction (BATCH_CHUNK_SIZE)")
+    parser.add_argument("--flush-seconds", type=float, default=10.0,
+                        help="commit a partial batch after waiting this long")
+    parser.add_argument("--report", help="write the per-stage report as JSON")
+    args = parser.parse_args()
+
+    enrollment = BulkEnrollment(
+        Checkpoint(args.checkpoint), os.getenv("MY_ACCOUNT"), os.getenv("MY_PRIVATE_KEY"),
+        batch_users=args.batch_users, upload_workers=args.upload_workers, queue_size=args.queue_size,
+        chunk_size=args.chunk_size, flush_seconds=args.flush_seconds, he_workers=args.he_workers,
+    )
+    report = enrollment.run(read_manifest(args.manifest), args.retry_failed)
+    print_report(report)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
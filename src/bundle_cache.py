@@ -0,0 +1,128 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+_DIGEST_SIZE = hashlib.sha256().digest_size
+
+
+class BundleCache:
+    """On-disk, CID-keyed cache of IPFS bundles.
+
+    Files are sharded by the first byte of ``sha256(cid)``. Each file starts
+    with the SHA-256 of its payload so corruption on disk is detected on
+    read. Hits are read into memory, so no file stays open or mapped and
+    eviction can always remove it. Total size is bounded by ``max_bytes``
+    with least-recently-used eviction: the directory is scanned once (by
+    mtime, which hits refresh) and a running total is kept from then on.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "corrupt": 0}
+        # path -> size in least-recently-used order; built on first use
+        self._entries = None
+        self._total = 0
+
+    def _path(self, cid):
+        key = hashlib.sha256(cid.encode()).hexdigest()
+        return os.path.join(self.directory, key[:2], key)
+
+    def _index(self):
+        """The LRU index, scanning the directory the first time. Call with the lock held."""
+        if self._entries is None:
+            found = []
+            if os.path.isdir(self.directory):
+                for shard in os.scandir(self.directory):
+                    if not shard.is_dir():
+                        continue
+                    for entry in os.scandir(shard.path):
+                        if entry.name.endswith(".tmp"):
+                            continue
+                        stat = entry.stat()
+                        found.append((stat.st_mtime, entry.path, stat.st_size))
+            found.sort()
+            self._entries = OrderedDict((path, size) for _, path, size in found)
+            self._total = sum(self._entries.values())
+        return self._entries
+
+    def get(self, cid):
+        path = self._path(cid)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            self.stats["misses"] += 1
+            return None
+
+        view = memoryview(data)
+        if len(view) < _DIGEST_SIZE or hashlib.sha256(view[_DIGEST_SIZE:]).digest() != view[:_DIGEST_SIZE]:
+            self.stats["corrupt"] += 1
+            self.stats["misses"] += 1
+            with self._lock:
+                self._forget(path)
+            self._remove(path)
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            entries = self._index()
+            if path in entries:
+                entries.move_to_end(path)
+        self.stats["hits"] += 1
+        return view[_DIGEST_SIZE:]
+
+    def put(self, cid, data):
+        """Stores ``data`` under ``cid``; the caller must have verified the CID."""
+        size = len(data) + _DIGEST_SIZE
+        if size > self.max_bytes:
+            return
+        path = self._path(cid)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(hashlib.sha256(data).digest())
+            f.write(data)
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            # Windows refuses to replace a file another process has open; keep the old copy
+            self._remove(tmp_path)
+            return
+        with self._lock:
+            self._forget(path)
+            self._index()[path] = size
+            self._total += size
+            self._evict()
+
+    def discard(self, cid):
+        """Removes ``cid`` from the cache, e.g. once its bundle is revoked."""
+        path = self._path(cid)
+        with self._lock:
+            self._forget(path)
+        self._remove(path)
+
+    def _forget(self, path):
+        size = self._index().pop(path, None)
+        if size is not None:
+            self._total -= size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            # Already gone, or still open elsewhere on Windows; a later eviction retries
+            pass
+
+    def _evict(self):
+        entries = self._index()
+        while self._total > self.max_bytes and entries:
+            path, size = entries.popitem(last=False)
+            self._total -= size
+            self._remove(path)
+            self.stats["evictions"] += 1
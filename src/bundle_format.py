@@ -0,0 +1,171 @@
+import json
+import pickle
+import struct
+import zlib
+
+# Fixed header: magic, version, flags, projection, distance mode, poly degree,
+# plain modulus, threshold, section count, reserved
+BUNDLE_MAGIC = b"SFBN"
+BUNDLE_VERSION = 1
+_HEADER = struct.Struct("<4sBBBBIQdHH")
+# Section table entry: section id, compression, padding, offset, stored length
+_SECTION = struct.Struct("<BB6xQQ")
+
+SECTION_CONTEXT = 1
+SECTION_EMBEDDING = 2
+SECTION_METADATA = 3
+
+# Header flags
+FLAG_GROUP = 0x01
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+
+_PROJECTIONS = ["dense", "fast", "reduced"]
+_DISTANCE_MODES = ["rotate", "slotwise"]
+
+
+def encode_bundle(sections, poly_degree, plain_modulus, threshold, projection="dense",
+                  distance_mode="rotate", metadata=None, compress=False, flags=0):
+    """Encodes ``sections`` (a list of ``(section_id, bytes)``) into one binary bundle.
+
+    Context and embedding sections are zlib-compressed when ``compress`` is
+    set; ``metadata`` is stored as a JSON section. A ``(section_id, bytes,
+    compression)`` entry is already in stored form (see
+    ``BundleView.raw_section``) and is copied as is.
+    """
+    sections = list(sections)
+    if metadata:
+        sections.append((SECTION_METADATA, json.dumps(metadata).encode()))
+
+    header_size = _HEADER.size + _SECTION.size * len(sections)
+    table = []
+    payloads = []
+    offset = header_size
+    for section_id, payload, *stored in sections:
+        compression = stored[0] if stored else COMPRESSION_NONE
+        if compress and not stored and section_id != SECTION_METADATA:
+            payload = zlib.compress(payload)
+            compression = COMPRESSION_ZLIB
+        table.append(_SECTION.pack(section_id, compression, offset, len(payload)))
+        payloads.append(payload)
+        offset += len(payload)
+
+    header = _HEADER.pack(
+        BUNDLE_MAGIC, BUNDLE_VERSION, flags,
+        _PROJECTIONS.index(projection), _DISTANCE_MODES.index(distance_mode),
+        poly_degree, plain_modulus, threshold, len(sections), 0,
+    )
+    return b"".join([header, *table, *payloads])
+
+
+def is_legacy_bundle(data):
+    """Bundles written before the binary format are pickled dicts."""
+    return bytes(data[:1]) == b"\x80"
+
+
+class BundleView:
+    """Read-only view over an encoded bundle.
+
+    Header fields are parsed without touching the ciphertext, and
+    uncompressed sections are returned as ``memoryview`` slices of the
+    original buffer.
+    """
+
+    def __init__(self, data):
+        self._buffer = memoryview(data)
+        if len(self._buffer) < _HEADER.size:
+            raise ValueError("❌ Bundle is truncated")
+        (magic, version, self.flags, projection, distance_mode, self.poly_degree,
+         self.plain_modulus, self.threshold, count, _) = _HEADER.unpack_from(self._buffer)
+        if magic != BUNDLE_MAGIC:
+            raise ValueError("❌ Not a SecureFace bundle")
+        if version > BUNDLE_VERSION:
+            raise ValueError(f"❌ Unsupported bundle version: {version}")
+        self.version = version
+        if projection >= len(_PROJECTIONS):
+            raise ValueError(f"❌ Unknown bundle projection: {projection}")
+        if distance_mode >= len(_DISTANCE_MODES):
+            raise ValueError(f"❌ Unknown bundle distance mode: {distance_mode}")
+        self.projection = _PROJECTIONS[projection]
+        self.distance_mode = _DISTANCE_MODES[distance_mode]
+        if _HEADER.size + count * _SECTION.size > len(self._buffer):
+            raise ValueError("❌ Bundle is truncated")
+        self._table = [
+            _SECTION.unpack_from(self._buffer, _HEADER.size + i * _SECTION.size)
+            for i in range(count)
+        ]
+        for _, _, offset, length in self._table:
+            if offset + length > len(self._buffer):
+                raise ValueError("❌ Bundle is truncated")
+        self._metadata = None
+
+    def sections(self, section_id):
+        found = []
+        for entry_id, compression, offset, length in self._table:
+            if entry_id != section_id:
+                continue
+            payload = self._buffer[offset:offset + length]
+            if compression == COMPRESSION_ZLIB:
+                payload = memoryview(zlib.decompress(payload))
+            found.append(payload)
+        return found
+
+    def section(self, section_id):
+        found = self.sections(section_id)
+        if not found:
+            raise KeyError(f"❌ Bundle has no section {section_id}")
+        return found[0]
+
+    def raw_section(self, section_id):
+        """``(payload, compression)`` of a section as stored, without decompressing."""
+        for entry_id, compression, offset, length in self._table:
+            if entry_id == section_id:
+                return self._buffer[offset:offset + length], compression
+        raise KeyError(f"❌ Bundle has no section {section_id}")
+
+    @property
+    def metadata(self):
+        if self._metadata is None:
+            found = self.sections(SECTION_METADATA)
+            self._metadata = json.loads(bytes(found[0])) if found else {}
+        return self._metadata
+
+
+class LegacyBundleView:
+    """Exposes a pickled bundle through the same interface as ``BundleView``."""
+
+    def __init__(self, data):
+        fields = pickle.loads(data)
+        self.version = 0
+        self.flags = FLAG_GROUP if "encrypted_templates" in fields else 0
+        self.poly_degree = None
+        self.plain_modulus = None
+        self.threshold = fields.get("threshold")
+        self.projection = fields.get("projection", "dense")
+        self.distance_mode = fields.get("distance_mode", "rotate")
+        self._sections = {SECTION_CONTEXT: [fields["encrypted_context"]]}
+        if "encrypted_embedding" in fields:
+            self._sections[SECTION_EMBEDDING] = [fields["encrypted_embedding"]]
+        else:
+            self._sections[SECTION_EMBEDDING] = list(fields["encrypted_templates"])
+        self.metadata = {
+            key: value for key, value in fields.items()
+            if key in ("thresholds", "labels", "template_size")
+        }
+
+    def sections(self, section_id):
+        return [memoryview(payload) for payload in self._sections.get(section_id, [])]
+
+    def section(self, section_id):
+        found = self.sections(section_id)
+        if not found:
+            raise KeyError(f"❌ Bundle has no section {section_id}")
+        return found[0]
+
+
+def open_bundle(data):
+    """Returns a view over a binary or legacy pickle bundle."""
+    if is_legacy_bundle(data):
+        return LegacyBundleView(data)
+    return BundleView(data)
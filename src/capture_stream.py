@@ -0,0 +1,327 @@
+"""Streaming face capture that keeps frames in memory and picks the best ones.
+
+A reader thread pulls frames from a webcam, a video file or a directory of
+images and always keeps only the latest one; a detector thread runs MTCNN on
+a downscaled copy of it. Frames with a confident, large enough face are
+scored by detection probability, face size and sharpness (variance of the
+Laplacian over the face), and the best few are returned as BGR arrays that
+``get_face_embeddings`` takes directly. No keypress or temporary file is
+needed, so a video file or image directory runs the capture headless.
+
+    CAPTURE_MODE=stream CAPTURE_SOURCE=clips/alice.mp4 python main.py
+"""
+import heapq
+import logging
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from face_processing import IMG_SIZE, get_mtcnn
+
+logger = logging.getLogger("CaptureStream")
+
+# "stream" selects frames automatically; "snapshot" keeps the SPACE-to-capture window
+CAPTURE_MODE = os.getenv("CAPTURE_MODE", "stream")
+# Camera index, video file or image directory
+CAPTURE_SOURCE = os.getenv("CAPTURE_SOURCE", "0")
+# Width MTCNN sees; detection on a full 1080p frame is several times slower
+DETECT_WIDTH = int(os.getenv("CAPTURE_DETECT_WIDTH", "320"))
+MIN_FACE_PROB = float(os.getenv("CAPTURE_MIN_PROB", "0.95"))
+# Smallest face side, in full-resolution pixels, worth embedding
+MIN_FACE_SIZE = int(os.getenv("CAPTURE_MIN_FACE", "80"))
+CAPTURE_TIMEOUT = float(os.getenv("CAPTURE_TIMEOUT", "15"))
+# How long to keep looking for better frames once enough candidates exist
+SETTLE_SECONDS = float(os.getenv("CAPTURE_SETTLE", "1.5"))
+CAPTURE_PREVIEW = os.getenv("CAPTURE_PREVIEW", "auto")
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+# Context kept around a candidate's face, as a fraction of its side, so MTCNN finds it again
+CROP_MARGIN = 0.5
+# Larger faces are downscaled in the kept crop; MTCNN resizes them to IMG_SIZE for FaceNet anyway
+CROP_FACE_SIZE = IMG_SIZE
+
+
+def _open_camera(index):
+    # DirectShow opens much faster than MSMF on Windows
+    backend = cv2.CAP_DSHOW if os.name == "nt" else cv2.CAP_ANY
+    return cv2.VideoCapture(index, backend)
+
+
+def iter_frames(source=None):
+    """Yields BGR frames from a camera index, video file or image directory."""
+    source = CAPTURE_SOURCE if source is None else str(source)
+    if os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                frame = cv2.imread(os.path.join(source, name))
+                if frame is not None:
+                    yield frame
+        return
+
+    cap = _open_camera(int(source)) if source.isdigit() else cv2.VideoCapture(source)
+    if not cap.isOpened():
+        raise ValueError(f"❌ Could not open capture source {source!r}")
+    try:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                return
+            yield frame
+    finally:
+        cap.release()
+
+
+def is_live(source=None):
+    """True for a camera, where frames keep coming until we stop reading."""
+    source = CAPTURE_SOURCE if source is None else str(source)
+    return source.isdigit()
+
+
+def sharpness(gray):
+    """Variance of the Laplacian; blurred or moving faces score low."""
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+
+class FrameCandidate:
+    """A scored face. Only a padded, size-capped crop is kept, not the full frame."""
+
+    def __init__(self, index, frame, box, prob):
+        self.index = index
+        self.box = box
+        self.prob = prob
+        x1, y1, x2, y2 = (int(round(v)) for v in box)
+        h, w = frame.shape[:2]
+        face = frame[max(y1, 0):min(y2, h), max(x1, 0):min(x2, w)]
+        self.size = min(x2 - x1, y2 - y1)
+        self.sharpness = sharpness(cv2.cvtColor(face, cv2.COLOR_BGR2GRAY)) if face.size else 0.0
+        self.crop = self._crop(frame, x1, y1, x2, y2)
+
+    def _crop(self, frame, x1, y1, x2, y2):
+        h, w = frame.shape[:2]
+        pad = int(CROP_MARGIN * max(x2 - x1, y2 - y1))
+        crop = frame[max(y1 - pad, 0):min(y2 + pad, h), max(x1 - pad, 0):min(x2 + pad, w)]
+        ratio = CROP_FACE_SIZE / max(self.size, 1)
+        if ratio < 1.0:
+            return cv2.resize(crop, (int(crop.shape[1] * ratio), int(crop.shape[0] * ratio)),
+                              interpolation=cv2.INTER_AREA)
+        # A copy, so the full frame it was sliced from can be freed
+        return crop.copy()
+
+    @property
+    def score(self):
+        # Sharpness spans orders of magnitude, so its log is weighed against size
+        return self.prob * np.log1p(self.sharpness) * np.sqrt(self.size)
+
+
+class StreamingCapture:
+    """Collects face candidates from a frame source on background threads.
+
+    The reader never waits for the detector: it overwrites a single slot, so
+    the detector always works on the most recent frame and a slow MTCNN only
+    lowers how many frames get scored. Files and directories are read at
+    the detector's pace instead, so no frame of a recording is skipped.
+    Only the ``keep`` best-scoring candidates are kept, each as a face crop.
+    """
+
+    def __init__(self, source=None, detect_width=None, min_prob=None, min_face=None, keep=30):
+        self.source = CAPTURE_SOURCE if source is None else str(source)
+        self.live = is_live(self.source)
+        self.detect_width = detect_width or DETECT_WIDTH
+        self.min_prob = MIN_FACE_PROB if min_prob is None else min_prob
+        self.min_face = MIN_FACE_SIZE if min_face is None else min_face
+        self.keep = keep
+
+        # Min-heap of (score, index, candidate), so the worst kept one is dropped first
+        self._kept = []
+        self.faces_found = 0
+        self.frames_read = 0
+        self.frames_scored = 0
+        self.error = None
+        self.latest = None
+        self._pending = None
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._done = False
+        self._threads = []
+
+    def start(self):
+        self._threads = [
+            threading.Thread(target=self._read, name="capture-read", daemon=True),
+            threading.Thread(target=self._detect, name="capture-detect", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+    @property
+    def finished(self):
+        """True once the source is exhausted and every frame was scored."""
+        # The detector only exits after scoring the last frame
+        return bool(self._threads) and not self._threads[1].is_alive()
+
+    def _read(self):
+        try:
+            for frame in iter_frames(self.source):
+                with self._cond:
+                    if not self.live:
+                        # Recordings have no real-time constraint: wait for the detector
+                        self._cond.wait_for(lambda: self._pending is None or self._stop.is_set())
+                    if self._stop.is_set():
+                        return
+                    self._pending = (self.frames_read, frame)
+                    self.latest = frame
+                    self.frames_read += 1
+                    self._cond.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            with self._cond:
+                self._done = True
+                self._cond.notify_all()
+
+    def _detect(self):
+        mtcnn = get_mtcnn()
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending is not None or self._done or self._stop.is_set())
+                if self._stop.is_set() or self._pending is None:
+                    return
+                index, frame = self._pending
+                self._pending = None
+                self._cond.notify_all()
+            try:
+                candidate = self._score(mtcnn, index, frame)
+            except Exception as e:
+                logger.warning(f"⚠️ Detection failed on frame {index}: {e}")
+                candidate = None
+            with self._cond:
+                self.frames_scored += 1
+                if candidate is not None:
+                    self.faces_found += 1
+                    entry = (candidate.score, candidate.index, candidate)
+                    if len(self._kept) < self.keep:
+                        heapq.heappush(self._kept, entry)
+                    elif entry > self._kept[0]:
+                        heapq.heapreplace(self._kept, entry)
+                self._cond.notify_all()
+
+    def _score(self, mtcnn, index, frame):
+        h, w = frame.shape[:2]
+        ratio = min(1.0, self.detect_width / w)
+        small = frame if ratio == 1.0 else cv2.resize(frame, (int(w * ratio), int(h * ratio)),
+                                                      interpolation=cv2.INTER_AREA)
+        boxes, probs = mtcnn.detect(cv2.cvtColor(small, cv2.COLOR_BGR2RGB))
+        if boxes is None:
+            return None
+        # Registration and login expect the subject to be the largest face
+        best = max(range(len(boxes)), key=lambda i: (boxes[i][2] - boxes[i][0]) * (boxes[i][3] - boxes[i][1]))
+        prob = float(probs[best])
+        if prob < self.min_prob:
+            return None
+        candidate = FrameCandidate(index, frame, np.asarray(boxes[best]) / ratio, prob)
+        if candidate.size < self.min_face:
+            return None
+        return candidate
+
+    def best(self, count, min_gap=1):
+        """The ``count`` highest-scoring candidates at least ``min_gap`` frames apart."""
+        with self._cond:
+            ranked = sorted(self._kept, reverse=True)
+        chosen = []
+        for _, _, candidate in ranked:
+            if all(abs(candidate.index - c.index) >= min_gap for c in chosen):
+                chosen.append(candidate)
+                if len(chosen) == count:
+                    break
+        return sorted(chosen, key=lambda c: c.index)
+
+
+def _preview_enabled(live):
+    if CAPTURE_PREVIEW == "auto":
+        return live and (os.name == "nt" or bool(os.getenv("DISPLAY")))
+    return CAPTURE_PREVIEW == "1"
+
+
+def _show(stream, count):
+    frame = stream.latest
+    if frame is None:
+        return True
+    frame = frame.copy()
+    for candidate in stream.best(count):
+        x1, y1, x2, y2 = (int(v) for v in candidate.box)
+        cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 200, 0), 2)
+    cv2.putText(frame, f"{stream.faces_found} candidates (ESC to cancel)", (10, 30),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 200, 0), 2)
+    cv2.imshow("SecureFace capture", frame)
+    return cv2.waitKey(1) & 0xFF != 27
+
+
+def capture_frames(count=1, source=None, timeout=None, min_gap=None):
+    """Returns the ``count`` best faces from ``source`` as padded BGR crops.
+
+    A camera is read until there are several times ``count`` candidates and
+    no better frame has turned up for ``SETTLE_SECONDS``, or until
+    ``timeout``; a file or directory is read to the end or until ``timeout``,
+    whichever comes first. For several frames
+    (registration) they are picked at least a few frames apart so they are
+    not near-duplicates. Returns ``None`` if the preview window is closed
+    with ESC, and raises ``ValueError`` if too few usable faces were found.
+    """
+    timeout = CAPTURE_TIMEOUT if timeout is None else timeout
+    live = is_live(source)
+    # Live frames ~30 fps apart are near-identical, so spread picks over ~⅓ s
+    min_gap = min_gap if min_gap is not None else (10 if live and count > 1 else 1)
+    # Each pick rules out fewer than 2 * min_gap neighbours, so this many
+    # top candidates always contain the same picks as the full list would
+    stream = StreamingCapture(source, keep=count * (2 * min_gap - 1)).start()
+    preview = _preview_enabled(live)
+    wanted = count * 3
+    deadline = time.monotonic() + timeout
+    settled_since, last_best = None, None
+
+    if stream.live:
+        print(f"📸 Look at the camera, capturing {count} frame(s)...")
+    try:
+        while not stream.finished and time.monotonic() < deadline:
+            if stream.error is not None:
+                raise ValueError(f"❌ Capture failed: {stream.error}")
+            if preview and not _show(stream, count):
+                print("❌ Capture canceled.")
+                return None
+            if stream.live and stream.faces_found >= wanted:
+                best = stream.best(count, min_gap)
+                scores = [c.score for c in best]
+                if scores != last_best:
+                    settled_since, last_best = time.monotonic(), scores
+                elif time.monotonic() - settled_since >= SETTLE_SECONDS:
+                    break
+            time.sleep(0.01 if preview else 0.05)
+    finally:
+        stream.stop()
+        if preview:
+            cv2.destroyAllWindows()
+
+    if stream.error is not None:
+        raise ValueError(f"❌ Capture failed: {stream.error}")
+    chosen = stream.best(count, min_gap)
+    logger.info(f"Scored {stream.frames_scored}/{stream.frames_read} frames, "
+                f"{stream.faces_found} with a usable face")
+    if len(chosen) < count:
+        raise ValueError(f"❌ Only found {len(chosen)} usable face frame(s), need {count}")
+    return [c.crop for c in chosen]
+
+
+def capture_frame(source=None, timeout=None):
+    """The single best face frame, for authentication."""
+    frames = capture_frames(1, source, timeout)
+    return None if frames is None else frames[0]
@@ -0,0 +1,49 @@
+import base64
+import hashlib
+
+import base58
+
+# Codec byte stored on chain: 1 marks a CIDv0, anything else is the CIDv1 multicodec
+CODEC_CIDV0 = 0x01
+CODEC_DAG_PB = 0x70
+CODEC_RAW = 0x55
+_SHA2_256 = b"\x12\x20"
+
+
+def encode_cid(cid):
+    """Splits a sha2-256 CID string into ``(digest, codec)`` for BiometricStorageV2."""
+    if cid.startswith("Qm"):
+        multihash = base58.b58decode(cid)
+        codec = CODEC_CIDV0
+    elif cid.startswith("b"):
+        body = cid[1:].upper()
+        raw = base64.b32decode(body + "=" * (-len(body) % 8))
+        # Single-byte varints: CID version 1 followed by a content codec below 0x80
+        if raw[0] != 0x01 or raw[1] >= 0x80:
+            raise ValueError(f"❌ Unsupported CID: {cid}")
+        codec = raw[1]
+        multihash = raw[2:]
+    else:
+        raise ValueError(f"❌ Unsupported CID encoding: {cid}")
+    if len(multihash) != 34 or multihash[:2] != _SHA2_256:
+        raise ValueError(f"❌ Only sha2-256 CIDs can be stored compactly: {cid}")
+    return multihash[2:], codec
+
+
+def decode_cid(digest, codec):
+    """Rebuilds the CID string from its on-chain ``(digest, codec)``."""
+    multihash = _SHA2_256 + bytes(digest)
+    if codec == CODEC_CIDV0:
+        return base58.b58encode(multihash).decode()
+    raw = bytes([0x01, codec]) + multihash
+    return "b" + base64.b32encode(raw).decode().lower().rstrip("=")
+
+
+def uid_to_bytes32(uid):
+    """Returns the 32-byte key for a UID; ``generate_uid`` already yields 64 hex chars."""
+    if len(uid) == 64:
+        try:
+            return bytes.fromhex(uid)
+        except ValueError:
+            pass
+    return hashlib.sha256(uid.encode()).digest()
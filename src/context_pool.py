@@ -0,0 +1,73 @@
+import threading
+import logging
+from collections import deque
+
+logger = logging.getLogger("ContextPool")
+
+
+class ContextPool:
+    """Keeps ready-to-use HE contexts per parameter set, filled in the background.
+
+    ``factory(*params)`` builds one context. ``start(*params)`` registers a
+    parameter set and launches the worker that keeps ``target_size`` contexts
+    ready for it. ``acquire(*params)`` pops a ready context, which is
+    therefore handed out exactly once, or builds one synchronously when
+    none is ready.
+    """
+
+    def __init__(self, factory, target_size):
+        self._factory = factory
+        self.target_size = target_size
+        self._ready = {}
+        self._cond = threading.Condition()
+        self._worker = None
+        self.stats = {"hits": 0, "misses": 0, "generated": 0}
+
+    def start(self, *params):
+        if self.target_size <= 0:
+            return
+        with self._cond:
+            self._ready.setdefault(params, deque())
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._fill, name="context-pool", daemon=True)
+                self._worker.start()
+            self._cond.notify()
+
+    def acquire(self, *params):
+        with self._cond:
+            ready = self._ready.get(params)
+            if ready:
+                context = ready.popleft()
+                self.stats["hits"] += 1
+                self._cond.notify()
+                return context
+            self.stats["misses"] += 1
+        return self._factory(*params)
+
+    def info(self):
+        with self._cond:
+            return dict(self.stats, ready={params: len(ready) for params, ready in self._ready.items()})
+
+    def _next_params(self):
+        for params, ready in self._ready.items():
+            if len(ready) < self.target_size:
+                return params
+        return None
+
+    def _fill(self):
+        while True:
+            with self._cond:
+                params = self._next_params()
+                while params is None:
+                    self._cond.wait()
+                    params = self._next_params()
+            try:
+                context = self._factory(*params)
+            except Exception as e:
+                logger.error(f"❌ Background context generation failed: {e}")
+                with self._cond:
+                    self._worker = None
+                return
+            with self._cond:
+                self._ready[params].append(context)
+                self.stats["generated"] += 1
@@ -1,23 +1,76 @@
 import tenseal as ts
 import numpy as np
-import pickle
 import hashlib
 import os
+import threading
+import time
+from collections import OrderedDict
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.backends import default_backend
 from dotenv import load_dotenv
 
+import metrics
+from context_pool import ContextPool
+from bundle_format import (
+    FLAG_GROUP,
+    SECTION_CONTEXT,
+    SECTION_EMBEDDING,
+    COMPRESSION_ZLIB,
+    encode_bundle,
+    is_legacy_bundle,
+    open_bundle,
+)
+
 load_dotenv()
 
 SCALE_FACTOR = int(os.getenv("SCALE_FACTOR"))
 POLY_DEGREE = int(os.getenv("POLY_DEGREE"))
 PRIME_MODULUS = int(os.getenv("PRIME_MODULUS"))
 EMBEDDING_SIZE = int(os.getenv("EMBEDDING_SIZE"))
+# "dense" is the original Gaussian matrix; "fast" is a seeded sign-flip + Hadamard transform;
+# "reduced" keeps TEMPLATE_DIM of the Hadamard outputs (a subsampled randomized Hadamard transform)
+PROJECTION_MODE = os.getenv("PROJECTION_MODE", "dense")
+TEMPLATE_DIM = int(os.getenv("TEMPLATE_DIM", "128"))
+# 0 keeps fixed-point SCALE_FACTOR encoding; 8 or 16 quantizes templates to that many signed bits
+TEMPLATE_BITS = int(os.getenv("TEMPLATE_BITS", "0"))
+# Quantization clips coordinates beyond this many standard deviations of the template
+QUANT_CLIP_SIGMAS = 4.0
+PROJECTION_CACHE_BYTES = int(os.getenv("PROJECTION_CACHE_MB", "64")) * 1024 * 1024
+
+# "rotate" sums the squared differences homomorphically and needs Galois keys;
+# "slotwise" decrypts the squared-difference vector and sums it in plaintext
+DISTANCE_MODE = os.getenv("DISTANCE_MODE", "rotate")
+BUNDLE_COMPRESSION = os.getenv("BUNDLE_COMPRESSION", "0") == "1"
+HE_CONTEXT_POOL_SIZE = int(os.getenv("HE_CONTEXT_POOL_SIZE", "1"))
+HE_CONTEXT_CACHE_SIZE = int(os.getenv("HE_CONTEXT_CACHE_SIZE", "8"))
+HE_CONTEXT_CACHE_TTL = float(os.getenv("HE_CONTEXT_CACHE_TTL", "300"))
+# Comma-separated coefficient-modulus prime sizes; empty keeps SEAL's 128-bit default
+COEFF_MOD_BIT_SIZES = [int(bits) for bits in os.getenv("COEFF_MOD_BIT_SIZES", "").split(",") if bits.strip()]
+# Threads SEAL uses per context; 0 keeps TenSEAL's default of one per core
+HE_THREADS = int(os.getenv("HE_THREADS", "0"))
+
+_projection_cache = OrderedDict()
+_projection_cache_bytes = 0
+_projection_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+_projection_lock = threading.Lock()
+
+
+BASE_THRESHOLD = 0.25
+# A refresh weighs the new capture by 1/min(templates, REFRESH_WINDOW), so
+# the template becomes a moving average that follows ageing
+REFRESH_WINDOW = int(os.getenv("REFRESH_WINDOW", "20"))
+# Distances needed in the statistics before a refresh moves the threshold
+REFRESH_MIN_SAMPLES = 5
+# Largest factor one refresh may raise the threshold by
+REFRESH_MAX_GROWTH = 1.05
 
 
 def hash_seed(user_seed):
     return hashlib.sha256(user_seed.encode()).digest()
 
+def generate_uid(pin: str, salt: str) -> str:
+    return hashlib.sha256((pin + salt).encode()).hexdigest()
+
 def aes_encrypt(key, data):
     iv = os.urandom(12)
     cipher = Cipher(algorithms.AES(key[:32]), modes.GCM(iv), backend=default_backend())
@@ -26,85 +79,671 @@ def aes_encrypt(key, data):
     return iv + encryptor.tag + ciphertext
 
 def aes_decrypt(key, encrypted_data):
-    iv = encrypted_data[:12]
-    tag = encrypted_data[12:28]
+    # Accepts bytes or a memoryview; only the nonce and tag are copied
+    iv = bytes(encrypted_data[:12])
+    tag = bytes(encrypted_data[12:28])
     ciphertext = encrypted_data[28:]
     cipher = Cipher(algorithms.AES(key[:32]), modes.GCM(iv, tag), backend=default_backend())
     decryptor = cipher.decryptor()
     return decryptor.update(ciphertext) + decryptor.finalize()
 
-def create_initial_context():
-    context = ts.context(ts.SCHEME_TYPE.BFV, POLY_DEGREE, PRIME_MODULUS)
-    context.generate_galois_keys()
+def _generate_context(poly_degree, prime_modulus, galois_keys=True):
+    context = ts.context(ts.SCHEME_TYPE.BFV, poly_degree, prime_modulus,
+                         coeff_mod_bit_sizes=COEFF_MOD_BIT_SIZES, n_threads=HE_THREADS or None)
+    if galois_keys:
+        context.generate_galois_keys()
     return context
 
+context_pool = ContextPool(_generate_context, HE_CONTEXT_POOL_SIZE)
+metrics.register_cache("he_context_pool", context_pool.info)
+
+def warm_context_pool(distance_mode=None):
+    """Starts pre-generating contexts for the configured HE parameters."""
+    distance_mode = distance_mode or DISTANCE_MODE
+    context_pool.start(POLY_DEGREE, PRIME_MODULUS, distance_mode == "rotate")
+
+@metrics.timed("he.context_acquire")
+def create_initial_context(galois_keys=True):
+    # Only blocks on keygen when no pre-generated context is ready
+    return context_pool.acquire(POLY_DEGREE, PRIME_MODULUS, galois_keys)
+
 def serialize_context_with_secret(context):
     return context.serialize(save_secret_key=True)
 
-def load_context(serialized_context):
-    return ts.context_from(serialized_context)
+def load_context(serialized_context, n_threads=None):
+    return ts.context_from(serialized_context, n_threads or HE_THREADS or None)
+
+class _CachedContext:
+    def __init__(self, context, expires):
+        self.context = context
+        self.expires = expires
+        self.users = 0
+        self.cached = True
+
+
+def _drop_secret_key(context):
+    # Leaves the public parts in place for whoever still holds a ciphertext
+    context.make_context_public()
+
+
+class ContextCache:
+    """LRU cache of decrypted HE contexts with TTL and size-based eviction.
+
+    Entries are keyed by a hash of the encrypted context's digest and the
+    user's seed hash, so a wrong PIN never hits another user's entry and the
+    PIN-derived key is never held as a key. Contexts are borrowed with
+    ``acquire`` and handed back with ``release``. Once a context has left
+    the cache (expiry, eviction or ``clear``) and its last borrower has
+    released it, its secret key is dropped. A background sweep expires idle
+    entries even when no request touches the cache.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        # id(context) -> entry, for every context handed out and not yet released
+        self._borrowed = {}
+        self._lock = threading.Lock()
+        self._sweeper = None
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    @staticmethod
+    def make_key(encrypted_context, seed_hash):
+        return hashlib.sha256(hashlib.sha256(encrypted_context).digest() + seed_hash).digest()
+
+    def acquire(self, key, load):
+        """Returns the context for ``key``, calling ``load()`` on a miss; pair with ``release``."""
+        with self._lock:
+            self._expire(time.monotonic())
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return self._lend(entry)
+            self.stats["misses"] += 1
+
+        entry = _CachedContext(load(), time.monotonic() + self.ttl)
+        with self._lock:
+            if self.max_entries <= 0:
+                entry.cached = False
+                return self._lend(entry)
+            if key in self._entries:
+                self._evict(key)
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._evict(next(iter(self._entries)))
+            self._start_sweeper()
+            return self._lend(entry)
+
+    def release(self, context):
+        """Hands back a context from ``acquire``; unknown contexts are ignored."""
+        with self._lock:
+            entry = self._borrowed.get(id(context))
+            if entry is None:
+                return
+            entry.users -= 1
+            if entry.users == 0:
+                del self._borrowed[id(context)]
+                if not entry.cached:
+                    _drop_secret_key(entry.context)
+
+    def discard(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._evict(key)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._evict(key)
+
+    def info(self):
+        with self._lock:
+            return dict(self.stats, entries=len(self._entries))
+
+    def _lend(self, entry):
+        entry.users += 1
+        self._borrowed[id(entry.context)] = entry
+        return entry.context
+
+    def _expire(self, now):
+        for key in [k for k, entry in self._entries.items() if entry.expires <= now]:
+            self._evict(key)
+
+    def _evict(self, key):
+        entry = self._entries.pop(key)
+        entry.cached = False
+        if entry.users == 0:
+            _drop_secret_key(entry.context)
+        self.stats["evictions"] += 1
+
+    def _start_sweeper(self):
+        if self._sweeper is not None:
+            return
+
+        def _sweep():
+            while True:
+                time.sleep(max(self.ttl / 4, 1.0))
+                with self._lock:
+                    self._expire(time.monotonic())
+
+        self._sweeper = threading.Thread(target=_sweep, name="context-cache-sweep", daemon=True)
+        self._sweeper.start()
+
+
+context_cache = ContextCache(HE_CONTEXT_CACHE_SIZE, HE_CONTEXT_CACHE_TTL)
+metrics.register_cache("he_context", context_cache.info)
 
 def generate_projection_matrix(seed_hash):
-    np.random.seed(int.from_bytes(seed_hash[:4], 'big'))
-    proj_matrix = np.random.randn(EMBEDDING_SIZE, EMBEDDING_SIZE)
+    # A private RandomState draws the same stream the global np.random.seed()
+    # did, so existing enrollments keep their matrix without touching global state
+    rng = np.random.RandomState(int.from_bytes(seed_hash[:4], 'big'))
+    proj_matrix = rng.randn(EMBEDDING_SIZE, EMBEDDING_SIZE)
     
     norm_factor = np.linalg.norm(proj_matrix)
     proj_matrix /= norm_factor  
 
     return proj_matrix
 
-def apply_user_specific_projection(embedding, user_seed):
+def generate_fast_projection(seed_hash):
+    """Seeded sign flips and output permutation for the Hadamard projection."""
+    rng = np.random.default_rng(int.from_bytes(seed_hash, 'big'))
+    size = 1 << (EMBEDDING_SIZE - 1).bit_length()
+    signs = rng.choice(np.array([-1.0, 1.0]), size=size)
+    permutation = rng.permutation(size)
+    return signs, permutation
+
+def _hadamard_transform(x):
+    """Unnormalized fast Walsh-Hadamard transform along the last axis."""
+    n = x.shape[-1]
+    lead = x.shape[:-1]
+    h = 1
+    while h < n:
+        x = x.reshape(*lead, n // (2 * h), 2, h)
+        a, b = x[..., 0, :], x[..., 1, :]
+        x = np.stack((a + b, a - b), axis=-2)
+        h *= 2
+    return x.reshape(*lead, n)
+
+def _apply_fast_projection(embedding, signs, permutation):
+    size = signs.shape[0]
+    padded = np.zeros(embedding.shape[:-1] + (size,))
+    padded[..., :embedding.shape[-1]] = embedding
+    transformed = _hadamard_transform(padded * signs)[..., permutation]
+    # Orthonormal transform, rescaled to the same expected norm as the dense matrix
+    return transformed / np.sqrt(size * EMBEDDING_SIZE)
+
+def _apply_reduced_projection(embedding, signs, permutation, dim):
+    size = signs.shape[0]
+    if not 0 < dim <= size:
+        raise ValueError(f"❌ TEMPLATE_DIM must be between 1 and {size}")
+    padded = np.zeros(embedding.shape[:-1] + (size,))
+    padded[..., :embedding.shape[-1]] = embedding
+    # Each Hadamard output has the input's squared norm as its variance, so
+    # this gives the same expected norm as the dense matrix at any ``dim``
+    return _hadamard_transform(padded * signs)[..., permutation[:dim]] / np.sqrt(dim * EMBEDDING_SIZE)
+
+def _projection_nbytes(projection):
+    if isinstance(projection, tuple):
+        return sum(part.nbytes for part in projection)
+    return projection.nbytes
+
+def get_projection(seed_hash, mode=None):
+    """Returns the cached projection for ``seed_hash``, generating it on a miss."""
+    global _projection_cache_bytes
+    mode = mode or PROJECTION_MODE
+    if mode not in ("dense", "fast", "reduced"):
+        raise ValueError(f"❌ Unknown projection mode: {mode}")
+    # The reduced projection keeps a prefix of the fast one's outputs
+    mode = "fast" if mode == "reduced" else mode
+    key = (mode, seed_hash)
+
+    with _projection_lock:
+        projection = _projection_cache.get(key)
+        if projection is not None:
+            _projection_cache.move_to_end(key)
+            _projection_cache_stats["hits"] += 1
+            return projection
+        _projection_cache_stats["misses"] += 1
+
+    if mode == "dense":
+        projection = generate_projection_matrix(seed_hash)
+        projection.setflags(write=False)
+    else:
+        projection = generate_fast_projection(seed_hash)
+
+    nbytes = _projection_nbytes(projection)
+    with _projection_lock:
+        if key not in _projection_cache and nbytes <= PROJECTION_CACHE_BYTES:
+            _projection_cache[key] = projection
+            _projection_cache_bytes += nbytes
+            while _projection_cache_bytes > PROJECTION_CACHE_BYTES:
+                _, evicted = _projection_cache.popitem(last=False)
+                _projection_cache_bytes -= _projection_nbytes(evicted)
+                _projection_cache_stats["evictions"] += 1
+    return projection
+
+def projection_cache_info():
+    with _projection_lock:
+        return dict(_projection_cache_stats, entries=len(_projection_cache), bytes=_projection_cache_bytes)
+
+metrics.register_cache("projection", projection_cache_info)
+
+def apply_user_specific_projection(embedding, user_seed, mode=None, dim=None):
+    """Projects with the user's seeded transform; ``dim`` only applies to "reduced"."""
+    mode = mode or PROJECTION_MODE
     user_seed_hash = hash_seed(user_seed)
-    user_projection_matrix = generate_projection_matrix(user_seed_hash)
-    return embedding @ user_projection_matrix
+    projection = get_projection(user_seed_hash, mode)
+    if mode == "fast":
+        return _apply_fast_projection(np.asarray(embedding, dtype=np.float64), *projection)
+    if mode == "reduced":
+        return _apply_reduced_projection(np.asarray(embedding, dtype=np.float64), *projection,
+                                         dim or TEMPLATE_DIM)
+    return embedding @ projection
+
+def _padded_size(embedding_size):
+    return 1 << (embedding_size - 1).bit_length()
+
+def projection_gain(mode=None, embedding_size=None, dim=None):
+    """Upper bound on ||projected|| / ||embedding|| for every seed.
+
+    The dense matrix is divided by its Frobenius norm, which bounds its
+    spectral norm by 1; the fast transform is orthonormal and then divided
+    by sqrt(EMBEDDING_SIZE). The reduced one keeps ``dim`` of the
+    unnormalized outputs, whose full norm is sqrt(padded size) times the
+    input's, and divides by sqrt(dim * EMBEDDING_SIZE).
+    """
+    mode = mode or PROJECTION_MODE
+    embedding_size = embedding_size or EMBEDDING_SIZE
+    if mode == "dense":
+        return 1.0
+    if mode == "reduced":
+        return np.sqrt(_padded_size(embedding_size) / ((dim or TEMPLATE_DIM) * embedding_size))
+    return 1.0 / np.sqrt(embedding_size)
+
+def projected_length(mode=None, embedding_size=None, dim=None):
+    """Slots one projected template occupies."""
+    mode = mode or PROJECTION_MODE
+    embedding_size = embedding_size or EMBEDDING_SIZE
+    if mode == "dense":
+        return embedding_size
+    if mode == "reduced":
+        return dim or TEMPLATE_DIM
+    return _padded_size(embedding_size)
+
+def squared_distance_bound(projection=None, scale_factor=None, embedding_size=None, dim=None):
+    """Largest decrypted squared distance two unit-norm embeddings can produce.
+
+    Scaled coordinates are truncated toward zero, so each scaled vector has
+    norm at most ``scale_factor * gain`` and their distance at most twice
+    that. The plain modulus must exceed this for the result not to wrap.
+    """
+    scale_factor = scale_factor or SCALE_FACTOR
+    # FaceNet's float32 normalization is only exact to about 1e-7
+    radius = scale_factor * projection_gain(projection, embedding_size, dim) * (1 + 1e-6)
+    return int(np.floor((2 * radius) ** 2))
+
+
+class TemplateEncoding:
+    """Turns projected embeddings into the integers that get encrypted.
+
+    ``bits=0`` is the original fixed-point encoding: multiply by
+    SCALE_FACTOR and truncate. With 8 or 16 bits, coordinates are rounded
+    at a per-enrollment ``scale`` and clipped to the signed range, so every
+    slot is bounded whatever the input. The scale is calibrated from the
+    template's own coordinate spread (see ``QUANT_CLIP_SIGMAS``).
+    """
+
+    def __init__(self, projection="dense", bits=0, scale=None, dim=None):
+        if bits not in (0, 8, 16):
+            raise ValueError(f"❌ Unsupported template bits: {bits}")
+        self.projection = projection
+        self.bits = bits
+        self.scale = scale if bits else SCALE_FACTOR
+        self.dim = dim if projection == "reduced" else None
+
+    @classmethod
+    def calibrate(cls, projected, projection, bits, dim=None):
+        if not bits:
+            return cls(projection, 0, None, dim)
+        spread = float(np.std(projected)) or 1.0 / np.sqrt(len(projected))
+        qmax = (1 << (bits - 1)) - 1
+        return cls(projection, bits, qmax / (QUANT_CLIP_SIGMAS * spread), dim)
 
-def create_encrypted_bundle(embedding, user_seed, threshold):
+    @classmethod
+    def from_bundle(cls, bundle):
+        metadata = bundle.metadata
+        return cls(bundle.projection, metadata.get("template_bits", 0),
+                   metadata.get("template_scale"), metadata.get("template_dim"))
+
+    def metadata(self):
+        metadata = {}
+        if self.dim:
+            metadata["template_dim"] = self.dim
+        if self.bits:
+            metadata.update(template_bits=self.bits, template_scale=self.scale)
+        return metadata
+
+    def encode(self, projected):
+        if not self.bits:
+            return (projected * SCALE_FACTOR).astype(np.int64)
+        qmax = (1 << (self.bits - 1)) - 1
+        return np.clip(np.rint(projected * self.scale), -qmax, qmax).astype(np.int64)
+
+    def bound(self):
+        """Largest squared distance between two encoded templates (see squared_distance_bound)."""
+        if not self.bits:
+            return squared_distance_bound(self.projection, dim=self.dim)
+        length = projected_length(self.projection, dim=self.dim)
+        qmax = (1 << (self.bits - 1)) - 1
+        # Rounding moves each coordinate by at most half a step
+        radius = self.scale * projection_gain(self.projection, dim=self.dim) * (1 + 1e-6) + 0.5 * np.sqrt(length)
+        return min(length * (2 * qmax) ** 2, int(np.floor((2 * radius) ** 2)))
+
+    def distance(self, raw_dist):
+        return np.sqrt(raw_dist) / self.scale
+
+
+def _check_plain_modulus(encoding):
+    if encoding.bound() >= PRIME_MODULUS:
+        raise ValueError("❌ PRIME_MODULUS is too small for this template encoding; distances would wrap")
+
+def _check_distance(raw_dist, encoding):
+    # Anything above the bound is a wrapped or noise-corrupted decryption
+    if raw_dist > encoding.bound():
+        raise ValueError("❌ Decrypted distance out of range: HE parameters overflowed")
+
+def _enrollment_distances(embeddings, user_seed, projection=None):
+    projected = apply_user_specific_projection(np.asarray(embeddings), user_seed, projection)
+    return np.linalg.norm(projected[1:] - projected[0], axis=1)
+
+def calibrate_threshold(embeddings, user_seed, projection=None):
+    """Picks the match threshold from the spread of the enrollment captures.
+
+    ``embeddings[0]`` is the template; the others are compared against it.
+    """
+    dists = _enrollment_distances(embeddings, user_seed, projection)
+    return max(BASE_THRESHOLD, np.percentile(dists, 95) * 1.1)
+
+def _add_distance(stats, distance):
+    """Welford update of the running count, mean and M2 of match distances."""
+    count = stats["count"] + 1
+    delta = distance - stats["mean"]
+    mean = stats["mean"] + delta / count
+    return dict(stats, count=count, mean=mean, m2=stats["m2"] + delta * (distance - mean))
+
+def enrollment_stats(embeddings, user_seed, projection=None):
+    """Distance statistics stored in the bundle so a refresh can update the threshold."""
+    stats = {"templates": 1, "count": 0, "mean": 0.0, "m2": 0.0}
+    for distance in _enrollment_distances(embeddings, user_seed, projection):
+        stats = _add_distance(stats, float(distance))
+    return stats
+
+def _threshold_from_stats(stats):
+    # Normal approximation of calibrate_threshold's 95th percentile
+    std = np.sqrt(stats["m2"] / (stats["count"] - 1)) if stats["count"] > 1 else 0.0
+    return max(BASE_THRESHOLD, (stats["mean"] + 1.645 * std) * 1.1)
+
+@metrics.timed("he.create_bundle")
+def create_encrypted_bundle(embedding, user_seed, threshold, projection=None, distance_mode=None,
+                            template_bits=None, template_dim=None, refresh_stats=None):
     seed_hash = hash_seed(user_seed)
+    projection = projection or PROJECTION_MODE
+    template_bits = TEMPLATE_BITS if template_bits is None else template_bits
+    template_dim = template_dim or TEMPLATE_DIM
+    distance_mode = distance_mode or DISTANCE_MODE
+    if distance_mode not in ("rotate", "slotwise"):
+        raise ValueError(f"❌ Unknown distance mode: {distance_mode}")
 
-    context = create_initial_context()
+    final_embedding = apply_user_specific_projection(embedding, user_seed, projection, template_dim)
+    encoding = TemplateEncoding.calibrate(final_embedding, projection, template_bits, template_dim)
+    _check_plain_modulus(encoding)
+    scaled_embedding = encoding.encode(final_embedding)
+
+    context = create_initial_context(galois_keys=distance_mode == "rotate")
     serialized_context = serialize_context_with_secret(context)
     encrypted_serialized_context = aes_encrypt(seed_hash, serialized_context)
 
-    final_embedding = apply_user_specific_projection(embedding, user_seed)
-    scaled_embedding = (final_embedding * SCALE_FACTOR).astype(np.int64)
-
     encrypted_embedding = ts.bfv_vector(context, scaled_embedding).serialize()
 
-    bundled_data = pickle.dumps({
-        "encrypted_embedding": encrypted_embedding,
-        "encrypted_context": encrypted_serialized_context,
-        "threshold": threshold  
-    })
+    bundled_data = encode_bundle(
+        [(SECTION_CONTEXT, encrypted_serialized_context), (SECTION_EMBEDDING, encrypted_embedding)],
+        POLY_DEGREE, PRIME_MODULUS, threshold,
+        projection=projection,
+        distance_mode=distance_mode,
+        metadata=dict(encoding.metadata(), refresh=refresh_stats) if refresh_stats else encoding.metadata(),
+        compress=BUNDLE_COMPRESSION,
+    )
+    metrics.record_bytes("context", len(serialized_context))
+    metrics.record_bytes("ciphertext", len(encrypted_embedding))
+    metrics.record_bytes("bundle", len(bundled_data))
 
     return bundled_data
 
 
+@metrics.timed("he.load_context")
+def _load_context(encrypted_serialized_context, seed_hash):
+    return load_context(aes_decrypt(seed_hash, encrypted_serialized_context))
+
+
+def _open_context(encrypted_serialized_context, seed_hash):
+    """Borrows the decrypted context from the cache; hand it back with ``release_context``."""
+    cache_key = ContextCache.make_key(encrypted_serialized_context, seed_hash)
+    return context_cache.acquire(cache_key, lambda: _load_context(encrypted_serialized_context, seed_hash))
+
+
+def forget_context(bundled_data, user_seed):
+    """Evicts the bundle's decrypted context from this process's cache, e.g. after a revoke."""
+    encrypted_context = open_bundle(bundled_data).section(SECTION_CONTEXT)
+    context_cache.discard(ContextCache.make_key(encrypted_context, hash_seed(user_seed)))
+
+
+def release_context(context):
+    """Returns a context from ``compute_encrypted_distance``/``compute_group_distances`` once decrypted."""
+    context_cache.release(context)
+
+
+@metrics.timed("he.refresh_bundle")
+def refresh_encrypted_bundle(bundled_data, new_embedding, user_seed, distance):
+    """Folds an accepted capture into the stored template without new keys.
+
+    The stored context is decrypted once (or taken from the context cache)
+    and its section is copied into the new bundle byte for byte. The stored
+    template is decrypted, moved towards the new capture by a running mean
+    and encrypted again under the same keys. ``distance`` is the capture's
+    verified distance. It is added to the Welford statistics in the
+    bundle metadata, and the threshold is recomputed from them.
+    """
+    if is_legacy_bundle(bundled_data):
+        raise ValueError("❌ Legacy bundles can't be refreshed; re-register instead")
+    bundle = open_bundle(bundled_data)
+    if bundle.flags & FLAG_GROUP:
+        raise ValueError("❌ Group bundles can't be refreshed")
+    if not distance < bundle.threshold:
+        raise ValueError("❌ Only an accepted capture can refresh the template")
+
+    context = _open_context(bundle.section(SECTION_CONTEXT), hash_seed(user_seed))
+    try:
+        encoding = TemplateEncoding.from_bundle(bundle)
+        stored = ts.bfv_vector_from(context, bytes(bundle.section(SECTION_EMBEDDING)))
+        template = np.asarray(stored.decrypt(context.secret_key()), dtype=np.float64) / encoding.scale
+
+        # Bundles from before refreshes existed only have their threshold
+        stats = bundle.metadata.get("refresh") or {"templates": 1, "count": 0, "mean": 0.0, "m2": 0.0}
+        projected = apply_user_specific_projection(new_embedding, user_seed, bundle.projection, encoding.dim)
+        weight = 1.0 / min(stats["templates"] + 1, REFRESH_WINDOW)
+        updated = template + weight * (projected - template)
+        # A mean of unit embeddings is shorter than any of them; keep the enrolled
+        # length so distances stay comparable and the plain-modulus bound holds
+        updated *= np.linalg.norm(projected) / np.linalg.norm(updated)
+
+        stats = _add_distance(dict(stats, templates=stats["templates"] + 1), float(distance))
+        threshold = bundle.threshold
+        if stats["count"] >= REFRESH_MIN_SAMPLES:
+            threshold = min(_threshold_from_stats(stats), bundle.threshold * REFRESH_MAX_GROWTH)
+
+        context_section, context_compression = bundle.raw_section(SECTION_CONTEXT)
+        _, embedding_compression = bundle.raw_section(SECTION_EMBEDDING)
+        encrypted_embedding = ts.bfv_vector(context, encoding.encode(updated)).serialize()
+    finally:
+        release_context(context)
+    bundled_data = encode_bundle(
+        [(SECTION_CONTEXT, context_section, context_compression), (SECTION_EMBEDDING, encrypted_embedding)],
+        bundle.poly_degree, bundle.plain_modulus, threshold,
+        projection=bundle.projection,
+        distance_mode=bundle.distance_mode,
+        metadata=dict(bundle.metadata, refresh=stats),
+        compress=embedding_compression == COMPRESSION_ZLIB,
+    )
+    metrics.record_bytes("bundle", len(bundled_data))
+    return bundled_data
+
+
+@metrics.timed("he.compute")
 def compute_encrypted_distance(bundled_data, new_embedding, user_seed):
+    """Returns ``(encrypted_distance, context, encoding)``; pass all three to ``decrypt_distance``."""
     seed_hash = hash_seed(user_seed)
 
-    data = pickle.loads(bundled_data)
-    encrypted_serialized_context = data["encrypted_context"]
-    serialized_embedding = data["encrypted_embedding"]
+    bundle = open_bundle(bundled_data)
+    context = _open_context(bundle.section(SECTION_CONTEXT), seed_hash)
+    try:
+        encoding = TemplateEncoding.from_bundle(bundle)
+        return _compute_distance(bundle, context, encoding, new_embedding, user_seed), context, encoding
+    except BaseException:
+        release_context(context)
+        raise
 
-    serialized_context = aes_decrypt(seed_hash, encrypted_serialized_context)
-    context = load_context(serialized_context)
 
-    stored_embedding = ts.bfv_vector_from(context, serialized_embedding)
+def _compute_distance(bundle, context, encoding, new_embedding, user_seed):
+    stored_embedding = ts.bfv_vector_from(context, bytes(bundle.section(SECTION_EMBEDDING)))
 
-    final_embedding = apply_user_specific_projection(new_embedding, user_seed)
-    scaled_embedding = (final_embedding * SCALE_FACTOR).astype(np.int64)
+    final_embedding = apply_user_specific_projection(new_embedding, user_seed, bundle.projection, encoding.dim)
+    scaled_embedding = encoding.encode(final_embedding)
     encrypted_new_embedding = ts.bfv_vector(context, scaled_embedding)
 
     diff = stored_embedding - encrypted_new_embedding
     squared_diff = diff * diff
-    encrypted_distance = squared_diff.sum()
-    return encrypted_distance, context
+    if bundle.distance_mode == "slotwise":
+        # Summed after decryption, so no rotations and no Galois keys
+        return squared_diff
+    return squared_diff.sum()
 
-def decrypt_distance(encrypted_distance, context):
+@metrics.timed("he.decrypt")
+def decrypt_distance(encrypted_distance, context, encoding):
+    """Decrypts a distance with the bundle's ``encoding`` (from ``compute_encrypted_distance``)."""
     raw_dist = encrypted_distance.decrypt(context.secret_key())
-    if isinstance(raw_dist, list):
-        raw_dist = raw_dist[0]
-    if raw_dist < 0:
-        raw_dist += PRIME_MODULUS    
-    distance = np.sqrt(abs(raw_dist)) / SCALE_FACTOR
+    if not isinstance(raw_dist, list):
+        raw_dist = [raw_dist]
+    # Squared values are non-negative, so map the centered decryption back to [0, t)
+    raw_dist = sum(int(v) + PRIME_MODULUS if v < 0 else int(v) for v in raw_dist)
+    _check_distance(raw_dist, encoding)
+    distance = encoding.distance(abs(raw_dist))
     return distance
+
+
+@metrics.timed("he.create_group_bundle")
+def create_group_bundle(embeddings, group_seed, thresholds, labels=None, projection=None):
+    """Packs the templates of a small group (household, team) into shared ciphertexts.
+
+    All templates are projected with ``group_seed`` and encrypted under one
+    context; each ciphertext holds as many templates as its slots allow, so
+    matching cost scales with ciphertexts rather than members.
+    """
+    seed_hash = hash_seed(group_seed)
+    projection = projection or PROJECTION_MODE
+    # Group templates keep fixed-point encoding; quantization is per enrollment
+    encoding = TemplateEncoding(projection, dim=TEMPLATE_DIM)
+    _check_plain_modulus(encoding)
+    labels = list(labels) if labels is not None else list(range(len(embeddings)))
+    if not (len(embeddings) == len(thresholds) == len(labels)):
+        raise ValueError("❌ embeddings, thresholds and labels must have the same length")
+
+    # Identification always reduces per template after decryption, so no Galois keys
+    context = create_initial_context(galois_keys=False)
+    serialized_context = serialize_context_with_secret(context)
+    encrypted_serialized_context = aes_encrypt(seed_hash, serialized_context)
+
+    final_embeddings = apply_user_specific_projection(np.asarray(embeddings), group_seed, projection, encoding.dim)
+    scaled_embeddings = encoding.encode(final_embeddings)
+    template_size = scaled_embeddings.shape[1]
+    per_ciphertext = POLY_DEGREE // template_size
+    if per_ciphertext == 0:
+        raise ValueError(f"❌ Template of size {template_size} does not fit in {POLY_DEGREE} slots")
+
+    encrypted_templates = []
+    for start in range(0, len(scaled_embeddings), per_ciphertext):
+        packed = scaled_embeddings[start:start + per_ciphertext].ravel()
+        encrypted_templates.append(ts.bfv_vector(context, packed).serialize())
+
+    # Per-member thresholds live in the metadata; the header threshold is unused
+    return encode_bundle(
+        [(SECTION_CONTEXT, encrypted_serialized_context)]
+        + [(SECTION_EMBEDDING, encrypted) for encrypted in encrypted_templates],
+        POLY_DEGREE, PRIME_MODULUS, 0.0,
+        projection=projection,
+        distance_mode="slotwise",
+        metadata={"thresholds": list(thresholds), "labels": labels, "template_size": template_size,
+                  **encoding.metadata()},
+        compress=BUNDLE_COMPRESSION,
+        flags=FLAG_GROUP,
+    )
+
+
+@metrics.timed("he.group_compute")
+def compute_group_distances(bundled_data, new_embedding, group_seed):
+    """Evaluates the squared differences to every packed template, one pass per ciphertext.
+
+    Returns ``(encrypted_squared_diffs, context, encoding)`` for ``decrypt_group_distances``.
+    """
+    seed_hash = hash_seed(group_seed)
+
+    bundle = open_bundle(bundled_data)
+    context = _open_context(bundle.section(SECTION_CONTEXT), seed_hash)
+    try:
+        encoding = TemplateEncoding.from_bundle(bundle)
+        return _compute_group_distances(bundle, context, encoding, new_embedding, group_seed), context, encoding
+    except BaseException:
+        release_context(context)
+        raise
+
+
+def _compute_group_distances(bundle, context, encoding, new_embedding, group_seed):
+    template_size = bundle.metadata["template_size"]
+
+    final_embedding = apply_user_specific_projection(new_embedding, group_seed, bundle.projection, encoding.dim)
+    scaled_embedding = encoding.encode(final_embedding)
+
+    encrypted_squared_diffs = []
+    for serialized_templates in bundle.sections(SECTION_EMBEDDING):
+        stored = ts.bfv_vector_from(context, bytes(serialized_templates))
+        count = stored.size() // template_size
+        # The probe is only subtracted as plaintext, replicated once per packed template
+        diff = stored - np.tile(scaled_embedding, count).tolist()
+        encrypted_squared_diffs.append(diff * diff)
+    return encrypted_squared_diffs
+
+
+@metrics.timed("he.group_decrypt")
+def decrypt_group_distances(encrypted_squared_diffs, context, template_size, encoding):
+    distances = []
+    for encrypted in encrypted_squared_diffs:
+        raw = np.array(encrypted.decrypt(context.secret_key()), dtype=np.int64)
+        raw[raw < 0] += PRIME_MODULUS
+        sums = raw.reshape(-1, template_size).sum(axis=1)
+        for total in sums:
+            _check_distance(total, encoding)
+        distances.extend(float(encoding.distance(total)) for total in sums)
+    return distances
+
+
+def identify_in_group(bundled_data, new_embedding, group_seed):
+    """Returns ``(label, distance, threshold)`` per member, closest first."""
+    encrypted_squared_diffs, context, encoding = compute_group_distances(bundled_data, new_embedding, group_seed)
+    metadata = open_bundle(bundled_data).metadata
+    try:
+        distances = decrypt_group_distances(encrypted_squared_diffs, context, metadata["template_size"], encoding)
+    finally:
+        release_context(context)
+    matches = zip(metadata["labels"], distances, metadata["thresholds"])
+    return sorted(matches, key=lambda match: match[1])
@@ -1,22 +1,162 @@
 import cv2
 import torch
 import numpy as np
-from facenet_pytorch import InceptionResnetV1, MTCNN
 import logging
+import os
+import time
+
+import metrics
+from lazy import LazySingleton
 
 IMG_SIZE = 160
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-# Load models
-facenet = InceptionResnetV1(pretrained='vggface2').eval().to(device)
-mtcnn = MTCNN(image_size=IMG_SIZE, margin=20, device=device)
+# eager, torchscript, onnx (needs onnxruntime) or int8
+FACENET_BACKEND = os.getenv("FACENET_BACKEND", "eager")
+# Intra-op threads for FaceNet; 0 keeps the library default
+INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS", "0"))
+MODEL_CACHE_DIR = os.getenv("MODEL_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "secureface"))
+BACKENDS = ["eager", "torchscript", "onnx", "int8"]
+# Largest L2 distance allowed between a backend's embedding and eager's (embeddings are unit length)
+BACKEND_TOLERANCE = {"eager": 1e-6, "torchscript": 1e-4, "onnx": 1e-3, "int8": 0.05}
+if os.getenv("FACENET_TOLERANCE"):
+    BACKEND_TOLERANCE = dict.fromkeys(BACKENDS, float(os.getenv("FACENET_TOLERANCE")))
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("FaceProcessing")
 
 
-def capture_image():
-    """Captures an image from the webcam and saves it as 'captured_image.jpg'."""
+def _load_eager_facenet():
+    from facenet_pytorch import InceptionResnetV1
+    return InceptionResnetV1(pretrained='vggface2').eval().to(device)
+
+
+class OnnxFaceNet:
+    """Runs the exported model in ONNX Runtime behind FaceNet's torch interface."""
+
+    def __init__(self, path, n_threads=0):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if n_threads:
+            options.intra_op_num_threads = n_threads
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, batch):
+        output = self.session.run(None, {self.input_name: batch.detach().cpu().numpy()})[0]
+        return torch.from_numpy(output)
+
+
+def _cache_path(backend):
+    ext = "onnx" if backend == "onnx" else "pt"
+    return os.path.join(MODEL_CACHE_DIR, f"facenet-vggface2-{backend}-torch{torch.__version__}.{ext}")
+
+
+def _export(backend, path):
+    """Compiles the eager model for ``backend``, saves it to ``path`` and returns the eager one."""
+    eager = model = _load_eager_facenet().cpu()
+    example = torch.randn(1, 3, IMG_SIZE, IMG_SIZE)
+    if backend == "int8":
+        # Dynamic quantization only covers Linear layers; the convolutions stay fp32
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
+    tmp = path + ".tmp"
+    with torch.no_grad():
+        if backend == "onnx":
+            torch.onnx.export(model, example, tmp, input_names=["faces"], output_names=["embeddings"],
+                              dynamic_axes={"faces": {0: "batch"}, "embeddings": {0: "batch"}},
+                              opset_version=17)
+        else:
+            torch.jit.save(torch.jit.freeze(torch.jit.trace(model, example)), tmp)
+    os.replace(tmp, path)
+    return eager
+
+
+def _load_backend(backend):
+    if backend == "eager":
+        return _load_eager_facenet()
+    if device.type != "cpu":
+        raise ValueError(f"❌ FACENET_BACKEND={backend} is CPU-only; use eager on {device}")
+    path = _cache_path(backend)
+    if not os.path.exists(path):
+        start = time.perf_counter()
+        eager = _export(backend, path)
+        logger.info(f"Exported FaceNet ({backend}) to {path} in {time.perf_counter() - start:.1f}s")
+        model = _open_backend(backend, path)
+        error = backend_agreement(model, reference=eager)
+        if error > BACKEND_TOLERANCE[backend]:
+            os.remove(path)
+            raise ValueError(f"❌ FaceNet {backend} differs from eager by {error:.2e} "
+                             f"(tolerance {BACKEND_TOLERANCE[backend]:.0e})")
+        return model
+    return _open_backend(backend, path)
+
+
+def _open_backend(backend, path):
+    if backend == "onnx":
+        return OnnxFaceNet(path, INFERENCE_THREADS)
+    model = torch.jit.load(path)
+    # The oneDNN rewrites don't apply to dynamically quantized Linear layers
+    return model if backend == "int8" else torch.jit.optimize_for_inference(model)
+
+
+def backend_agreement(model, faces=None, reference=None):
+    """Largest L2 distance between ``model``'s embeddings and the eager model's.
+
+    ``faces`` is a batch of aligned face crops; random crops are used when
+    none are given.
+    """
+    if faces is None:
+        faces = torch.randn(8, 3, IMG_SIZE, IMG_SIZE, generator=torch.Generator().manual_seed(0))
+    if reference is None:
+        reference = _load_eager_facenet().cpu()
+    with torch.no_grad():
+        expected = reference(faces).numpy()
+        actual = model(faces).cpu().numpy()
+    return float(np.linalg.norm(actual - expected, axis=1).max())
+
+
+@metrics.timed("face.load_facenet")
+def load_facenet(backend=None):
+    """Loads FaceNet for ``backend``, exporting and caching it the first time."""
+    backend = backend or FACENET_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"❌ Unknown FACENET_BACKEND {backend!r}, expected one of {BACKENDS}")
+    if INFERENCE_THREADS:
+        torch.set_num_threads(INFERENCE_THREADS)
+    return _load_backend(backend)
+
+
+def _load_facenet():
+    return load_facenet()
+
+
+def _load_mtcnn():
+    from facenet_pytorch import MTCNN
+    return MTCNN(image_size=IMG_SIZE, margin=20, device=device)
+
+
+# Models are loaded on first use, not at import time
+_facenet = LazySingleton("facenet", _load_facenet)
+_mtcnn = LazySingleton("mtcnn", _load_mtcnn)
+
+
+def get_facenet():
+    return _facenet.get()
+
+
+def get_mtcnn():
+    return _mtcnn.get()
+
+
+def warm_up_models():
+    """Starts loading FaceNet and MTCNN in background threads."""
+    return [_facenet.warm(), _mtcnn.warm()]
+
+
+def capture_image(filename="captured_image.jpg"):
+    """Captures an image from the webcam and saves it as ``filename``."""
     cap = cv2.VideoCapture(0, cv2.CAP_DSHOW)  # Use DirectShow backend for Windows
     if not cap.isOpened():
         raise ValueError("❌ Webcam not detected!")
@@ -32,7 +172,7 @@ def capture_image():
 
         key = cv2.waitKey(1) & 0xFF  # Ensure compatibility
         if key == 32:  # SPACE key to capture
-            cv2.imwrite("captured_image.jpg", frame)
+            cv2.imwrite(filename, frame)
             break
         elif key == 27:  # ESC to cancel
             print("❌ Capture canceled.")
@@ -42,22 +182,87 @@ def capture_image():
     
     cap.release()
     cv2.destroyAllWindows()
-    return "captured_image.jpg"
+    return filename
 
+def _load_rgb(image):
+    """Returns an RGB array for an image path or an in-memory BGR frame."""
+    if image is None or isinstance(image, np.ndarray):
+        img = image
+    else:
+        img = cv2.imread(image)
+    if img is None:
+        raise ValueError("❌ Image capture failed")
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+@metrics.timed("face.embedding")
 def get_face_embedding(image_path):
     """Extracts face embedding from an image captured via webcam."""
     try:
-        img = cv2.cvtColor(cv2.imread(image_path), cv2.COLOR_BGR2RGB)
-        if img is None:
-            raise ValueError("❌ Image capture failed")
+        img = _load_rgb(image_path)
 
-        face = mtcnn(img)
+        face = get_mtcnn()(img)
         if face is None:
             raise ValueError("❌ No face detected")
 
         with torch.no_grad():
-            embedding = facenet(face.unsqueeze(0).to(device))
+            embedding = get_facenet()(face.unsqueeze(0).to(device))
             return embedding.cpu().numpy().flatten()  # Return 1D NumPy array
     except Exception as e:
         logger.error(f"❌ Face processing failed: {str(e)}")
         raise
+
+
+@metrics.timed("face.embedding_batch")
+def get_face_embeddings(images, batch_size=16):
+    """Extracts embeddings for a list of image paths or BGR frames in batches.
+
+    Returns ``(embeddings, failures)`` where ``embeddings`` is aligned with
+    ``images`` (``None`` for images that failed) and ``failures`` maps the
+    index of each failed image to its error message.
+    """
+    embeddings = [None] * len(images)
+    failures = {}
+
+    # Decode everything first so a bad file only fails its own slot
+    decoded = {}
+    for i, image in enumerate(images):
+        try:
+            decoded[i] = _load_rgb(image)
+        except Exception as e:
+            failures[i] = str(e)
+
+    # MTCNN can only batch frames of identical size
+    groups = {}
+    for i, img in decoded.items():
+        groups.setdefault(img.shape, []).append(i)
+
+    faces = {}
+    for indices in groups.values():
+        for start in range(0, len(indices), batch_size):
+            chunk = indices[start:start + batch_size]
+            try:
+                with metrics.span("face.mtcnn"):
+                    detected = get_mtcnn()([decoded[i] for i in chunk])
+            except Exception as e:
+                for i in chunk:
+                    failures[i] = str(e)
+                continue
+            for i, face in zip(chunk, detected):
+                if face is None:
+                    failures[i] = "❌ No face detected"
+                else:
+                    faces[i] = face
+
+    order = sorted(faces)
+    for start in range(0, len(order), batch_size):
+        chunk = order[start:start + batch_size]
+        batch = torch.stack([faces[i] for i in chunk]).to(device)
+        with torch.no_grad(), metrics.span("face.facenet"):
+            output = get_facenet()(batch).cpu().numpy()
+        for i, embedding in zip(chunk, output):
+            embeddings[i] = embedding
+
+    for i, error in sorted(failures.items()):
+        logger.error(f"❌ Face processing failed for image #{i}: {error}")
+    return embeddings, failures
@@ -1,46 +1,140 @@
+import os
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from dotenv import load_dotenv
+
+import metrics
+from bundle_cache import BundleCache
+from lazy import LazySingleton
+
+load_dotenv()
+
+IPFS_API_URL = os.getenv("IPFS_API_URL", "http://127.0.0.1:5001/api/v0")
+IPFS_GATEWAY_URL = os.getenv("IPFS_GATEWAY_URL", "http://127.0.0.1:8080/ipfs")
+IPFS_TIMEOUT = float(os.getenv("IPFS_TIMEOUT", "30"))
+IPFS_RETRIES = int(os.getenv("IPFS_RETRIES", "3"))
+IPFS_CACHE_ENABLED = os.getenv("IPFS_CACHE", "1") == "1"
+IPFS_CACHE_DIR = os.getenv("IPFS_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "secureface", "ipfs"))
+IPFS_CACHE_BYTES = int(os.getenv("IPFS_CACHE_MB", "512")) * 1024 * 1024
 
-IPFS_API_URL = "http://127.0.0.1:5001/api/v0"
 
 class IPFSHandler:
-    def __init__(self):
+    def __init__(self, cache=None):
+        """Sets up a pooled session; the daemon is only contacted when needed."""
+        self.session = requests.Session()
+        retry = Retry(
+            total=IPFS_RETRIES,
+            backoff_factor=0.2,
+            status_forcelist=[500, 502, 503, 504],
+            allowed_methods=["GET", "POST"],
+        )
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=4, pool_maxsize=16)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if cache is None and IPFS_CACHE_ENABLED:
+            cache = BundleCache(IPFS_CACHE_DIR, IPFS_CACHE_BYTES)
+        self.cache = cache
+        if cache is not None:
+            metrics.register_cache("ipfs_bundles", lambda: dict(cache.stats))
+        self._connected = False
+
+    def check_connection(self):
         """Check if IPFS daemon is running."""
+        if self._connected:
+            return
         try:
-            res = requests.post(f"{IPFS_API_URL}/id")
+            res = self.session.post(f"{IPFS_API_URL}/id", timeout=IPFS_TIMEOUT)
             if res.status_code == 200:
                 print("✅ Connected to IPFS")
+                self._connected = True
             else:
                 raise ConnectionError("❌ Failed to connect to IPFS")
         except requests.exceptions.RequestException as e:
             raise ConnectionError(f"❌ IPFS daemon not running: {e}")
 
-    def upload_encrypted_bundle(self, encrypted_data, filename="encrypted_embedding.enc"):
-        """Uploads an encrypted file (embedding) to IPFS."""
-        with open(filename, "wb") as f:
-            f.write(encrypted_data)  # Save encrypted data
-        with open(filename, "rb") as f:
-            files = {"file": f}
-            res = requests.post(f"{IPFS_API_URL}/add", files=files)
-            if res.status_code == 200:
-                ipfs_hash = res.json()["Hash"]
-                print(f"✅ Encrypted embedding stored on IPFS: {ipfs_hash}")
-                return ipfs_hash
-            else:
-                raise Exception("❌ Failed to upload embedding to IPFS")
+    def _add(self, data, only_hash=False, cid_version=0):
+        params = {"cid-version": cid_version}
+        if only_hash:
+            params["only-hash"] = "true"
+        files = {"file": ("bundle", data)}
+        res = self.session.post(f"{IPFS_API_URL}/add", params=params, files=files, timeout=IPFS_TIMEOUT)
+        if res.status_code != 200:
+            raise Exception("❌ Failed to upload embedding to IPFS")
+        return res.json()["Hash"]
+
+    @metrics.timed("ipfs.upload")
+    def upload_encrypted_bundle(self, encrypted_data):
+        """Uploads an encrypted bundle (embedding) to IPFS straight from memory."""
+        self.check_connection()
+        ipfs_hash = self._add(bytes(encrypted_data))
+        metrics.record_bytes("ipfs_upload", len(encrypted_data))
+        print(f"✅ Encrypted embedding stored on IPFS: {ipfs_hash}")
+        if self.cache is not None:
+            # The daemon just derived this CID from these exact bytes
+            self.cache.put(ipfs_hash, encrypted_data)
+        return ipfs_hash
+
+    def forget_bundle(self, ipfs_hash):
+        """Drops the local copy of a bundle; IPFS itself may still hold it."""
+        if self.cache is not None:
+            self.cache.discard(ipfs_hash)
+
+    @metrics.timed("ipfs.fetch")
+    def retrieve_encrypted_bundle(self, ipfs_hash):
+        """Retrieves an encrypted bundle, from the local cache when possible."""
+        if self.cache is not None:
+            cached = self.cache.get(ipfs_hash)
+            if cached is not None:
+                print(f"✅ Bundle {ipfs_hash} served from local cache")
+                return cached
 
-    def retrieve_encrypted_bundle(self, ipfs_hash, output_path="retrieved_encrypted_embedding.enc"):
-        """Retrieves an encrypted file from IPFS."""
         print(f"🔹 Fetching IPFS hash from local node: {ipfs_hash}")
-        url = f"http://127.0.0.1:8080/ipfs/{ipfs_hash}"
-        res = requests.get(url, stream=True)  
-        
+        url = f"{IPFS_GATEWAY_URL}/{ipfs_hash}"
+        try:
+            res = self.session.get(url, timeout=IPFS_TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"❌ Failed to retrieve encrypted embedding from IPFS: {e}")
+
         if res.status_code == 200:
-            with open(output_path, "wb") as f:
-                for chunk in res.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            print(f"✅ File retrieved from Local IPFS and saved as: {output_path}")
-            with open(output_path, "rb") as f:
-                return f.read()  # Return serialized encrypted embedding
+            data = res.content
+            metrics.record_bytes("ipfs_fetch", len(data))
+            print("✅ File retrieved from Local IPFS")
+            if self.cache is not None and self._cid_matches(ipfs_hash, data):
+                self.cache.put(ipfs_hash, data)
+            return data
         else:
             print(f"❌ Failed to retrieve from Local IPFS: {res.status_code} - {res.text}")
             raise Exception("❌ Failed to retrieve encrypted embedding from IPFS")
+
+    def _cid_matches(self, ipfs_hash, data):
+        """Re-derives the CID of ``data`` so nothing unverified enters the cache.
+
+        A mismatch can also come from add options (chunker, raw leaves,
+        codec) other than the defaults used here, so it only means the data
+        is returned without being cached.
+        """
+        try:
+            self.check_connection()
+            cid_version = 0 if ipfs_hash.startswith("Qm") else 1
+            derived = self._add(data, only_hash=True, cid_version=cid_version)
+        except Exception as e:
+            print(f"⚠️ Could not verify {ipfs_hash}, not caching it: {e}")
+            return False
+        if derived != ipfs_hash:
+            print(f"⚠️ {ipfs_hash} re-hashes to {derived}, not caching it")
+            return False
+        return True
+
+
+# Created on first use, not at import time
+_ipfs = LazySingleton("ipfs", IPFSHandler)
+
+
+def get_ipfs_handler():
+    return _ipfs.get()
+
+
+def warm_up_ipfs():
+    """Creates the pooled IPFS session in a background thread."""
+    return _ipfs.warm()
@@ -0,0 +1,71 @@
+import threading
+import time
+import logging
+
+logger = logging.getLogger("LazyInit")
+
+_startup_timings = {}
+_timings_lock = threading.Lock()
+_UNSET = object()
+
+
+def record_timing(name, seconds):
+    """Adds ``seconds`` to the startup-time breakdown under ``name``."""
+    with _timings_lock:
+        _startup_timings[name] = _startup_timings.get(name, 0.0) + seconds
+
+
+def startup_timings():
+    """Returns a copy of the startup-time breakdown in seconds."""
+    with _timings_lock:
+        return dict(_startup_timings)
+
+
+def print_startup_report():
+    timings = startup_timings()
+    if not timings:
+        return
+    print("\n⏱️ Startup breakdown:")
+    for name, seconds in sorted(timings.items(), key=lambda kv: -kv[1]):
+        print(f"   {name:<20} {seconds * 1000:>9.1f} ms")
+
+
+class LazySingleton:
+    """Builds a shared object on first use.
+
+    ``warm()`` starts building it in a daemon thread so the cost overlaps
+    with user input; a later ``get()`` waits for that build instead of
+    starting a second one. A failed background build is retried in the
+    foreground so the error surfaces where the object is actually needed.
+    """
+
+    def __init__(self, name, factory):
+        self.name = name
+        self._factory = factory
+        self._value = _UNSET
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._value is _UNSET:
+            with self._lock:
+                if self._value is _UNSET:
+                    start = time.perf_counter()
+                    value = self._factory()
+                    record_timing(self.name, time.perf_counter() - start)
+                    self._value = value
+        return self._value
+
+    def is_ready(self):
+        return self._value is not _UNSET
+
+    def warm(self):
+        """Builds the object in a background thread and returns the thread."""
+        def _run():
+            try:
+                self.get()
+            except BaseException as e:
+                logger.warning(f"⚠️ Background warm-up of {self.name} failed: {e}")
+
+        thread = threading.Thread(target=_run, name=f"warm-{self.name}", daemon=True)
+        thread.start()
+        return thread
@@ -1,30 +1,35 @@
+import time
+
+_import_start = time.perf_counter()
+
 import getpass
 import os
-import pickle
-import hashlib
-import numpy as np
 from dotenv import load_dotenv
 
-from face_processing import get_face_embedding, capture_image
+from face_processing import get_face_embeddings, capture_image, warm_up_models
+from capture_stream import CAPTURE_MODE, capture_frame, capture_frames
 from encryption import (
+    calibrate_threshold,
     create_encrypted_bundle,
-    compute_encrypted_distance,
-    decrypt_distance,
-    apply_user_specific_projection,
+    enrollment_stats,
+    generate_uid,
+    warm_context_pool,
 )
-from ipfs_handler import IPFSHandler
+from ipfs_handler import get_ipfs_handler, warm_up_ipfs
 from blockchain_interaction import (
     store_ipfs_hash,
     get_ipfs_hash,
-    revoke_ipfs_hash,
+    warm_up_chain,
 )
+from auth_pipeline import authenticate, BundleLookupError, print_timings, refresh_template, revoke_template
+from lazy import record_timing, print_startup_report
+
+record_timing("imports", time.perf_counter() - _import_start)
 
 load_dotenv()
 SALT = os.getenv("GLOBAL_SALT")
-ipfs = IPFSHandler()
-
-def generate_uid(pin: str, salt: str) -> str:
-    return hashlib.sha256((pin + salt).encode()).hexdigest()
+WARM_START = os.getenv("WARM_START", "1") == "1"
+STARTUP_REPORT = os.getenv("STARTUP_REPORT", "0") == "1"
 
 print("Choose an option:")
 print("1. Registration")
@@ -32,6 +37,14 @@ print("2. Authentication")
 print("3. Revoke Biometric Data")
 choice = input("Enter 1, 2, or 3: ")
 
+if WARM_START and choice in ("1", "2", "3"):
+    # Overlap model loading and connections with the PIN prompt
+    warm_up_models()
+    warm_up_chain()
+    warm_up_ipfs()
+    if choice == "1":
+        warm_context_pool()
+
 user_pin = getpass.getpass("🔐 Enter your secret PIN: ")
 uid = generate_uid(user_pin, SALT)
 
@@ -45,77 +58,90 @@ if choice == "1":
         if existing_hash:
             print(f"❌ Already registered. Stored hash: {existing_hash}")
             exit(1)
-    except:
+    except Exception:
         print("✅ No prior registration found. Continuing...")
 
-    embeddings = []
-    print("\n📸 Capture 5 registration images:")
-    for i in range(5):
-        input(f"Press Enter to capture image #{i+1}: ")
-        path = capture_image()
-        emb = get_face_embedding(path)
-        embeddings.append(emb)
+    if CAPTURE_MODE == "stream":
+        try:
+            images = capture_frames(5)
+        except ValueError as e:
+            print(e)
+            exit(1)
+        if images is None:
+            exit(1)
+    else:
+        images = []
+        print("\n📸 Capture 5 registration images:")
+        for i in range(5):
+            input(f"Press Enter to capture image #{i+1}: ")
+            images.append(capture_image(f"captured_image_{i+1}.jpg"))
+
+    embeddings, failures = get_face_embeddings(images)
+    if failures:
+        failed = ", ".join(f"#{i+1}" for i in sorted(failures))
+        print(f"❌ Registration failed, no usable face in image(s) {failed}.")
+        exit(1)
 
     primary = embeddings[0]
-    proj_primary = apply_user_specific_projection(primary, user_pin)
-
-    dists = []
-    for other in embeddings[1:]:
-        proj = apply_user_specific_projection(other, user_pin)
-        dists.append(np.linalg.norm(proj_primary - proj))
-
-    base_threshold = 0.25  
-    threshold = max(base_threshold, np.percentile(dists, 95) * 1.1)
+    threshold = calibrate_threshold(embeddings, user_pin)
     print(f"🚩 Chosen Threshold: {threshold:.4f}")
 
-    bundle = create_encrypted_bundle(primary, user_pin, threshold)
-    ipfs_hash = ipfs.upload_encrypted_bundle(bundle)
-    store_ipfs_hash(uid, ipfs_hash, my_account, my_private_key)
+    bundle = create_encrypted_bundle(primary, user_pin, threshold,
+                                     refresh_stats=enrollment_stats(embeddings, user_pin))
+    ipfs_hash = get_ipfs_handler().upload_encrypted_bundle(bundle)
+    print("⏳ Waiting for the transaction to be mined...")
+    store_ipfs_hash(uid, ipfs_hash, my_account, my_private_key).result()
     print("✅ Registration successful.")
 
 elif choice == "2":
     print("\n🔹 Starting Authentication...")
+
+    def capture():
+        if CAPTURE_MODE == "stream":
+            return capture_frame()
+        input("Press Enter to capture your face: ")
+        return capture_image()
+
+    # The chain lookup and bundle download run while the camera is open
     try:
-        ipfs_hash = get_ipfs_hash(uid)
-    except:
+        result = authenticate(uid, user_pin, capture)
+    except BundleLookupError:
         print("❌ No biometric data found for this UID.")
         exit(1)
+    except ValueError as e:
+        print(e)
+        exit(1)
 
-    bundle = ipfs.retrieve_encrypted_bundle(ipfs_hash)
-    data = pickle.loads(bundle)
-    threshold = data["threshold"]
-
-    input("Press Enter to capture your face: ")
-    emb = get_face_embedding(capture_image())
-
-    enc_dist, ctx = compute_encrypted_distance(bundle, emb, user_pin)
-    dist = decrypt_distance(enc_dist, ctx)
+    print(f"🔹 Distance = {result['distance']:.4f}, Threshold = {result['threshold']:.4f}")
+    print("✅ Auth Result:", "GRANTED" if result["granted"] else "DENIED")
+    print_timings(result["timings"])
 
-    print(f"🔹 Distance = {dist:.4f}, Threshold = {threshold:.4f}")
-    print("✅ Auth Result:", "GRANTED" if dist < threshold else "DENIED")
+    if result["granted"] and input("Update your stored template with this capture? (y/N): ").lower() == "y":
+        print("⏳ Waiting for the transaction to be mined...")
+        new_hash, new_threshold = refresh_template(uid, user_pin, result, my_account, my_private_key)
+        print(f"✅ Template refreshed: {new_hash} (threshold {new_threshold:.4f})")
 
 elif choice == "3":
     print("\n⚠️ Starting Biometric Revocation...")
+
+    def capture():
+        print("📸 Capture your face for revocation verification:")
+        return capture_frame() if CAPTURE_MODE == "stream" else capture_image()
+
     try:
-        ipfs_hash = get_ipfs_hash(uid)
-    except:
+        result = authenticate(uid, user_pin, capture)
+    except BundleLookupError:
         print("❌ No biometric data found.")
         exit(1)
+    except ValueError as e:
+        print(e)
+        exit(1)
 
-    bundle = ipfs.retrieve_encrypted_bundle(ipfs_hash)
-    data = pickle.loads(bundle)
-    threshold = data["threshold"]
-
-    print("📸 Capture your face for revocation verification:")
-    emb = get_face_embedding(capture_image())
-
-    enc_dist, ctx = compute_encrypted_distance(bundle, emb, user_pin)
-    dist = decrypt_distance(enc_dist, ctx)
-
-    if dist < threshold:
+    if result["granted"]:
         confirm = input("Type 'REVOKE' to delete your biometric data: ")
         if confirm == "REVOKE":
-            revoke_ipfs_hash(uid, my_account, my_private_key)
+            print("⏳ Waiting for the transaction to be mined...")
+            revoke_template(uid, user_pin, result, my_account, my_private_key)
             print("✅ Biometric data successfully revoked.")
         else:
             print("❌ Revocation canceled.")
@@ -123,3 +149,6 @@ elif choice == "3":
         print("❌ Verification failed. Revocation denied.")
 else:
     print("❌ Invalid option.")
+
+if STARTUP_REPORT:
+    print_startup_report()
@@ -0,0 +1,244 @@
+"""Spans, histograms and counters for the request hot path.
+
+Off unless ``METRICS=1``: ``timed`` then hands back the undecorated function
+and the other calls return on their first line, so instrumented code pays
+nothing measurable. When on, metrics are kept in-process and rendered in
+the Prometheus text format by ``render_prometheus()``. The service serves
+them on ``GET /metrics``, and ``METRICS_FILE`` writes them when the process
+exits.
+
+``METRICS_PROFILE=cpu`` (cProfile) and/or ``memory`` (tracemalloc) profile
+the whole process and write the results to ``METRICS_PROFILE_DIR`` at exit.
+cProfile only sees the main thread.
+"""
+import atexit
+import cProfile
+import functools
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+load_dotenv()
+METRICS_ENABLED = os.getenv("METRICS", "0") == "1"
+METRICS_FILE = os.getenv("METRICS_FILE")
+METRICS_PROFILE = {mode.strip() for mode in os.getenv("METRICS_PROFILE", "").split(",") if mode.strip()}
+METRICS_PROFILE_DIR = os.getenv("METRICS_PROFILE_DIR", ".")
+PREFIX = "secureface"
+
+logger = logging.getLogger("Metrics")
+
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+BYTE_BUCKETS = [1 << shift for shift in range(10, 29, 2)]  # 1 KiB .. 256 MiB
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_collectors = {}
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _observe(family, label, value, buckets):
+    with _lock:
+        histogram = _histograms.get((family, label))
+        if histogram is None:
+            histogram = _histograms[(family, label)] = _Histogram(buckets)
+        histogram.observe(value)
+
+
+def observe(span_name, seconds):
+    """Adds one latency sample for ``span_name``."""
+    if not METRICS_ENABLED:
+        return
+    _observe("span_seconds", span_name, seconds, LATENCY_BUCKETS)
+
+
+def record_bytes(kind, size):
+    """Adds one size sample, e.g. ``record_bytes("bundle", len(bundle))``."""
+    if not METRICS_ENABLED:
+        return
+    _observe("bytes", kind, size, BYTE_BUCKETS)
+
+
+def inc(name, label="", amount=1):
+    if not METRICS_ENABLED:
+        return
+    with _lock:
+        _counters[(name, label)] = _counters.get((name, label), 0) + amount
+
+
+@contextmanager
+def _span(name):
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        inc("errors_total", name)
+        raise
+    finally:
+        observe(name, time.perf_counter() - start)
+
+
+@contextmanager
+def _no_span():
+    yield
+
+
+def span(name):
+    """Context manager timing a block; exceptions are counted as errors."""
+    return _span(name) if METRICS_ENABLED else _no_span()
+
+
+def timed(name):
+    """Decorator form of ``span``; a no-op when metrics are off."""
+    def decorate(fn):
+        if not METRICS_ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def track_future(name, future):
+    """Times ``future`` from now until it resolves, counting failures as errors."""
+    if not METRICS_ENABLED:
+        return future
+    start = time.perf_counter()
+
+    def _done(f):
+        observe(name, time.perf_counter() - start)
+        if f.exception() is not None:
+            inc("errors_total", name)
+
+    future.add_done_callback(_done)
+    return future
+
+
+def register_cache(name, info):
+    """Exports a cache's ``hits``/``misses``/... counters, read from ``info()`` at scrape time."""
+    if not METRICS_ENABLED:
+        return
+    with _lock:
+        _collectors[name] = info
+
+
+def _format_labels(key, value):
+    return f'{{{key}="{value}"}}' if value else ""
+
+
+def render_prometheus():
+    """All metrics in the Prometheus text exposition format."""
+    with _lock:
+        histograms = sorted(_histograms.items())
+        counters = sorted(_counters.items())
+        collectors = sorted(_collectors.items())
+    lines = []
+
+    families = {"span_seconds": "span", "bytes": "kind"}
+    for family, label_key in families.items():
+        rows = [(label, h) for (f, label), h in histograms if f == family]
+        if not rows:
+            continue
+        metric = f"{PREFIX}_{family}"
+        lines.append(f"# TYPE {metric} histogram")
+        for label, h in rows:
+            cumulative = 0
+            for bound, count in zip(h.buckets + ["+Inf"], h.counts):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{{label_key}="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{{label_key}="{label}"}} {h.sum}')
+            lines.append(f'{metric}_count{{{label_key}="{label}"}} {h.count}')
+
+    seen = set()
+    for (name, label), value in counters:
+        metric = f"{PREFIX}_{name}"
+        if metric not in seen:
+            lines.append(f"# TYPE {metric} counter")
+            seen.add(metric)
+        lines.append(f"{metric}{_format_labels('span', label)} {value}")
+
+    cache_rows = []
+    for name, info in collectors:
+        try:
+            cache_rows.append((name, info()))
+        except Exception as e:
+            logger.warning(f"⚠️ Cache stats for {name} unavailable: {e}")
+    for stat in ("hits", "misses", "evictions"):
+        metric = f"{PREFIX}_cache_{stat}_total"
+        rows = [(name, stats[stat]) for name, stats in cache_rows if stat in stats]
+        if rows:
+            lines.append(f"# TYPE {metric} counter")
+            lines.extend(f'{metric}{{cache="{name}"}} {value}' for name, value in rows)
+    lines.append(f"# TYPE {PREFIX}_cache_hit_ratio gauge")
+    for name, stats in cache_rows:
+        lookups = stats.get("hits", 0) + stats.get("misses", 0)
+        if lookups:
+            lines.append(f'{PREFIX}_cache_hit_ratio{{cache="{name}"}} {stats["hits"] / lookups:.4f}')
+    lines.append(f"# TYPE {PREFIX}_cache_entries gauge")
+    for name, stats in cache_rows:
+        if isinstance(stats.get("entries"), int):
+            lines.append(f'{PREFIX}_cache_entries{{cache="{name}"}} {stats["entries"]}')
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(path=None):
+    path = path or METRICS_FILE
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write(render_prometheus())
+    os.replace(tmp, path)
+
+
+# ==================== PROFILING ====================
+_profiler = None
+
+
+def _write_profiles():
+    pid = os.getpid()
+    if _profiler is not None:
+        _profiler.disable()
+        path = os.path.join(METRICS_PROFILE_DIR, f"profile-{pid}.prof")
+        _profiler.dump_stats(path)
+        print(f"📈 CPU profile written to {path} (python -m pstats {path})")
+    if tracemalloc.is_tracing():
+        snapshot = tracemalloc.take_snapshot()
+        path = os.path.join(METRICS_PROFILE_DIR, f"memory-{pid}.txt")
+        _, peak = tracemalloc.get_traced_memory()
+        with open(path, "w") as f:
+            f.write(f"peak {peak / 1024:.0f} KiB\n")
+            for stat in snapshot.statistics("lineno")[:50]:
+                f.write(f"{stat}\n")
+        print(f"📈 Memory profile written to {path}")
+
+
+if METRICS_PROFILE:
+    if "cpu" in METRICS_PROFILE:
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+    if "memory" in METRICS_PROFILE:
+        tracemalloc.start(25)
+    atexit.register(_write_profiles)
+
+if METRICS_ENABLED and METRICS_FILE:
+    atexit.register(write_metrics)
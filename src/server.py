@@ -0,0 +1,249 @@
+"""Long-running SecureFace service exposing register, authenticate and revoke.
+
+Models, the web3 contract handle and the IPFS session are loaded once and
+stay warm. Images travel in the request body as base64-encoded JPEG/PNG,
+and the CPU-heavy HE work runs in a bounded process pool. Requests beyond
+the pool plus its queue are rejected with 503 instead of piling up, and
+bodies over ``MAX_REQUEST_BYTES`` with 413.
+
+    POST /register      {"pin": "...", "images": ["<base64>", ...]}
+    POST /authenticate  {"pin": "...", "image": "<base64>"}
+    POST /revoke        {"pin": "...", "image": "<base64>"}
+    GET  /health
+    GET  /metrics       Prometheus text format (METRICS=1)
+"""
+import argparse
+import base64
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+
+from face_processing import get_face_embeddings, get_facenet, get_mtcnn
+from encryption import calibrate_threshold, create_encrypted_bundle, enrollment_stats, generate_uid
+from ipfs_handler import get_ipfs_handler
+from blockchain_interaction import get_contract, get_ipfs_hash, store_ipfs_hash
+from auth_pipeline import BundleLookupError, authenticate, revoke_template
+from verify_engine import HE_WORKERS, VerificationEngine
+import metrics
+
+load_dotenv()
+SALT = os.getenv("GLOBAL_SALT")
+# Requests allowed to wait for a worker before new ones are turned away
+HE_QUEUE_LIMIT = int(os.getenv("HE_QUEUE_LIMIT", str(2 * HE_WORKERS)))
+REGISTRATION_IMAGES = 5
+# Five base64 JPEGs from a 1080p camera fit comfortably
+MAX_REQUEST_BYTES = int(os.getenv("MAX_REQUEST_BYTES", str(16 << 20)))
+
+
+class Overloaded(Exception):
+    """The HE pool and its queue are full."""
+
+
+class RequestTooLarge(Exception):
+    """The request body is over ``MAX_REQUEST_BYTES``."""
+
+
+class SecureFaceService:
+    def __init__(self, account, private_key):
+        self.account = account
+        self.private_key = private_key
+        self.engine = VerificationEngine(HE_WORKERS)
+        self._admission = threading.BoundedSemaphore(HE_WORKERS + HE_QUEUE_LIMIT)
+
+    def warm_up(self):
+        """Loads everything a request needs before the first one arrives."""
+        start = time.perf_counter()
+        get_facenet()
+        get_mtcnn()
+        get_contract()
+        get_ipfs_handler()
+        self.engine.warm_up()
+        print(f"✅ Service warm in {time.perf_counter() - start:.1f}s")
+
+    @contextmanager
+    def _admitted(self):
+        # Bounds the CPU and HE work (decoding, embedding, encryption), not
+        # chain confirmations, which run after the slot is released
+        if not self._admission.acquire(blocking=False):
+            raise Overloaded()
+        try:
+            yield
+        finally:
+            self._admission.release()
+
+    def register(self, pin, images):
+        """``images`` are base64-encoded, like the other requests' ``image``."""
+        if len(images) != REGISTRATION_IMAGES:
+            raise ValueError(f"❌ Registration needs {REGISTRATION_IMAGES} images")
+        with self._admitted():
+            uid, bundle, threshold = self._enroll(pin, [_decode_image(i) for i in images])
+        ipfs_hash = get_ipfs_handler().upload_encrypted_bundle(bundle)
+        store_ipfs_hash(uid, ipfs_hash, self.account, self.private_key).result()
+        return {"registered": True, "ipfs_hash": ipfs_hash, "threshold": threshold}
+
+    def _enroll(self, pin, images):
+        uid = generate_uid(pin, SALT)
+        try:
+            existing_hash = get_ipfs_hash(uid)
+        except Exception:
+            existing_hash = None
+        if existing_hash:
+            raise ValueError("❌ Already registered")
+
+        embeddings, failures = get_face_embeddings(images)
+        if failures:
+            raise ValueError(f"❌ No usable face in image(s) {sorted(failures)}")
+        threshold = calibrate_threshold(embeddings, pin)
+        create = functools.partial(create_encrypted_bundle, refresh_stats=enrollment_stats(embeddings, pin))
+        bundle = self.engine.run(create, embeddings[0], pin, threshold).result()
+        return uid, bundle, threshold
+
+    @metrics.timed("server.he_verify")
+    def _verify(self, bundle, embedding, pin):
+        # The HE stages run in worker processes, so this is their only span here
+        return self.engine.submit(bundle, embedding, pin).result()
+
+    def authenticate(self, pin, image):
+        with self._admitted():
+            return self._response(self._authenticate(pin, _decode_image(image)))
+
+    def _authenticate(self, pin, image):
+        return authenticate(generate_uid(pin, SALT), pin, lambda: image, verify=self._verify)
+
+    @staticmethod
+    def _response(result):
+        return {
+            "granted": bool(result["granted"]),
+            "distance": float(result["distance"]),
+            "threshold": float(result["threshold"]),
+            "timings": result["timings"],
+        }
+
+    def revoke(self, pin, image):
+        with self._admitted():
+            result = self._authenticate(pin, _decode_image(image))
+        response = self._response(result)
+        if not result["granted"]:
+            return dict(response, revoked=False)
+        # Workers' cached contexts for this bundle expire within HE_CONTEXT_CACHE_TTL
+        revoke_template(generate_uid(pin, SALT), pin, result, self.account, self.private_key)
+        return dict(response, revoked=True)
+
+
+def _decode_image(encoded):
+    frame = cv2.imdecode(np.frombuffer(base64.b64decode(encoded), np.uint8), cv2.IMREAD_COLOR)
+    if frame is None:
+        raise ValueError("❌ Could not decode image")
+    return frame
+
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._reply(200, {"ok": True})
+            elif self.path == "/metrics" and metrics.METRICS_ENABLED:
+                body = metrics.render_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            else:
+                self._reply(404, {"error": "not found"})
+
+        def do_POST(self):
+            routes = {
+                "/register": lambda r: service.register(r["pin"], r["images"]),
+                "/authenticate": lambda r: service.authenticate(r["pin"], r["image"]),
+                "/revoke": lambda r: service.revoke(r["pin"], r["image"]),
+            }
+            route = routes.get(self.path)
+            if route is None:
+                self._reply(404, {"error": "not found"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                if length > MAX_REQUEST_BYTES:
+                    raise RequestTooLarge()
+                if length < 0:
+                    raise ValueError("❌ Invalid Content-Length")
+                request = json.loads(self.rfile.read(length))
+                with metrics.span(f"http{self.path}"):
+                    response = route(request)
+                self._reply(200, response)
+            except Overloaded:
+                self._reply(503, {"error": "busy, retry later"})
+            except RequestTooLarge:
+                # The body is left unread, so don't reuse the connection
+                self.close_connection = True
+                self._reply(413, {"error": f"request body over {MAX_REQUEST_BYTES} bytes"})
+            except BundleLookupError:
+                self._reply(404, {"error": "no biometric data found"})
+            except (KeyError, ValueError) as e:
+                self._reply(400, {"error": str(e)})
+            except Exception as e:
+                self._reply(500, {"error": str(e)})
+
+        def address_string(self):
+            # Unix-socket peers have no (host, port)
+            return self.client_address[0] if self.client_address else "unix"
+
+    return Handler
+
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ["local", 0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SecureFace authentication service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix-socket", help="listen on a Unix socket instead of TCP")
+    args = parser.parse_args()
+
+    service = SecureFaceService(os.getenv("MY_ACCOUNT"), os.getenv("MY_PRIVATE_KEY"))
+    service.warm_up()
+    handler = make_handler(service)
+
+    if args.unix_socket:
+        if os.path.exists(args.unix_socket):
+            os.remove(args.unix_socket)
+        server = ThreadingUnixHTTPServer(args.unix_socket, handler)
+        print(f"🔹 Listening on unix:{args.unix_socket}")
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), handler)
+        print(f"🔹 Listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.engine.shutdown()
+
+
+if __name__ == "__main__":
+    main()
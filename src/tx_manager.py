@@ -0,0 +1,173 @@
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger("TxManager")
+
+GAS_PRICE_GWEI = os.getenv("GAS_PRICE_GWEI")
+GAS_MULTIPLIER = float(os.getenv("GAS_MULTIPLIER", "1.2"))
+TX_MAX_RETRIES = int(os.getenv("TX_MAX_RETRIES", "3"))
+TX_RECEIPT_TIMEOUT = float(os.getenv("TX_RECEIPT_TIMEOUT", "180"))
+TX_POLL_INTERVAL = float(os.getenv("TX_POLL_INTERVAL", "2"))
+# Replacement transactions must outbid the pending one by at least 10%
+_REPLACEMENT_BUMP = 1.125
+
+
+class TransactionFailed(Exception):
+    """A transaction reverted or could not be mined within its retries."""
+
+
+class _Job:
+    def __init__(self, contract_call, future):
+        self.contract_call = contract_call
+        self.future = future
+        self.nonce = None
+        self.gas = None
+        self.gas_price = None
+        self.tx_hashes = []
+        self.sent_at = None
+        self.attempts = 0
+
+
+class TransactionManager:
+    """Submits contract transactions for one account through a queue.
+
+    Nonces are handed out locally, so concurrent submissions from one
+    process never collide. A sender thread estimates gas, signs and sends
+    queued calls; a receipt thread polls pending transactions, resolves
+    their futures with the receipt, and re-sends with the same nonce and a
+    higher gas price when one is not mined in time.
+    """
+
+    def __init__(self, web3, account, private_key):
+        self.web3 = web3
+        self.account = account
+        self._private_key = private_key
+        self._nonce = None
+        self._nonce_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        threading.Thread(target=self._send_loop, name="tx-sender", daemon=True).start()
+        threading.Thread(target=self._receipt_loop, name="tx-receipts", daemon=True).start()
+
+    def submit(self, contract_call):
+        """Queues a prepared contract function call; returns a Future for its receipt."""
+        future = Future()
+        self._queue.put(_Job(contract_call, future))
+        return future
+
+    def _next_nonce(self):
+        with self._nonce_lock:
+            if self._nonce is None:
+                self._nonce = self.web3.eth.get_transaction_count(self.account, "pending")
+            nonce = self._nonce
+            self._nonce += 1
+            return nonce
+
+    def _resync_nonce(self):
+        with self._nonce_lock:
+            self._nonce = None
+
+    def _gas_price(self):
+        if GAS_PRICE_GWEI:
+            return self.web3.to_wei(GAS_PRICE_GWEI, 'gwei')
+        return self.web3.eth.gas_price
+
+    def _send(self, job):
+        tx = job.contract_call.build_transaction({
+            'from': self.account,
+            'nonce': job.nonce,
+            'gas': job.gas,
+            'gasPrice': job.gas_price,
+        })
+        signed_tx = self.web3.eth.account.sign_transaction(tx, self._private_key)
+        job.tx_hashes.append(self.web3.eth.send_raw_transaction(signed_tx.raw_transaction))
+        job.sent_at = time.monotonic()
+        job.attempts += 1
+
+    def _send_loop(self):
+        while True:
+            job = self._queue.get()
+            try:
+                # Estimating first also surfaces reverts before a nonce is spent
+                estimate = job.contract_call.estimate_gas({'from': self.account})
+                job.gas = int(estimate * GAS_MULTIPLIER)
+                job.gas_price = self._gas_price()
+                job.nonce = self._next_nonce()
+                try:
+                    self._send(job)
+                except Exception as e:
+                    if "nonce" not in str(e).lower():
+                        raise
+                    # Another client used our nonce; resync from the chain and retry once
+                    self._resync_nonce()
+                    job.nonce = self._next_nonce()
+                    self._send(job)
+            except Exception as e:
+                logger.error(f"❌ Transaction submission failed: {e}")
+                if job.nonce is not None and not job.tx_hashes:
+                    # The allocated nonce was never used; don't leave a gap
+                    self._resync_nonce()
+                job.future.set_exception(e)
+                continue
+            with self._pending_lock:
+                self._pending.append(job)
+
+    def _receipt_loop(self):
+        while True:
+            time.sleep(TX_POLL_INTERVAL)
+            with self._pending_lock:
+                pending = list(self._pending)
+            for job in pending:
+                try:
+                    self._check(job)
+                except Exception as e:
+                    logger.warning(f"⚠️ Receipt check failed, will retry: {e}")
+
+    def _check(self, job):
+        # Any earlier attempt may be the one that got mined
+        receipt = None
+        for tx_hash in job.tx_hashes:
+            try:
+                receipt = self.web3.eth.get_transaction_receipt(tx_hash)
+            except Exception:
+                continue
+            if receipt is not None:
+                break
+
+        if receipt is not None:
+            self._finish(job)
+            if receipt['status'] == 1:
+                job.future.set_result(receipt)
+            else:
+                job.future.set_exception(TransactionFailed(f"❌ Transaction {receipt['transactionHash'].hex()} reverted"))
+            return
+
+        if time.monotonic() - job.sent_at < TX_RECEIPT_TIMEOUT:
+            return
+        if job.attempts > TX_MAX_RETRIES:
+            self._finish(job)
+            # The node may have dropped the nonce; later sends must not leave a gap behind it
+            self._resync_nonce()
+            job.future.set_exception(TransactionFailed(
+                f"❌ Transaction with nonce {job.nonce} not mined after {job.attempts} attempts"))
+            return
+
+        # Same nonce, higher price: replaces the stuck transaction
+        job.gas_price = int(max(job.gas_price * _REPLACEMENT_BUMP, self._gas_price()))
+        try:
+            logger.warning(f"⚠️ Re-sending transaction with nonce {job.nonce}")
+            self._send(job)
+        except Exception as e:
+            # Usually "nonce too low": the earlier attempt got mined meanwhile
+            logger.warning(f"⚠️ Re-send failed, keeping previous attempt: {e}")
+            job.sent_at = time.monotonic()
+            job.attempts += 1
+
+    def _finish(self, job):
+        with self._pending_lock:
+            self._pending.remove(job)
@@ -0,0 +1,198 @@
+import logging
+import sqlite3
+import threading
+import time
+
+from web3 import Web3
+
+from cid_codec import decode_cid, uid_to_bytes32
+
+logger = logging.getLogger("UidIndex")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    block INTEGER NOT NULL,
+    log_index INTEGER NOT NULL,
+    uid_key BLOB NOT NULL,
+    cid TEXT,
+    PRIMARY KEY (block, log_index)
+);
+CREATE INDEX IF NOT EXISTS events_uid ON events (uid_key, block, log_index);
+CREATE TABLE IF NOT EXISTS blocks (number INTEGER PRIMARY KEY, hash BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+"""
+
+
+def uid_key(uid, compact=False):
+    """Topic under which the contract logs ``uid``.
+
+    BiometricStorage logs ``string indexed uid`` as its keccak hash;
+    BiometricStorageV2 logs the ``bytes32`` UID itself.
+    """
+    if compact:
+        return uid_to_bytes32(uid)
+    return bytes(Web3.keccak(text=uid))
+
+
+class UidIndex:
+    """Local uid→CID index built from the contract's event logs.
+
+    ``sync()`` backfills ``IPFSHashStored``/``Updated``/``Revoked`` logs in
+    block-range chunks up to the chain head, after first checking recent
+    block hashes and rolling back anything a reorg removed. The index is an
+    SQLite file, so later runs only fetch new blocks. ``lookup()`` answers
+    from the file only while the last sync is recent enough; otherwise the
+    caller should ask the contract. ``compact`` selects the
+    BiometricStorageV2 event layout.
+    """
+
+    def __init__(self, web3, contract, path, start_block=0, chunk_size=2000,
+                 reorg_depth=64, max_staleness=60, compact=False):
+        self.web3 = web3
+        self.contract = contract
+        self.compact = compact
+        self.start_block = start_block
+        self.chunk_size = chunk_size
+        self.reorg_depth = reorg_depth
+        self.max_staleness = max_staleness
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+        # Guards the shared connection; held only for SQLite work, never across an RPC
+        self._lock = threading.Lock()
+        # One sync at a time, without blocking lookups while it waits on the node
+        self._sync_lock = threading.Lock()
+        self._tail_thread = None
+        self._check_contract()
+
+    def _meta(self, key, default=None):
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, key, value):
+        # Callers hold the lock
+        self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def _check_contract(self):
+        # An index built for another deployment is useless; start over
+        address = self.contract.address
+        stored = self._meta("contract", address)
+        with self._lock:
+            if stored != address:
+                logger.warning("⚠️ Index belongs to another contract, rebuilding")
+                self._db.executescript("DELETE FROM events; DELETE FROM blocks; DELETE FROM meta;")
+            self._set_meta("contract", address)
+            self._db.commit()
+
+    @property
+    def synced_block(self):
+        return self._meta("synced_block", self.start_block - 1)
+
+    def _rollback_reorg(self):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT number, hash FROM blocks ORDER BY number DESC"
+            ).fetchall()
+        for number, block_hash in rows:
+            if bytes(self.web3.eth.get_block(number)["hash"]) == block_hash:
+                if number != rows[0][0]:
+                    logger.warning(f"⚠️ Chain reorg detected, rolling back to block {number}")
+                    self._truncate(number)
+                return
+        if rows:
+            logger.warning("⚠️ Reorg deeper than the tracked window, rebuilding index")
+            self._truncate(self.start_block - 1)
+
+    def _truncate(self, block):
+        with self._lock:
+            self._db.execute("DELETE FROM events WHERE block > ?", (block,))
+            self._db.execute("DELETE FROM blocks WHERE number > ?", (block,))
+            self._set_meta("synced_block", block)
+            self._db.commit()
+
+    def _cid(self, args, cid_arg):
+        if cid_arg is None:
+            return None
+        if self.compact:
+            return decode_cid(args["digest"], args["codec"])
+        return args[cid_arg]
+
+    def _fetch(self, from_block, to_block):
+        events = self.contract.events
+        found = []
+        for event, cid_arg in ((events.IPFSHashStored, "ipfsHash"),
+                               (events.IPFSHashUpdated, "newIpfsHash"),
+                               (events.IPFSHashRevoked, None)):
+            for log in event.get_logs(from_block=from_block, to_block=to_block):
+                cid = self._cid(log["args"], cid_arg)
+                found.append((log["blockNumber"], log["logIndex"], bytes(log["args"]["uid"]), cid))
+        return found
+
+    def _remember_block(self, number, block_hash):
+        # Callers hold the lock
+        self._db.execute("INSERT OR REPLACE INTO blocks (number, hash) VALUES (?, ?)", (number, block_hash))
+        self._db.execute(
+            "DELETE FROM blocks WHERE number NOT IN "
+            "(SELECT number FROM blocks ORDER BY number DESC LIMIT ?)",
+            (self.reorg_depth,),
+        )
+
+    def sync(self):
+        """Brings the index up to the chain head; returns the number of new events."""
+        with self._sync_lock:
+            self._rollback_reorg()
+            head = self.web3.eth.block_number
+            added = 0
+            start = self.synced_block + 1
+            while start <= head:
+                end = min(start + self.chunk_size - 1, head)
+                # RPC work happens outside the lock so lookups keep answering
+                events = self._fetch(start, end)
+                block_hash = bytes(self.web3.eth.get_block(end)["hash"])
+                with self._lock:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO events (block, log_index, uid_key, cid) VALUES (?, ?, ?, ?)",
+                        events,
+                    )
+                    self._remember_block(end, block_hash)
+                    self._set_meta("synced_block", end)
+                    # Commit per chunk so an interrupted backfill resumes where it stopped
+                    self._db.commit()
+                added += len(events)
+                start = end + 1
+            with self._lock:
+                self._set_meta("synced_at", time.time())
+                self._db.commit()
+            return added
+
+    def is_fresh(self):
+        synced_at = self._meta("synced_at")
+        return synced_at is not None and time.time() - synced_at <= self.max_staleness
+
+    def lookup(self, uid):
+        """Returns ``(known, cid)``; ``cid`` is ``None`` for a revoked uid."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT cid FROM events WHERE uid_key = ? ORDER BY block DESC, log_index DESC LIMIT 1",
+                (uid_key(uid, self.compact),),
+            ).fetchone()
+        if row is None:
+            return False, None
+        return True, row[0]
+
+    def start_tailing(self, interval=5.0):
+        """Keeps the index current from a daemon thread."""
+        if self._tail_thread is not None:
+            return self._tail_thread
+
+        def _tail():
+            while True:
+                try:
+                    self.sync()
+                except Exception as e:
+                    logger.warning(f"⚠️ Index sync failed, will retry: {e}")
+                time.sleep(interval)
+
+        self._tail_thread = threading.Thread(target=_tail, name="uid-index", daemon=True)
+        self._tail_thread.start()
+        return self._tail_thread
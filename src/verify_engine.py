@@ -0,0 +1,160 @@
+import logging
+import math
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+import encryption
+from encryption import compute_encrypted_distance, decrypt_distance, release_context
+
+logger = logging.getLogger("VerifyEngine")
+
+HE_WORKERS = int(os.getenv("HE_WORKERS", str(os.cpu_count() or 1)))
+# Each worker is one core's worth of HE; more SEAL threads would only oversubscribe
+HE_WORKER_THREADS = int(os.getenv("HE_WORKER_THREADS", "1"))
+
+
+def _init_worker(n_threads):
+    encryption.HE_THREADS = n_threads
+    # Workers only attach to segments the engine creates and unlinks. Before
+    # 3.13 attaching also registers them for cleanup, so a worker's tracker
+    # would unlink them again or warn about leaks when it exits
+    register = resource_tracker.register
+
+    def _register(name, rtype):
+        if rtype != "shared_memory":
+            register(name, rtype)
+
+    resource_tracker.register = _register
+
+
+def _verify_slice(shm_name, jobs):
+    """Runs in a worker: verifies jobs whose bytes live in a shared segment.
+
+    Each job is ``(bundle_offset, bundle_len, embedding_offset, embedding_len,
+    user_seed)``; embeddings are float64. Returns ``(distance, error)`` pairs.
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    buf = shm.buf
+    results = []
+    try:
+        for bundle_offset, bundle_len, emb_offset, emb_len, user_seed in jobs:
+            bundle = buf[bundle_offset:bundle_offset + bundle_len]
+            embedding = np.frombuffer(buf, np.float64, emb_len, emb_offset).copy()
+            try:
+                encrypted_distance, context, encoding = compute_encrypted_distance(bundle, embedding, user_seed)
+                try:
+                    results.append((float(decrypt_distance(encrypted_distance, context, encoding)), None))
+                finally:
+                    release_context(context)
+            except Exception as e:
+                results.append((None, f"{type(e).__name__}: {e}"))
+            finally:
+                bundle.release()
+    finally:
+        del buf
+        shm.close()
+    return results
+
+
+class VerificationEngine:
+    """Spreads encrypted-distance verifications across long-lived worker processes.
+
+    A batch is copied once into a shared-memory segment and split into a few
+    slices per worker, so only offsets and seeds are pickled. Workers keep
+    their own context cache, and SEAL runs ``n_threads`` threads in each so
+    that throughput scales with the number of workers rather than contending
+    for the same cores.
+    """
+
+    def __init__(self, workers=None, n_threads=None):
+        self.workers = workers or HE_WORKERS
+        self.n_threads = n_threads or HE_WORKER_THREADS
+        self.pool = ProcessPoolExecutor(
+            max_workers=self.workers, initializer=_init_worker, initargs=(self.n_threads,)
+        )
+
+    def warm_up(self):
+        """Starts every worker now so the first batch doesn't pay for it."""
+        list(self.pool.map(abs, range(self.workers)))
+
+    def submit(self, bundle, embedding, user_seed):
+        """Verifies one job; returns a Future for its distance."""
+        return self._submit_batch([(bundle, embedding, user_seed)], slices=1)[0]
+
+    def verify_many(self, jobs, slices=None):
+        """Verifies ``(bundle, embedding, user_seed)`` jobs in parallel.
+
+        Returns ``(distances, failures)``: distances aligned with ``jobs``
+        (``None`` where a job failed) and a dict of index → error message.
+        """
+        distances, failures = [], {}
+        futures = self._submit_batch(jobs, slices)
+        for index, future in enumerate(futures):
+            try:
+                distances.append(future.result())
+            except Exception as e:
+                distances.append(None)
+                failures[index] = str(e)
+        return distances, failures
+
+    def _submit_batch(self, jobs, slices=None):
+        if not jobs:
+            return []
+        embeddings = [np.ascontiguousarray(embedding, np.float64) for _, embedding, _ in jobs]
+        size = sum(len(bundle) + embedding.nbytes for (bundle, _, _), embedding in zip(jobs, embeddings))
+        shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+
+        layout, offset = [], 0
+        for (bundle, _, user_seed), embedding in zip(jobs, embeddings):
+            bundle_len = len(bundle)
+            shm.buf[offset:offset + bundle_len] = bundle
+            emb_offset = offset + bundle_len
+            shm.buf[emb_offset:emb_offset + embedding.nbytes] = embedding.tobytes()
+            layout.append((offset, bundle_len, emb_offset, embedding.size, user_seed))
+            offset = emb_offset + embedding.nbytes
+
+        # A few slices per worker keeps them busy when job costs differ
+        slices = slices or self.workers * 4
+        step = max(1, math.ceil(len(layout) / slices))
+        chunks = [layout[i:i + step] for i in range(0, len(layout), step)]
+        chunk_futures = [self.pool.submit(_verify_slice, shm.name, chunk) for chunk in chunks]
+
+        pending = [len(chunk_futures)]
+        pending_lock = threading.Lock()
+
+        def _resolve(chunk_future, job_futures):
+            try:
+                results = chunk_future.result()
+            except Exception as e:
+                # The worker itself died; every job in the slice fails
+                results = [(None, f"{type(e).__name__}: {e}")] * len(job_futures)
+            for job_future, (distance, error) in zip(job_futures, results):
+                if error is None:
+                    job_future.set_result(distance)
+                else:
+                    job_future.set_exception(RuntimeError(error))
+            with pending_lock:
+                pending[0] -= 1
+                last = pending[0] == 0
+            if last:
+                # Every slice is done, so no worker is still mapping the segment
+                shm.close()
+                shm.unlink()
+
+        futures = []
+        for chunk, chunk_future in zip(chunks, chunk_futures):
+            job_futures = [Future() for _ in chunk]
+            chunk_future.add_done_callback(lambda f, jf=job_futures: _resolve(f, jf))
+            futures.extend(job_futures)
+        return futures
+
+    def run(self, fn, *args):
+        """Runs other HE work (e.g. bundle creation) on the same workers."""
+        return self.pool.submit(fn, *args)
+
+    def shutdown(self):
+        self.pool.shutdown()
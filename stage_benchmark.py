@@ -0,0 +1,358 @@
+"""Times every stage of registration and authentication separately.
+
+IPFS and the chain are replaced by in-process stand-ins: a small HTTP
+server speaking the IPFS add/gateway API, and an eth-tester chain with the
+contract deployed from the Truffle build (``truffle compile`` first, and
+eth-tester from requirements-dev.txt; chain stages are skipped without
+them). Face stages need ``--image``; without it a
+synthetic embedding feeds the later stages.
+
+    python stage_benchmark.py --image face.jpg --output baseline.json
+    python stage_benchmark.py --image face.jpg --compare baseline.json --tolerance 0.15
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import platform
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import base58
+import numpy as np
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "src")
+BUILD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "build", "contracts")
+sys.path.insert(0, SRC_DIR)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("StageBenchmark")
+
+USER_SEED = "123456"
+
+
+# ==================== IN-PROCESS STAND-INS ====================
+class _IPFSStandIn(BaseHTTPRequestHandler):
+    """Answers /api/v0/id, /api/v0/add and gateway GETs from a dict."""
+    blocks = {}
+
+    def _reply(self, status, body, content_type="application/octet-stream"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.startswith("/api/v0/id"):
+            self._reply(200, b"{}", "application/json")
+            return
+        # Single-file multipart body: payload sits between the part headers and the closing boundary
+        boundary = self.headers["Content-Type"].split("boundary=")[1].encode()
+        data = body.split(b"\r\n\r\n", 1)[1].rsplit(b"\r\n--" + boundary, 1)[0]
+        # CIDv0-shaped sha2-256 multihash; not a real dag-pb CID but stable per content
+        cid = base58.b58encode(b"\x12\x20" + hashlib.sha256(data).digest()).decode()
+        if "only-hash=true" not in self.path:
+            self.blocks[cid] = data
+        self._reply(200, json.dumps({"Hash": cid}).encode(), "application/json")
+
+    def do_GET(self):
+        data = self.blocks.get(self.path.rsplit("/", 1)[-1])
+        if data is None:
+            self._reply(404, b"not found")
+        else:
+            self._reply(200, data)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_ipfs_stand_in():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _IPFSStandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    os.environ["IPFS_API_URL"] = f"{base}/api/v0"
+    os.environ["IPFS_GATEWAY_URL"] = f"{base}/ipfs"
+    # Measure the fetch itself, not the local cache
+    os.environ["IPFS_CACHE"] = "0"
+    return server
+
+
+def start_chain_stand_in():
+    """Deploys the configured contract on eth-tester; returns ``(account, key)`` or ``None``."""
+    import blockchain_interaction
+    from lazy import LazySingleton
+    from web3 import EthereumTesterProvider, Web3
+
+    name = "BiometricStorageV2" if blockchain_interaction.CONTRACT_VERSION == "2" else "BiometricStorage"
+    try:
+        with open(os.path.join(BUILD_DIR, f"{name}.json")) as f:
+            build = json.load(f)
+    except FileNotFoundError:
+        return None
+
+    provider = EthereumTesterProvider()
+    web3 = Web3(provider)
+    account = web3.eth.accounts[0]
+    factory = web3.eth.contract(abi=build["abi"], bytecode=build["bytecode"])
+    receipt = web3.eth.wait_for_transaction_receipt(factory.constructor().transact({"from": account}))
+    contract = web3.eth.contract(address=receipt["contractAddress"], abi=build["abi"])
+    blockchain_interaction._chain = LazySingleton("web3", lambda: (web3, contract, {}))
+    private_key = provider.ethereum_tester.backend.account_keys[0].to_hex()
+    return account, private_key
+
+
+# ==================== MEASUREMENT ====================
+class StageTimer:
+    def __init__(self, warmup, repeat):
+        self.warmup = warmup
+        self.repeat = repeat
+        self.stages = {}
+        self.skipped = {}
+
+    def measure(self, name, fn):
+        """Times ``fn`` after warmup runs; returns its last result, or ``None`` if it failed."""
+        try:
+            for _ in range(self.warmup):
+                fn()
+            samples = []
+            for _ in range(self.repeat):
+                start = time.perf_counter()
+                result = fn()
+                samples.append(time.perf_counter() - start)
+            # One separate traced run: tracemalloc slows the timed ones down
+            tracemalloc.start()
+            fn()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        except Exception as e:
+            tracemalloc.stop()
+            logger.warning(f"⚠️ {name} skipped: {e}")
+            self.skipped[name] = str(e)
+            return None
+
+        ms = np.array(samples) * 1000
+        self.stages[name] = {
+            "mean_ms": float(ms.mean()),
+            "min_ms": float(ms.min()),
+            "p50_ms": float(np.percentile(ms, 50)),
+            "p90_ms": float(np.percentile(ms, 90)),
+            "p99_ms": float(np.percentile(ms, 99)),
+            "py_peak_kb": peak / 1024,
+        }
+        logger.info(f"{name:<28} p50 {self.stages[name]['p50_ms']:>9.2f} ms")
+        return result
+
+    def skip(self, name, reason):
+        self.skipped[name] = reason
+
+
+def _peak_rss_kb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS, kilobytes elsewhere
+    return rss / 1024 if sys.platform == "darwin" else rss
+
+
+def run_benchmarks(image_path, warmup, repeat):
+    start_ipfs_stand_in()
+    os.environ.setdefault("TX_POLL_INTERVAL", "0.05")
+    # Imported only now so the modules pick up the stand-in endpoints
+    import cv2
+    import tenseal as ts
+    import torch
+    import encryption
+    from blockchain_interaction import get_ipfs_hash, store_ipfs_hash
+    from bundle_format import SECTION_CONTEXT, SECTION_EMBEDDING, encode_bundle, open_bundle
+    from face_processing import device, get_facenet, get_mtcnn
+    from ipfs_handler import IPFSHandler
+
+    timer = StageTimer(warmup, repeat)
+    sizes = {}
+
+    # ---- registration ----
+    embedding = None
+    if image_path:
+        with open(image_path, "rb") as f:
+            encoded_image = np.frombuffer(f.read(), np.uint8)
+        frame = timer.measure("register/image_decode", lambda: cv2.imdecode(encoded_image, cv2.IMREAD_COLOR))
+        face = None
+        if frame is not None:
+            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            face = timer.measure("register/mtcnn", lambda: get_mtcnn()(rgb))
+        if face is not None:
+            def _facenet():
+                with torch.no_grad():
+                    return get_facenet()(face.unsqueeze(0).to(device)).cpu().numpy().flatten()
+            embedding = timer.measure("register/facenet", _facenet)
+        else:
+            timer.skip("register/facenet", "no face detected")
+    else:
+        for name in ("register/image_decode", "register/mtcnn", "register/facenet"):
+            timer.skip(name, "no --image given")
+    if embedding is None:
+        logger.warning("⚠️ Using a synthetic embedding for the remaining stages")
+        embedding = np.random.default_rng(0).standard_normal(encryption.EMBEDDING_SIZE).astype(np.float32)
+        embedding /= np.linalg.norm(embedding)
+
+    seed_hash = encryption.hash_seed(USER_SEED)
+    galois_keys = encryption.DISTANCE_MODE == "rotate"
+    timer.measure("register/projection_matrix",
+                  lambda: encryption.generate_projection_matrix(seed_hash))
+    projected = timer.measure("register/projection",
+                              lambda: encryption.apply_user_specific_projection(embedding, USER_SEED))
+    encoding = encryption.TemplateEncoding(encryption.PROJECTION_MODE, dim=encryption.TEMPLATE_DIM)
+    scaled = encoding.encode(projected)
+
+    context = timer.measure("register/he_keygen", lambda: encryption._generate_context(
+        encryption.POLY_DEGREE, encryption.PRIME_MODULUS, galois_keys))
+    encrypted = timer.measure("register/he_encrypt", lambda: ts.bfv_vector(context, scaled))
+    serialized_embedding = timer.measure("register/ciphertext_serialize", encrypted.serialize)
+    serialized_context = timer.measure("register/context_serialize",
+                                       lambda: encryption.serialize_context_with_secret(context))
+    encrypted_context = timer.measure("register/aes_encrypt",
+                                      lambda: encryption.aes_encrypt(seed_hash, serialized_context))
+    bundle = timer.measure("register/bundle_encode", lambda: encode_bundle(
+        [(SECTION_CONTEXT, encrypted_context), (SECTION_EMBEDDING, serialized_embedding)],
+        encryption.POLY_DEGREE, encryption.PRIME_MODULUS, encryption.BASE_THRESHOLD,
+        projection=encryption.PROJECTION_MODE, distance_mode=encryption.DISTANCE_MODE,
+        metadata=encoding.metadata(), compress=encryption.BUNDLE_COMPRESSION))
+    sizes.update({
+        "serialized_context": len(serialized_context),
+        "encrypted_context": len(encrypted_context),
+        "embedding_ciphertext": len(serialized_embedding),
+        "bundle": len(bundle),
+    })
+
+    ipfs = IPFSHandler()
+    with redirect_stdout(open(os.devnull, "w")):
+        ipfs_hash = timer.measure("register/ipfs_put", lambda: ipfs.upload_encrypted_bundle(bundle))
+
+        try:
+            chain = start_chain_stand_in()
+            skip_reason = "no contract build in build/contracts"
+        except ImportError as e:
+            chain = None
+            skip_reason = f"{e.name or 'eth-tester'} not installed (pip install -r requirements-dev.txt)"
+        uid = hashlib.sha256(b"stage-benchmark").hexdigest()
+        if chain is None:
+            for name in ("register/chain_store", "auth/chain_lookup"):
+                timer.skip(name, skip_reason)
+        else:
+            account, private_key = chain
+            counter = iter(range(10 ** 9))
+            timer.measure("register/chain_store", lambda: store_ipfs_hash(
+                f"{uid}-{next(counter)}", ipfs_hash, account, private_key).result())
+            store_ipfs_hash(uid, ipfs_hash, account, private_key).result()
+            timer.measure("auth/chain_lookup", lambda: get_ipfs_hash(uid))
+
+        # ---- authentication ----
+        fetched = timer.measure("auth/ipfs_get", lambda: ipfs.retrieve_encrypted_bundle(ipfs_hash))
+    fetched = fetched if fetched is not None else bundle
+
+    def _open():
+        view = open_bundle(fetched)
+        return view.section(SECTION_CONTEXT), view.section(SECTION_EMBEDDING)
+
+    context_section, embedding_section = timer.measure("auth/bundle_open", _open)
+    decrypted_context = timer.measure("auth/aes_decrypt",
+                                      lambda: encryption.aes_decrypt(seed_hash, context_section))
+    context = timer.measure("auth/context_deserialize", lambda: encryption.load_context(decrypted_context))
+    stored = timer.measure("auth/ciphertext_deserialize",
+                           lambda: ts.bfv_vector_from(context, bytes(embedding_section)))
+    probe = timer.measure("auth/he_encrypt", lambda: ts.bfv_vector(context, scaled))
+
+    def _compute():
+        diff = stored - probe
+        squared = diff * diff
+        return squared.sum() if galois_keys else squared
+
+    encrypted_distance = timer.measure("auth/he_compute", _compute)
+    timer.measure("auth/he_decrypt", lambda: encryption.decrypt_distance(encrypted_distance, context, encoding))
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "tenseal": ts.__version__,
+            "poly_degree": encryption.POLY_DEGREE,
+            "plain_modulus": encryption.PRIME_MODULUS,
+            "distance_mode": encryption.DISTANCE_MODE,
+            "projection": encryption.PROJECTION_MODE,
+            "warmup": warmup,
+            "repeat": repeat,
+        },
+        "stages": timer.stages,
+        "skipped": timer.skipped,
+        "bundle_bytes": sizes,
+        "peak_rss_kb": _peak_rss_kb(),
+    }
+
+
+# ==================== REGRESSION CHECK ====================
+def compare(current, baseline, tolerance, min_delta_ms):
+    """Prints stage-by-stage changes; returns the names of regressed stages and sizes."""
+    regressions = []
+    print(f"\n📊 {'Stage':<28} | {'Baseline p50':>12} | {'Current p50':>12} | Change")
+    for name, base in baseline["stages"].items():
+        stats = current["stages"].get(name)
+        if stats is None:
+            print(f"{name:<31} | {base['p50_ms']:>12.2f} | {'skipped':>12} |")
+            continue
+        change = stats["p50_ms"] / base["p50_ms"] - 1 if base["p50_ms"] else 0.0
+        # Sub-millisecond stages jitter by more than any sensible tolerance
+        regressed = change > tolerance and stats["p50_ms"] - base["p50_ms"] > min_delta_ms
+        marker = "  ❌" if regressed else ""
+        print(f"{name:<31} | {base['p50_ms']:>12.2f} | {stats['p50_ms']:>12.2f} | {100 * change:>+6.1f}%{marker}")
+        if regressed:
+            regressions.append(name)
+
+    for name, base_size in baseline.get("bundle_bytes", {}).items():
+        size = current["bundle_bytes"].get(name)
+        if size is not None and base_size and size / base_size - 1 > tolerance:
+            print(f"❌ {name} grew from {base_size} to {size} bytes")
+            regressions.append(f"bundle_bytes/{name}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--image", help="face image for the decode/MTCNN/FaceNet stages")
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", help="write results as JSON to this file (default: stdout)")
+    parser.add_argument("--compare", help="baseline JSON from an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p50 slowdown, e.g. 0.2 = 20%%")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="ignore slowdowns smaller than this")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.image, args.warmup, args.repeat)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Results written to {args.output}")
+    elif not args.compare:
+        print(json.dumps(results, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance, args.min_delta_ms)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regression(s) beyond {100 * args.tolerance:.0f}%: {', '.join(regressions)}")
+            sys.exit(1)
+        print("\n✅ No stage regressed beyond tolerance")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+const BiometricStorage = artifacts.require("BiometricStorage");
+const BiometricStorageV2 = artifacts.require("BiometricStorageV2");
+
+const CODEC_V0 = 1;
+
+async function assertReverts(promise, reason) {
+  try {
+    await promise;
+  } catch (error) {
+    assert.include(error.message, reason);
+    return;
+  }
+  assert.fail(`expected a revert with "${reason}"`);
+}
+
+contract("BiometricStorageV2", (accounts) => {
+  // generate_uid is a SHA-256 hex digest; v2 stores it as bytes32
+  const uid = "9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08";
+  const uidBytes = "0x" + uid;
+  const digest = web3.utils.sha3("bundle");
+
+  it("marks a UID known on store and keeps it known after revoke", async () => {
+    const v2 = await BiometricStorageV2.new();
+    assert.isFalse(await v2.known(uidBytes));
+
+    await v2.storeIPFSHash(uidBytes, digest, CODEC_V0);
+    assert.isTrue(await v2.known(uidBytes));
+
+    await v2.revokeIPFSHash(uidBytes);
+    await assertReverts(v2.getIPFSHash(uidBytes), "No IPFS hash found");
+    assert.isTrue(await v2.known(uidBytes));
+  });
+
+  it("revoke after migrate leaves nothing for the v1 fallback to resolve", async () => {
+    const v1 = await BiometricStorage.new();
+    const v2 = await BiometricStorageV2.new();
+    await v1.storeIPFSHash(uid, "QmYwAPJzv5CZsnA625s3Xf2nemtYgPpHdWEz79ojWnPbdG");
+
+    // migrate_to_v2: copy the record into v2
+    await v2.storeIPFSHashBatch([uidBytes], [digest], [CODEC_V0]);
+    await v2.revokeIPFSHash(uidBytes);
+
+    // The v1 entry is still there, but v2 reports the UID as known, so the
+    // client's fallback (only for UIDs v2 never held) must not read it
+    await assertReverts(v2.getIPFSHash(uidBytes), "No IPFS hash found");
+    assert.isTrue(await v2.known(uidBytes));
+    assert.equal(await v1.getIPFSHash(uid), "QmYwAPJzv5CZsnA625s3Xf2nemtYgPpHdWEz79ojWnPbdG");
+  });
+
+  it("leaves unmigrated UIDs unknown so they can still fall back to v1", async () => {
+    const v2 = await BiometricStorageV2.new();
+    await assertReverts(v2.getIPFSHash(uidBytes), "No IPFS hash found");
+    assert.isFalse(await v2.known(uidBytes));
+  });
+});